@@ -0,0 +1,168 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark command line.
+
+Run from the repository root:
+
+    python -m benchmarks run -o baseline.json
+    python -m benchmarks compare baseline.json
+    python -m benchmarks --distribution skewed generate --choices 5 --criteria 8
+"""
+
+import argparse
+import json
+import sys
+from typing import List
+
+from quandary.utility import critical_error
+
+from .generator import DISTRIBUTIONS, DEFAULT_DISTRIBUTION, generate_quandary, quandary_yaml
+from .suite import Measurement, run_benchmarks, baseline_data, measurements_from_baseline, \
+    compare_measurements, DEFAULT_DURATION, DEFAULT_THRESHOLD_PERCENTAGE
+
+
+def _load_measurements(path: str) -> List[Measurement]:
+    try:
+        with open(path, encoding='utf-8') as stream:
+            return measurements_from_baseline(json.load(stream))
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        critical_error(f'Failed to load baseline file: {path}: {exc}')
+
+
+def _save_measurements(path: str, measurements: List[Measurement]):
+    try:
+        with open(path, 'w', encoding='utf-8') as stream:
+            json.dump(baseline_data(measurements), stream, indent=2)
+            stream.write('\n')
+    except OSError as exc:
+        critical_error(f'Failed to save baseline file: {path}: {exc}')
+
+
+def _run_measurements(args: argparse.Namespace) -> List[Measurement]:
+    measurements = run_benchmarks(args.DURATION, args.DISTRIBUTION)
+    for measurement in measurements:
+        print(f'{measurement.name:<24} {measurement.rate:>14,.1f} {measurement.unit}')
+    return measurements
+
+
+def _run(args: argparse.Namespace) -> int:
+    measurements = _run_measurements(args)
+    if args.OUTPUT:
+        _save_measurements(args.OUTPUT, measurements)
+    return 0
+
+
+def _compare(args: argparse.Namespace) -> int:
+    baseline = _load_measurements(args.BASELINE)
+    if args.CURRENT:
+        current = _load_measurements(args.CURRENT)
+    else:
+        current = _run_measurements(args)
+        print('')
+    comparisons = compare_measurements(baseline, current, args.THRESHOLD)
+    slowdown_count = 0
+    for comparison in comparisons:
+        flag = 'SLOWER' if comparison.slowdown else ''
+        print(f'{comparison.name:<24} {comparison.baseline_rate:>14,.1f}'
+              f' {comparison.current_rate:>14,.1f} {comparison.unit:<9}'
+              f' {comparison.change_percentage:+7.1f}% {flag}')
+        if comparison.slowdown:
+            slowdown_count += 1
+    if slowdown_count:
+        print(f'{slowdown_count} benchmark(s) slower than the baseline by more than'
+              f' {args.THRESHOLD}%.')
+    return 1 if slowdown_count else 0
+
+
+def _generate(args: argparse.Namespace) -> int:
+    quandary = generate_quandary(args.CHOICES, args.CRITERIA, args.DISTRIBUTION, args.SEED)
+    try:
+        sys.stdout.write(quandary_yaml(quandary))
+    except ValueError as exc:
+        critical_error(str(exc))
+    return 0
+
+
+def main():
+    """Benchmark main function parses the command line and runs a command."""
+    parser = argparse.ArgumentParser(description='Quandary benchmarks')
+    parser.add_argument(
+        '--duration',
+        dest='DURATION',
+        type=float,
+        default=DEFAULT_DURATION,
+        help=f'minimum seconds per benchmark (default: {DEFAULT_DURATION})')
+    parser.add_argument(
+        '--distribution',
+        dest='DISTRIBUTION',
+        choices=sorted(DISTRIBUTIONS),
+        default=DEFAULT_DISTRIBUTION,
+        help=f'synthetic rating distribution (default: {DEFAULT_DISTRIBUTION})')
+    subparsers = parser.add_subparsers(dest='COMMAND', required=True)
+    run_parser = subparsers.add_parser('run', help='run benchmarks')
+    run_parser.add_argument(
+        '-o', '--output',
+        dest='OUTPUT',
+        help='JSON baseline file to save')
+    run_parser.set_defaults(FUNCTION=_run)
+    compare_parser = subparsers.add_parser(
+        'compare', help='compare against a baseline, and fail if slower')
+    compare_parser.add_argument(
+        dest='BASELINE',
+        help='JSON baseline file')
+    compare_parser.add_argument(
+        dest='CURRENT',
+        nargs='?',
+        help='JSON results file to compare (default: run benchmarks now)')
+    compare_parser.add_argument(
+        '--threshold',
+        dest='THRESHOLD',
+        type=float,
+        default=DEFAULT_THRESHOLD_PERCENTAGE,
+        help=f'rate decrease %% flagged as a slowdown'
+             f' (default: {DEFAULT_THRESHOLD_PERCENTAGE}%%)')
+    compare_parser.set_defaults(FUNCTION=_compare)
+    generate_parser = subparsers.add_parser(
+        'generate', help='write a synthetic YAML quandary to standard output')
+    generate_parser.add_argument(
+        '--choices',
+        dest='CHOICES',
+        type=int,
+        default=10,
+        help='number of choices (default: 10, maximum: 26)')
+    generate_parser.add_argument(
+        '--criteria',
+        dest='CRITERIA',
+        type=int,
+        default=10,
+        help='number of criteria (default: 10, maximum: 26)')
+    generate_parser.add_argument(
+        '--seed',
+        dest='SEED',
+        type=int,
+        default=0,
+        help='random seed (default: 0)')
+    generate_parser.set_defaults(FUNCTION=_generate)
+    args = parser.parse_args()
+    sys.exit(args.FUNCTION(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Synthetic quandary generator for benchmarks."""
+
+import random
+import string
+from typing import Callable, Dict, List
+
+from quandary.data import Quandary, Criterion, GenericRatings
+
+# Rating value generators, by distribution name.
+DISTRIBUTIONS: Dict[str, Callable[[random.Random], float]] = {
+    'uniform': lambda rng: rng.random(),
+    'clustered': lambda rng: min(max(rng.gauss(0.5, 0.1), 0.0), 1.0),
+    'skewed': lambda rng: rng.random() ** 3,
+}
+DEFAULT_DISTRIBUTION = 'uniform'
+YAML_RATINGS_BAR_WIDTH = 51
+
+
+def _identifiers(count: int) -> List[str]:
+    # Letters as long as they suffice, like configuration files, then numbers.
+    if count <= len(string.ascii_uppercase):
+        return list(string.ascii_uppercase[:count])
+    return [f'{number:04d}' for number in range(1, count + 1)]
+
+
+def generate_quandary(choice_count: int,
+                      criterion_count: int,
+                      distribution: str = DEFAULT_DISTRIBUTION,
+                      seed: int = 0,
+                      unrated_fraction: float = 0.0,
+                      ) -> Quandary:
+    """
+    Generate a random quandary in memory.
+
+    :param choice_count: number of choices
+    :param criterion_count: number of criteria
+    :param distribution: rating distribution name (see DISTRIBUTIONS)
+    :param seed: random seed, the same seed produces the same quandary
+    :param unrated_fraction: fraction of choice ratings left out
+    :return: generated quandary
+    """
+    rng = random.Random(seed)
+    generate_rating = DISTRIBUTIONS[distribution]
+    choice_letters = _identifiers(choice_count)
+    criterion_letters = _identifiers(criterion_count)
+    choices = {letter: f'Choice {letter}' for letter in choice_letters}
+    criteria = {}
+    for letter in criterion_letters:
+        choice_ratings = {choice_letter: generate_rating(rng)
+                          for choice_letter in choice_letters
+                          if rng.random() >= unrated_fraction}
+        criteria[letter] = Criterion(f'Criterion {letter}', choice_ratings)
+    priority_ratings = {letter: generate_rating(rng) for letter in criterion_letters}
+    return Quandary(f'Synthetic {choice_count}x{criterion_count} {distribution} quandary',
+                    choices,
+                    criteria,
+                    priority_ratings)
+
+
+def _ratings_bar(ratings: GenericRatings) -> str:
+    # Letters go to the nearest free position, since each position holds one.
+    positions = ['_'] * YAML_RATINGS_BAR_WIDTH
+    for letter, rating in ratings.items():
+        target = round(rating * (YAML_RATINGS_BAR_WIDTH - 1))
+        position = min((pos for pos in range(YAML_RATINGS_BAR_WIDTH) if positions[pos] == '_'),
+                       key=lambda pos: abs(pos - target))
+        positions[position] = letter
+    return ''.join(positions)
+
+
+def quandary_yaml(quandary: Quandary) -> str:
+    """
+    Format quandary as a YAML configuration.
+
+    Ratings are rounded to ratings bar positions.
+
+    :param quandary: quandary with single letter choices and criteria, and no unrated choices
+    :return: YAML configuration text
+    """
+    if len(quandary.choices) > len(string.ascii_uppercase) \
+            or len(quandary.criteria) > len(string.ascii_uppercase):
+        raise ValueError('YAML quandaries are limited to 26 choices and criteria.')
+    if any(len(criterion.choice_ratings) != len(quandary.choices)
+           for criterion in quandary.criteria.values()):
+        raise ValueError('YAML quandaries must rate every choice for every criterion.')
+    lines = ['quandary:',
+             f'  description: {quandary.description}',
+             '',
+             'choices:']
+    for letter, label in quandary.choices.items():
+        lines.extend([f'  {letter}:',
+                      f'    name: {label}'])
+    lines.extend(['', 'criteria:'])
+    for letter, criterion in quandary.criteria.items():
+        lines.extend([f'  {letter}:',
+                      f'    name: {criterion.label}',
+                      f'    ratings: {_ratings_bar(criterion.choice_ratings)}'])
+    lines.extend(['',
+                  'priorities:',
+                  f'  ratings: {_ratings_bar(quandary.priority_ratings)}'])
+    return '\n'.join(lines) + '\n'
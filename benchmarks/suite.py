@@ -0,0 +1,212 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Benchmark measurements, and comparison against baselines."""
+
+import os
+import platform
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Any
+
+from quandary.analysis import resolve_quandary, run_stability_analysis
+from quandary.configuration import parse_configuration_file
+from quandary.data import Quandary
+from quandary.vectorized import numpy_available
+
+from .generator import generate_quandary, quandary_yaml
+
+# Benchmark quandary sizes, as (choice count, criterion count) pairs.
+SIZES = {
+    'small': (3, 10),
+    'medium': (10, 10),
+    'large': (26, 26),
+}
+DEFAULT_DURATION = 1.0
+MEASUREMENT_ROUNDS = 5
+DEFAULT_THRESHOLD_PERCENTAGE = 10.0
+STABILITY_RANDOM_STEPS = 20
+STABILITY_RANDOM_TRIALS = 200
+PARSE_FILE_COUNT = 20
+BASELINE_FORMAT_VERSION = 1
+
+
+@dataclass
+class Measurement:
+    """Benchmark result, as a rate where higher is better."""
+    name: str
+    rate: float
+    unit: str
+
+
+def _measure(function: Callable[[], int], duration: float) -> float:
+    # Repeats the function for at least the duration, split into rounds, and
+    # keeps the best round's rate to reduce noise. The function returns the
+    # number of units (runs, trials, files) that it processed.
+    best_rate = 0.0
+    for _round in range(MEASUREMENT_ROUNDS):
+        unit_count = 0
+        start_time = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < duration / MEASUREMENT_ROUNDS:
+            unit_count += function()
+            elapsed = time.perf_counter() - start_time
+        best_rate = max(best_rate, unit_count / elapsed)
+    return best_rate
+
+
+def _resolve(quandary: Quandary) -> Callable[[], int]:
+    def _run() -> int:
+        resolve_quandary(quandary)
+        return 1
+    return _run
+
+
+def _stability(quandary: Quandary, engine: str) -> Callable[[], int]:
+    results = resolve_quandary(quandary)
+
+    def _run() -> int:
+        # A 1% stability percentage runs (nearly) all steps, and random trials
+        # are forced, for consistent work per run.
+        stability_results = run_stability_analysis(quandary,
+                                                   results,
+                                                   random_steps=STABILITY_RANDOM_STEPS,
+                                                   random_trials=STABILITY_RANDOM_TRIALS,
+                                                   stability_percentage=1,
+                                                   engine=engine,
+                                                   seed=0,
+                                                   exact_limit=0)
+        return sum(step.trial_count for step in stability_results.steps)
+    return _run
+
+
+def _parse(paths: List[str]) -> Callable[[], int]:
+    def _run() -> int:
+        for path in paths:
+            parse_configuration_file(path)
+        return len(paths)
+    return _run
+
+
+def run_benchmarks(duration: float = DEFAULT_DURATION,
+                   distribution: str = 'uniform',
+                   ) -> List[Measurement]:
+    """
+    Run all benchmarks.
+
+    :param duration: minimum seconds per benchmark
+    :param distribution: synthetic rating distribution name
+    :return: measurements
+    """
+    engines = ['python', 'numpy'] if numpy_available() else ['python']
+    measurements: List[Measurement] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size_name, (choice_count, criterion_count) in SIZES.items():
+            quandary = generate_quandary(choice_count, criterion_count, distribution)
+            measurements.append(Measurement(f'resolve/{size_name}',
+                                            _measure(_resolve(quandary), duration),
+                                            'runs/s'))
+            for engine in engines:
+                measurements.append(Measurement(f'stability/{engine}/{size_name}',
+                                                _measure(_stability(quandary, engine), duration),
+                                                'trials/s'))
+            paths: List[str] = []
+            for seed in range(PARSE_FILE_COUNT):
+                path = os.path.join(directory, f'{size_name}-{seed}.yaml')
+                with open(path, 'w', encoding='utf-8') as stream:
+                    stream.write(quandary_yaml(generate_quandary(choice_count,
+                                                                 criterion_count,
+                                                                 distribution,
+                                                                 seed=seed)))
+                paths.append(path)
+            measurements.append(Measurement(f'parse/{size_name}',
+                                            _measure(_parse(paths), duration),
+                                            'files/s'))
+    return measurements
+
+
+def baseline_data(measurements: List[Measurement]) -> Dict[str, Any]:
+    """
+    Convert measurements to JSON baseline data.
+
+    :param measurements: measurements
+    :return: JSON-compatible baseline data
+    """
+    return {
+        'version': BASELINE_FORMAT_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'numpy': numpy_available(),
+        'measurements': {measurement.name: {'rate': measurement.rate, 'unit': measurement.unit}
+                         for measurement in measurements},
+    }
+
+
+def measurements_from_baseline(data: Dict[str, Any]) -> List[Measurement]:
+    """
+    Convert JSON baseline data to measurements.
+
+    :param data: baseline data
+    :return: measurements
+    """
+    if data.get('version') != BASELINE_FORMAT_VERSION:
+        raise ValueError(f'Unsupported baseline version: {data.get("version")}')
+    return [Measurement(name, values['rate'], values['unit'])
+            for name, values in data['measurements'].items()]
+
+
+@dataclass
+class Comparison:
+    """Benchmark comparison against a baseline measurement."""
+    name: str
+    baseline_rate: float
+    current_rate: float
+    unit: str
+    slowdown: bool
+
+    @property
+    def change_percentage(self) -> float:
+        return (self.current_rate / self.baseline_rate - 1) * 100
+
+
+def compare_measurements(baseline: List[Measurement],
+                         current: List[Measurement],
+                         threshold_percentage: float = DEFAULT_THRESHOLD_PERCENTAGE,
+                         ) -> List[Comparison]:
+    """
+    Compare measurements against baseline measurements with the same names.
+
+    :param baseline: baseline measurements
+    :param current: current measurements
+    :param threshold_percentage: rate decrease % flagged as a slowdown
+    :return: comparisons
+    """
+    baseline_by_name = {measurement.name: measurement for measurement in baseline}
+    comparisons: List[Comparison] = []
+    for measurement in current:
+        baseline_measurement = baseline_by_name.get(measurement.name)
+        if baseline_measurement is None or baseline_measurement.rate <= 0:
+            continue
+        minimum_rate = baseline_measurement.rate * (1 - threshold_percentage / 100)
+        comparisons.append(Comparison(measurement.name,
+                                      baseline_measurement.rate,
+                                      measurement.rate,
+                                      measurement.unit,
+                                      measurement.rate < minimum_rate))
+    return comparisons
@@ -17,48 +17,695 @@
 
 """Quandary analysis."""
 
+import math
+import operator
+import os
 import random
-from typing import List, Set, Iterable, Optional
+import threading
+import time
+from array import array
+from typing import List, Set, Iterable, Optional, Dict, Tuple, Iterator, AsyncIterator
 
-from .data import Quandary, Results, GenericLetter, CriteriaMap, Criterion, \
-    ChoiceRatings, ChoiceResult, GenericRatings, PriorityRatings, \
-    DEFAULT_RANDOM_STEPS, DEFAULT_RANDOM_TRIALS, DEFAULT_STABILITY_PERCENTAGE
-from .utility import error
+from .data import Results, GenericLetter, CriterionLetter, ChoiceResult, \
+    CompiledQuandary, AnyQuandary, \
+    DEFAULT_RANDOM_STEPS, DEFAULT_RANDOM_TRIALS, DEFAULT_STABILITY_PERCENTAGE, \
+    DEFAULT_STABILITY_ENGINE, STABILITY_ENGINES, DEFAULT_JOBS, ADAPTIVE_BLOCK_TRIALS, \
+    DEFAULT_STABILITY_SEARCH, STABILITY_SEARCHES, BISECT_VERIFY_STEPS, DEFAULT_EXACT_LIMIT, \
+    SWEEP_BLOCK_TRIALS, SHARD_BLOCK_TRIALS, \
+    StabilityStep, StabilityResults, StabilityProgress, Sensitivity, RankStatistics
+from .rng import RandomStream, SignBits
+from .utility import error, QuandaryError
+
+
+RatingValues = List[Tuple[float, float]]
+
+
+def _randomization_values(compiled: CompiledQuandary,
+                          perturbation: float,
+                          ) -> Tuple[RatingValues, RatingValues]:
+    # Lowered and raised values for each rated choice rating and priority.
+    rating_values = [(max(compiled.ratings[idx] - perturbation, 0),
+                      min(compiled.ratings[idx] + perturbation, 1))
+                     for idx in compiled.rated_indexes]
+    priority_values = [(max(priority - perturbation, 0), min(priority + perturbation, 1))
+                       for priority in compiled.priorities]
+    return rating_values, priority_values
 
 
 class _QuandaryRandomizer:
-    """Can perform multiple random perturbations of a given quandary."""
+    """Can perform multiple random perturbations of a given compiled quandary."""
+
+    def __init__(self, compiled: CompiledQuandary):
+        self.compiled = compiled
+        self.rated_count = len(compiled.rated_indexes)
+        self.sign_bits = SignBits(random.Random(), self.rated_count + compiled.criterion_count)
+        # Randomized ratings are overwritten in place by each randomization.
+        self.ratings = array('d', compiled.ratings)
+        self.priorities = array('d', compiled.priorities)
+        self.perturbation: Optional[float] = None
+        self.rating_values: RatingValues = []
+        self.priority_values: RatingValues = []
+
+    def set_stream(self, stream: RandomStream):
+        self.sign_bits.rng = stream.python_random()
+
+    def randomize(self, perturbation: float):
+        """
+        Randomize ratings and priorities in place.
+
+        :param perturbation: perturbation amount added to or subtracted from ratings
+        """
+        if perturbation != self.perturbation:
+            self.rating_values, self.priority_values = _randomization_values(self.compiled,
+                                                                             perturbation)
+            self.perturbation = perturbation
+        signs = self.sign_bits.draw()
+        ratings = self.ratings
+        for idx, values, sign in zip(self.compiled.rated_indexes, self.rating_values, signs):
+            ratings[idx] = values[sign == '1']
+        priorities = self.priorities
+        for idx, values, sign in zip(range(len(priorities)),
+                                     self.priority_values,
+                                     signs[self.rated_count:]):
+            priorities[idx] = values[sign == '1']
+
+
+def _calculate_totals(choice_count: int, ratings: array, priorities: array) -> List[float]:
+    # Each choice's ratings are a strided column of the criteria x choices array.
+    return [sum(map(operator.mul, ratings[choice_idx::choice_count], priorities))
+            for choice_idx in range(choice_count)]
+
+
+def _calculate_profile_totals(compiled: CompiledQuandary) -> List[List[float]]:
+    # All profiles are scored as one profiles x criteria by criteria x choices product.
+    if not compiled.profile_names:
+        return []
+    from .vectorized import calculate_profile_totals, numpy_available
+    if numpy_available():
+        return calculate_profile_totals(compiled)
+    criterion_count = compiled.criterion_count
+    return [_calculate_totals(compiled.choice_count,
+                              compiled.ratings,
+                              compiled.profile_priorities[profile_idx * criterion_count:
+                                                          (profile_idx + 1) * criterion_count])
+            for profile_idx in range(len(compiled.profile_names))]
+
+
+def _rank_choices(totals: List[float]) -> List[int]:
+    # Stable sort keeps tied choices in configuration order.
+    return sorted(range(len(totals)), key=totals.__getitem__, reverse=True)
+
+
+def _order_checks(order: List[int], top_k: Optional[int]) -> List[Tuple[int, int, bool]]:
+    # Choice pairs that must keep their order for the top K rankings to stay
+    # the same. Those are consecutive pairs in the top K, followed by the K-th
+    # choice paired with each lower ranked choice. The boolean says whether
+    # the higher ranked choice needs a strictly higher total, i.e. when a tie
+    # would put it second.
+    top_count = len(order) if top_k is None else min(top_k, len(order))
+    pairs = list(zip(order[:top_count - 1], order[1:top_count]))
+    if top_count > 0:
+        pairs.extend((order[top_count - 1], lower_idx) for lower_idx in order[top_count:])
+    return [(higher_idx, lower_idx, higher_idx > lower_idx)
+            for higher_idx, lower_idx in pairs]
+
+
+def _initial_order_checks(compiled: CompiledQuandary,
+                          top_k: Optional[int],
+                          ) -> List[Tuple[int, int, bool]]:
+    # Order checks for the unperturbed rankings, shared by all engines, so
+    # that they agree exactly.
+    return _order_checks(_rank_choices(_calculate_totals(compiled.choice_count,
+                                                         compiled.ratings,
+                                                         compiled.priorities)),
+                         top_k)
+
+
+def _order_changed(totals: List[float], order_checks: List[Tuple[int, int, bool]]) -> bool:
+    # Same as comparing a (partial) ranking of the totals, but without sorting,
+    # and stopping at the first out of order pair.
+    for higher_idx, lower_idx, strict in order_checks:
+        higher_total = totals[higher_idx]
+        lower_total = totals[lower_idx]
+        if higher_total < lower_total or (strict and higher_total == lower_total):
+            return True
+    return False
+
+
+class _PythonStabilityEngine:
+    """Counts changed rankings by resolving randomized quandaries one at a time."""
+
+    def __init__(self, compiled: CompiledQuandary, top_k: Optional[int]):
+        self.compiled = compiled
+        self.randomizer = _QuandaryRandomizer(compiled)
+        self.choice_count = compiled.choice_count
+        self.order_checks = _initial_order_checks(compiled, top_k)
+        # Set by _run_step() to collect rank statistics along with the trials.
+        self.rank_statistics: Optional[RankStatistics] = None
+
+    def set_stream(self, stream: RandomStream):
+        self.randomizer.set_stream(stream)
+
+    def count_changed(self, perturbation: float, trials: int) -> int:
+        randomizer = self.randomizer
+        rank_statistics = self.rank_statistics
+        changed_count = 0
+        for _trial in range(trials):
+            randomizer.randomize(perturbation)
+            totals = _calculate_totals(self.choice_count,
+                                       randomizer.ratings,
+                                       randomizer.priorities)
+            if _order_changed(totals, self.order_checks):
+                changed_count += 1
+            if rank_statistics is not None:
+                rank_statistics.add_trial(totals, _rank_choices(totals))
+        return changed_count
+
+    def count_all(self, perturbation: float) -> Tuple[int, int]:
+        """
+        Count changed rankings for every possible randomization.
+
+        Each rating is either raised or lowered by the perturbation, so the
+        randomizations are the sign bit patterns of all ratings. Patterns are
+        visited in Gray code order, where each pattern differs by one bit, and
+        only affected totals are recalculated. Priority bits are the highest,
+        which change least often, since they affect every choice total.
+
+        :param perturbation: perturbation amount added to or subtracted from ratings
+        :return: (changed rankings count, randomization count) pair
+        """
+        compiled = self.compiled
+        choice_count = self.choice_count
+        rated_indexes = compiled.rated_indexes
+        rated_count = len(rated_indexes)
+        ratings = array('d', compiled.ratings)
+        priorities = array('d', compiled.priorities)
+        rating_values, priority_values = _randomization_values(compiled, perturbation)
+        for bit, idx in enumerate(rated_indexes):
+            ratings[idx] = rating_values[bit][0]
+        for idx in range(len(priorities)):
+            priorities[idx] = priority_values[idx][0]
+        bits = [0] * (rated_count + len(priorities))
+        totals = _calculate_totals(choice_count, ratings, priorities)
+        changed_count = int(_order_changed(totals, self.order_checks))
+        rank_statistics = self.rank_statistics
+        if rank_statistics is not None:
+            rank_statistics.add_trial(totals, _rank_choices(totals))
+        pattern_count = 1 << len(bits)
+        for pattern in range(1, pattern_count):
+            # The bit that changes in Gray code order is the lowest set bit.
+            bit = (pattern & -pattern).bit_length() - 1
+            bits[bit] ^= 1
+            if bit < rated_count:
+                idx = rated_indexes[bit]
+                ratings[idx] = rating_values[bit][bits[bit]]
+                choice_idx = idx % choice_count
+                totals[choice_idx] = sum(map(operator.mul,
+                                             ratings[choice_idx::choice_count],
+                                             priorities))
+            else:
+                priorities[bit - rated_count] = priority_values[bit - rated_count][bits[bit]]
+                totals = _calculate_totals(choice_count, ratings, priorities)
+            if _order_changed(totals, self.order_checks):
+                changed_count += 1
+            if rank_statistics is not None:
+                rank_statistics.add_trial(totals, _rank_choices(totals))
+        return changed_count, pattern_count
+
+    def sweep_changed(self, perturbations: List[float], trials: int) -> List[int]:
+        """
+        Count changed rankings at every perturbation, reusing each trial's signs.
+
+        Each randomized rating and priority is a linear function of the
+        perturbation, until it is clamped at 0 or 1, so each choice total is a
+        quadratic function. A choice's coefficients are only recalculated when
+        one of its values gets clamped, and each level then costs one
+        evaluation per choice, instead of randomizing and totaling all ratings
+        again.
+
+        :param perturbations: perturbation amounts, in increasing order
+        :param trials: number of trials
+        :return: number of trials with changed rankings, by perturbation
+        """
+        compiled = self.compiled
+        choice_count = self.choice_count
+        rated_indexes = compiled.rated_indexes
+        rated_count = len(rated_indexes)
+        # Sign bits for each rated choice rating, paired with its priority
+        # bit, by choice, in criteria order.
+        choice_bits: List[List[Tuple[int, int]]] = [[] for _ in range(choice_count)]
+        criterion_choices: List[Set[int]] = [set() for _ in compiled.priorities]
+        for bit, idx in enumerate(rated_indexes):
+            criterion_idx, choice_idx = divmod(idx, choice_count)
+            choice_bits[choice_idx].append((bit, rated_count + criterion_idx))
+            criterion_choices[criterion_idx].add(choice_idx)
+        values = [compiled.ratings[idx] for idx in rated_indexes] + list(compiled.priorities)
+        maximum_perturbation = perturbations[-1] if perturbations else 0
+        order_checks = self.order_checks
+        sign_bits = self.randomizer.sign_bits
+        changed_counts = [0] * len(perturbations)
+        coefficients: List[Tuple[float, float, float]] = [(0.0, 0.0, 0.0)] * choice_count
+        for _trial in range(trials):
+            signs = sign_bits.draw()
+            # Values are offset + slope * perturbation, where clamped values have no slope.
+            offsets = list(values)
+            slopes = [1.0 if sign == '1' else -1.0 for sign in signs]
+            clamps = sorted((1 - value if slope > 0 else value, bit)
+                            for bit, (value, slope) in enumerate(zip(values, slopes))
+                            if (1 - value if slope > 0 else value) < maximum_perturbation)
+            clamp_idx = 0
+            changed_choices: Iterable[int] = range(choice_count)
+            for level_idx, perturbation in enumerate(perturbations):
+                if clamp_idx < len(clamps) and clamps[clamp_idx][0] <= perturbation:
+                    changed_choices = set(changed_choices)
+                    while clamp_idx < len(clamps) and clamps[clamp_idx][0] <= perturbation:
+                        bit = clamps[clamp_idx][1]
+                        clamp_idx += 1
+                        offsets[bit] = 1.0 if slopes[bit] > 0 else 0.0
+                        slopes[bit] = 0.0
+                        if bit < rated_count:
+                            changed_choices.add(rated_indexes[bit] % choice_count)
+                        else:
+                            changed_choices.update(criterion_choices[bit - rated_count])
+                # Products of the linear rating and priority functions, summed in
+                # the same order as _calculate_totals(), so that totals are exact
+                # once all of a choice's values are clamped.
+                for choice_idx in changed_choices:
+                    bits = choice_bits[choice_idx]
+                    coefficients[choice_idx] = (
+                        sum(offsets[bit] * offsets[criterion_bit] for bit, criterion_bit in bits),
+                        sum(offsets[bit] * slopes[criterion_bit]
+                            + slopes[bit] * offsets[criterion_bit]
+                            for bit, criterion_bit in bits),
+                        sum(slopes[bit] * slopes[criterion_bit] for bit, criterion_bit in bits))
+                changed_choices = ()
+                totals = [constant + perturbation * (linear + perturbation * quadratic)
+                          for constant, linear, quadratic in coefficients]
+                if _order_changed(totals, order_checks):
+                    changed_counts[level_idx] += 1
+        return changed_counts
+
+
+def _create_stability_engine(engine: str, compiled: CompiledQuandary, top_k: Optional[int]):
+    if engine == 'python':
+        return _PythonStabilityEngine(compiled, top_k)
+    if engine == 'numpy':
+        from .vectorized import VectorizedStabilityEngine, numpy_available
+        if not numpy_available():
+            raise QuandaryError('The "numpy" stability engine requires NumPy to be installed.')
+        return VectorizedStabilityEngine(compiled, _initial_order_checks(compiled, top_k))
+    raise QuandaryError(f'Unknown stability engine "{engine}",'
+                        f' expected one of: {", ".join(STABILITY_ENGINES)}')
+
+
+def _hoeffding_margin(trial_count: int, look_count: int, error_rate: float) -> float:
+    # Error rate is split evenly between all possible looks at the data, so
+    # that stopping at any of them keeps the overall error below the rate.
+    return math.sqrt(math.log(2 * look_count / error_rate) / (2 * trial_count))
+
+
+def _run_step(engine,
+              perturbation: float,
+              trials: int,
+              stream: RandomStream,
+              volatility_threshold: float,
+              exact: bool,
+              error_rate: Optional[float],
+              rank_statistics: bool = False,
+              ) -> StabilityStep:
+    # Rank statistics are collected by the engine, from the same totals.
+    engine.rank_statistics = (RankStatistics.allocate(engine.compiled.choice_letters)
+                              if rank_statistics else None)
+    step = _run_step_trials(engine, perturbation, trials, stream, volatility_threshold, exact,
+                            error_rate)
+    step.rank_statistics = engine.rank_statistics
+    engine.rank_statistics = None
+    return step
+
+
+def _run_step_trials(engine,
+                     perturbation: float,
+                     trials: int,
+                     stream: RandomStream,
+                     volatility_threshold: float,
+                     exact: bool,
+                     error_rate: Optional[float],
+                     ) -> StabilityStep:
+    if exact:
+        changed_count, pattern_count = engine.count_all(perturbation)
+        return StabilityStep(perturbation, changed_count, pattern_count)
+    engine.set_stream(stream)
+    if error_rate is None:
+        return StabilityStep(perturbation, engine.count_changed(perturbation, trials), trials)
+    # Adaptive mode runs trial blocks until the changed fraction confidence
+    # bounds are entirely above or below the volatility threshold.
+    block_trials = min(ADAPTIVE_BLOCK_TRIALS, trials)
+    look_count = math.ceil(trials / block_trials)
+    changed_count = 0
+    trial_count = 0
+    while trial_count < trials:
+        run_trials = min(block_trials, trials - trial_count)
+        changed_count += engine.count_changed(perturbation, run_trials)
+        trial_count += run_trials
+        margin = _hoeffding_margin(trial_count, look_count, error_rate)
+        changed_fraction = changed_count / trial_count
+        if (changed_fraction - margin >= volatility_threshold
+                or changed_fraction + margin < volatility_threshold):
+            break
+    return StabilityStep(perturbation, changed_count, trial_count)
 
-    def __init__(self, quandary: Quandary):
-        self.quandary = quandary
 
-    @classmethod
-    def _randomize_rating(cls, rating: float, perturbation: float) -> float:
-        return max(min(rating + random.choice([perturbation, -perturbation]), 1), 0)
+# Child stream key for extra refinement trials, after the step number key.
+_REFINE_STREAM_KEY = 1
+# Step number key for sweep trial blocks, which is never a real step number.
+_SWEEP_STREAM_KEY = 0
+# Child stream key for shard trial blocks, after the step number key.
+_SHARD_STREAM_KEY = 2
 
-    @classmethod
-    def _randomize_generic_ratings(cls, ratings: GenericRatings, factor: float) -> GenericRatings:
-        return {
-            letter: cls._randomize_rating(rating, factor)
-            for letter, rating in ratings.items()
-        }
+# Stability engine and settings for the current pool worker process.
+_worker_engine = None
+_worker_settings = None
 
-    def _randomize_criteria(self, perturbation: float) -> CriteriaMap:
-        criteria: CriteriaMap = {}
-        for criterion_letter, criterion in self.quandary.criteria.items():
-            choice_ratings = self._randomize_generic_ratings(criterion.choice_ratings,
-                                                             perturbation)
-            criteria[criterion_letter] = Criterion(criterion.label, choice_ratings)
-        return criteria
 
-    def _randomize_priorities(self, perturbation: float) -> PriorityRatings:
-        return self._randomize_generic_ratings(self.quandary.priority_ratings, perturbation)
+def _initialize_worker(engine: str,
+                       compiled: CompiledQuandary,
+                       top_k: Optional[int],
+                       volatility_threshold: float,
+                       exact: bool,
+                       rank_statistics: bool,
+                       ):
+    global _worker_engine, _worker_settings
+    _worker_engine = _create_stability_engine(engine, compiled, top_k)
+    _worker_settings = (volatility_threshold, exact, rank_statistics)
 
-    def randomize(self, perturbation: float) -> Quandary:
-        return Quandary(f'{self.quandary.description} [randomization={perturbation:.2f}%]',
-                        dict(self.quandary.choices),
-                        self._randomize_criteria(perturbation),
-                        self._randomize_priorities(perturbation))
+
+def _run_step_in_worker(perturbation: float,
+                        trials: int,
+                        stream: RandomStream,
+                        error_rate: Optional[float],
+                        ) -> StabilityStep:
+    volatility_threshold, exact, rank_statistics = _worker_settings
+    return _run_step(_worker_engine, perturbation, trials, stream, volatility_threshold, exact,
+                     error_rate, rank_statistics)
+
+
+def _sweep_block(engine,
+                 perturbations: List[float],
+                 trials: int,
+                 stream: RandomStream,
+                 ) -> List[int]:
+    engine.set_stream(stream)
+    return engine.sweep_changed(perturbations, trials)
+
+
+def _sweep_block_in_worker(perturbations: List[float],
+                           trials: int,
+                           stream: RandomStream,
+                           ) -> List[int]:
+    return _sweep_block(_worker_engine, perturbations, trials, stream)
+
+
+def _randomization_bit_count(compiled: CompiledQuandary) -> int:
+    return len(compiled.rated_indexes) + compiled.criterion_count
+
+
+def _is_unstable(step: StabilityStep, volatility_threshold: float) -> bool:
+    return step.changed_count / step.trial_count >= volatility_threshold
+
+
+class _StepRunner:
+    """Runs stability steps inline or spread across a pool of processes."""
+
+    def __init__(self,
+                 engine: str,
+                 compiled: CompiledQuandary,
+                 top_k: Optional[int],
+                 random_steps: int,
+                 random_trials: int,
+                 volatility_threshold: float,
+                 error_rate: Optional[float],
+                 stream: RandomStream,
+                 jobs: int,
+                 exact: bool,
+                 rank_statistics: bool = False,
+                 ):
+        self.random_steps = random_steps
+        self.random_trials = random_trials
+        self.volatility_threshold = volatility_threshold
+        self.exact = exact
+        self.rank_statistics = rank_statistics
+        self.error_rate = error_rate
+        self.stream = stream
+        self.jobs = jobs
+        if jobs > 1:
+            # Imported here, to keep it out of the start of single process runs.
+            from concurrent.futures import ProcessPoolExecutor
+            self.engine = None
+            self.executor = ProcessPoolExecutor(max_workers=jobs,
+                                                initializer=_initialize_worker,
+                                                initargs=(engine, compiled, top_k,
+                                                          volatility_threshold, exact,
+                                                          rank_statistics))
+        else:
+            self.engine = _create_stability_engine(engine, compiled, top_k)
+            self.executor = None
+        self.completed: Dict[int, StabilityStep] = {}
+
+    def __enter__(self) -> '_StepRunner':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    def _run(self,
+             random_steps: List[int],
+             trials: int,
+             streams: List[RandomStream],
+             error_rate: Optional[float],
+             ) -> List[StabilityStep]:
+        perturbations = [random_step / self.random_steps for random_step in random_steps]
+        if self.executor is None:
+            return [_run_step(self.engine, perturbation, trials, stream,
+                              self.volatility_threshold, self.exact, error_rate,
+                              self.rank_statistics)
+                    for perturbation, stream in zip(perturbations, streams)]
+        return list(self.executor.map(_run_step_in_worker,
+                                      perturbations,
+                                      [trials] * len(random_steps),
+                                      streams,
+                                      [error_rate] * len(random_steps)))
+
+    def run(self, random_steps: List[int]) -> List[StabilityStep]:
+        """
+        Run trials for one or more steps, reusing results for completed steps.
+
+        :param random_steps: step numbers, starting with 1
+        :return: step results
+        """
+        new_steps = [random_step for random_step in random_steps
+                     if random_step not in self.completed]
+        if new_steps:
+            # Every step gets its own random stream, so that results do not
+            # depend on which process runs the step, or in what order.
+            streams = [self.stream.spawn(random_step) for random_step in new_steps]
+            for random_step, step in zip(new_steps, self._run(new_steps,
+                                                              self.random_trials,
+                                                              streams,
+                                                              self.error_rate)):
+                self.completed[random_step] = step
+        return [self.completed[random_step] for random_step in random_steps]
+
+    def refine(self, random_steps: List[int], trials: int) -> List[StabilityStep]:
+        """
+        Add extra trials to completed steps.
+
+        :param random_steps: completed step numbers
+        :param trials: number of extra trials per step
+        :return: refined step results
+        """
+        if self.exact:
+            # Exact results have nothing to refine.
+            return [self.completed[random_step] for random_step in random_steps]
+        streams = [self.stream.spawn(random_step, _REFINE_STREAM_KEY)
+                   for random_step in random_steps]
+        for random_step, extra_step in zip(random_steps, self._run(random_steps, trials,
+                                                                   streams, None)):
+            step = self.completed[random_step]
+            if step.rank_statistics is not None:
+                step.rank_statistics.add(extra_step.rank_statistics)
+            self.completed[random_step] = StabilityStep(
+                step.perturbation,
+                step.changed_count + extra_step.changed_count,
+                step.trial_count + extra_step.trial_count,
+                step.rank_statistics)
+        return [self.completed[random_step] for random_step in random_steps]
+
+    def sweep(self) -> List[StabilityStep]:
+        """
+        Run all steps in one pass, with the same random signs for every step.
+
+        Trials are split into fixed size blocks, each with its own random
+        stream, so that results do not depend on the number of jobs. Exact
+        steps have no random signs, and run one at a time.
+
+        :return: step results for all steps
+        """
+        random_steps = list(range(1, self.random_steps + 1))
+        if self.exact:
+            return self.run(random_steps)
+        perturbations = [random_step / self.random_steps for random_step in random_steps]
+        block_trials = [min(SWEEP_BLOCK_TRIALS, self.random_trials - first_trial)
+                        for first_trial in range(0, self.random_trials, SWEEP_BLOCK_TRIALS)]
+        streams = [self.stream.spawn(_SWEEP_STREAM_KEY, block_idx)
+                   for block_idx in range(len(block_trials))]
+        if self.executor is None:
+            block_counts = [_sweep_block(self.engine, perturbations, trials, stream)
+                            for trials, stream in zip(block_trials, streams)]
+        else:
+            block_counts = list(self.executor.map(_sweep_block_in_worker,
+                                                  [perturbations] * len(block_trials),
+                                                  block_trials,
+                                                  streams))
+        for random_step, perturbation, changed_count in zip(random_steps,
+                                                            perturbations,
+                                                            map(sum, zip(*block_counts))):
+            self.completed[random_step] = StabilityStep(perturbation,
+                                                        changed_count,
+                                                        self.random_trials)
+        return [self.completed[random_step] for random_step in random_steps]
+
+    def run_trial_blocks(self,
+                         random_steps: List[int],
+                         first_trial: int,
+                         last_trial: int,
+                         ) -> List[StabilityStep]:
+        """
+        Run a range of trials for steps, in fixed size blocks of trials.
+
+        Every step and trial block gets its own random stream, so that results
+        do not depend on how steps and trials are split between runs.
+
+        :param random_steps: step numbers, starting with 1
+        :param first_trial: first trial number, starting with 1, at the start of a block
+        :param last_trial: last trial number
+        :return: step results for the trial range
+        """
+        block_ranges = [(first_block_trial, min(first_block_trial + SHARD_BLOCK_TRIALS - 1,
+                                                last_trial))
+                        for first_block_trial in range(first_trial, last_trial + 1,
+                                                       SHARD_BLOCK_TRIALS)]
+        step_blocks = [(random_step, first_block_trial, last_block_trial)
+                       for random_step in random_steps
+                       for first_block_trial, last_block_trial in block_ranges]
+        streams = [self.stream.spawn(random_step,
+                                     _SHARD_STREAM_KEY,
+                                     (first_block_trial - 1) // SHARD_BLOCK_TRIALS)
+                   for random_step, first_block_trial, _last_block_trial in step_blocks]
+        perturbations = [random_step / self.random_steps
+                         for random_step, _first_block_trial, _last_block_trial in step_blocks]
+        block_trials = [last_block_trial - first_block_trial + 1
+                        for _random_step, first_block_trial, last_block_trial in step_blocks]
+        if self.executor is None:
+            block_steps = [_run_step(self.engine, perturbation, trials, stream,
+                                     self.volatility_threshold, False, None)
+                           for perturbation, trials, stream in zip(perturbations,
+                                                                   block_trials,
+                                                                   streams)]
+        else:
+            block_steps = list(self.executor.map(_run_step_in_worker,
+                                                 perturbations,
+                                                 block_trials,
+                                                 streams,
+                                                 [None] * len(step_blocks)))
+        changed_counts = {random_step: 0 for random_step in random_steps}
+        for (random_step, _first_block_trial, _last_block_trial), step in zip(step_blocks,
+                                                                              block_steps):
+            changed_counts[random_step] += step.changed_count
+        return [StabilityStep(random_step / self.random_steps,
+                              changed_counts[random_step],
+                              last_trial - first_trial + 1)
+                for random_step in random_steps]
+
+    def is_unstable(self, random_step: int) -> bool:
+        """
+        Check if a completed step is unstable.
+
+        :param random_step: completed step number
+        :return: True if the step changed too many rankings
+        """
+        return _is_unstable(self.completed[random_step], self.volatility_threshold)
+
+
+def _iterate_linear(runner: _StepRunner,
+                    cancel: Optional[threading.Event] = None,
+                    ) -> Iterator[Tuple[int, StabilityStep]]:
+    # Steps run in batches of one per job, and are produced in order, up to
+    # and including the first unstable step. Each step uses its own random
+    # stream, so the result is the same for any number of jobs. Cancellation
+    # is checked before each batch.
+    random_steps = runner.random_steps
+    jobs = runner.jobs
+    for first_step in range(1, random_steps + 1, jobs):
+        if cancel is not None and cancel.is_set():
+            return
+        random_step_batch = list(range(first_step, min(first_step + jobs, random_steps + 1)))
+        for random_step, step in zip(random_step_batch, runner.run(random_step_batch)):
+            yield random_step, step
+            if runner.is_unstable(random_step):
+                return
+
+
+def _scan_linear(runner: _StepRunner) -> int:
+    for random_step, _step in _iterate_linear(runner):
+        if runner.is_unstable(random_step):
+            return random_step - 1
+    return runner.random_steps
+
+
+def _search_bisect(runner: _StepRunner,
+                   random_steps: int,
+                   jobs: int,
+                   refine_trials: int,
+                   ) -> Optional[int]:
+    # Assumes changed rankings increase with perturbation. Each round probes
+    # one step per job, evenly spaced between the highest known stable step
+    # and the lowest known unstable step. Step 0 (no perturbation) is stable
+    # by definition, and the step past the end is treated as unstable.
+    # Returns None if any result contradicts the assumption.
+    stable_step = 0
+    unstable_step = random_steps + 1
+    while unstable_step - stable_step > 1:
+        gap = unstable_step - stable_step
+        probe_count = min(jobs, gap - 1)
+        probes = [stable_step + (gap * idx) // (probe_count + 1)
+                  for idx in range(1, probe_count + 1)]
+        runner.run(probes)
+        unstable_probes = [probe for probe in probes if runner.is_unstable(probe)]
+        if unstable_probes:
+            unstable_step = unstable_probes[0]
+        stable_probes = [probe for probe in probes if probe < unstable_step]
+        if stable_probes:
+            stable_step = stable_probes[-1]
+        if len(stable_probes) + len(unstable_probes) != len(probes):
+            return None
+    # Verification pass, with evenly spaced steps below the boundary.
+    verify_count = min(BISECT_VERIFY_STEPS, stable_step - 1)
+    verify_steps = sorted({(stable_step * idx) // (verify_count + 1)
+                           for idx in range(1, verify_count + 1)})
+    runner.run(verify_steps)
+    if any(runner.is_unstable(verify_step) for verify_step in verify_steps):
+        return None
+    # Optional refinement with extra trials for the boundary steps.
+    if refine_trials > 0:
+        boundary_steps = [random_step for random_step in (stable_step, unstable_step)
+                          if 1 <= random_step <= random_steps]
+        runner.refine(boundary_steps, refine_trials)
+        if stable_step >= 1 and runner.is_unstable(stable_step):
+            return None
+        if unstable_step <= random_steps and not runner.is_unstable(unstable_step):
+            return None
+    return stable_step
 
 
 def _report_unknown_letters(letters: Iterable[GenericLetter], label: str, section: str):
@@ -68,11 +715,190 @@ def _report_unknown_letters(letters: Iterable[GenericLetter], label: str, sectio
               f' "{" ".join(sorted_letters)}" in quandary "{section}"')
 
 
-def analyze_stability(quandary: Quandary,
+def _open_step_runner(quandary: AnyQuandary,
+                      random_steps: int,
+                      random_trials: int,
+                      stability_percentage: int,
+                      engine: str,
+                      jobs: int,
+                      seed: Optional[int],
+                      error_rate: Optional[float],
+                      exact_limit: int,
+                      top_k: Optional[int],
+                      rank_statistics: bool = False,
+                      ) -> _StepRunner:
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    volatility_threshold = (100 - stability_percentage) / 100
+    compiled = compile_quandary(quandary)
+    exact = (1 << _randomization_bit_count(compiled)) <= exact_limit
+    return _StepRunner(engine, compiled, top_k, random_steps, random_trials,
+                       volatility_threshold, error_rate, RandomStream(seed), jobs, exact,
+                       rank_statistics)
+
+
+def run_stability_analysis(quandary: AnyQuandary,
+                           results: Results,
+                           random_steps: int = DEFAULT_RANDOM_STEPS,
+                           random_trials: int = DEFAULT_RANDOM_TRIALS,
+                           stability_percentage: int = DEFAULT_STABILITY_PERCENTAGE,
+                           engine: str = DEFAULT_STABILITY_ENGINE,
+                           jobs: int = DEFAULT_JOBS,
+                           seed: int = None,
+                           error_rate: float = None,
+                           search: str = DEFAULT_STABILITY_SEARCH,
+                           refine_trials: int = 0,
+                           exact_limit: int = DEFAULT_EXACT_LIMIT,
+                           top_k: int = None,
+                           rank_statistics: bool = False,
+                           ) -> StabilityResults:
+    """
+    Calculate stability and keep the results for each randomization step.
+
+    :param quandary: quandary definition
+    :param results: results data
+    :param random_steps: number of random steps (increments)
+    :param random_trials: number of random trials
+    :param stability_percentage: percent limit for considering stable
+    :param engine: trial engine name, "python" or "numpy" (vectorized)
+    :param jobs: number of worker processes (0: one per CPU)
+    :param seed: optional random seed for reproducible results
+    :param error_rate: stop step trials early once the stable/unstable decision
+                       error rate is below this value (None: run all trials)
+    :param search: step search, "linear" scan, "bisect" (assumes monotonic
+                   changes, with fallback to linear when contradicted), or
+                   "sweep" of all steps with the same random signs (no
+                   adaptive early stopping)
+    :param refine_trials: extra trials for bisect search boundary steps
+    :param exact_limit: maximum number of possible randomizations to evaluate
+                        all of them, instead of random trials (0: never)
+    :param top_k: only consider changes to the top K rankings (None: all)
+    :param rank_statistics: collect rank statistics for each step from the
+                            same trials (not with the "sweep" search)
+    :return: stability results with stability value and step results, and
+             the stability of each priority profile, if any
+    """
+    if stability_percentage == 0:
+        return StabilityResults(None, [])
+    if search not in STABILITY_SEARCHES:
+        raise QuandaryError(f'Unknown stability search "{search}",'
+                            f' expected one of: {", ".join(STABILITY_SEARCHES)}')
+    if rank_statistics and search == 'sweep':
+        raise QuandaryError('Rank statistics are not available with the "sweep" search.')
+
+    def _search(target: CompiledQuandary, collect: bool) -> StabilityResults:
+        with _open_step_runner(target, random_steps, random_trials, stability_percentage,
+                               engine, jobs, seed, error_rate, exact_limit, top_k,
+                               collect) as runner:
+            stable_step = None
+            if search == 'bisect':
+                stable_step = _search_bisect(runner, random_steps, runner.jobs, refine_trials)
+            elif search == 'sweep':
+                # The linear scan below finds the boundary in the completed steps.
+                runner.sweep()
+            if stable_step is None:
+                stable_step = _scan_linear(runner)
+            steps = [runner.completed[random_step] for random_step in sorted(runner.completed)]
+        return StabilityResults(stable_step / random_steps, steps)
+
+    compiled = compile_quandary(quandary)
+    stability_results = _search(compiled, rank_statistics)
+    # Profile views share the rating matrix, and only the priorities differ.
+    for profile_idx, profile_name in enumerate(compiled.profile_names):
+        profile_results = _search(compiled.profile(profile_idx), False)
+        stability_results.profile_stability[profile_name] = profile_results.stability
+    return stability_results
+
+
+def run_stability_shard(quandary: AnyQuandary,
+                        first_step: int,
+                        last_step: int,
+                        first_trial: int,
+                        last_trial: int,
+                        random_steps: int = DEFAULT_RANDOM_STEPS,
+                        engine: str = DEFAULT_STABILITY_ENGINE,
+                        jobs: int = DEFAULT_JOBS,
+                        seed: int = None,
+                        top_k: int = None,
+                        ) -> Dict[int, StabilityStep]:
+    """
+    Run one shard of a stability analysis, i.e. a range of steps and trials.
+
+    Shard results for the same seed are combined by merge_stability_steps(),
+    with the same result for any split of the steps and trials.
+
+    :param quandary: quandary definition
+    :param first_step: first step number, starting with 1
+    :param last_step: last step number
+    :param first_trial: first trial number, starting with 1, which must be 1
+                        more than a multiple of SHARD_BLOCK_TRIALS
+    :param last_trial: last trial number
+    :param random_steps: number of random steps (increments)
+    :param engine: trial engine name, "python" or "numpy" (vectorized)
+    :param jobs: number of worker processes (0: one per CPU)
+    :param seed: optional random seed for reproducible results
+    :param top_k: only consider changes to the top K rankings (None: all)
+    :return: step results by step number
+    """
+    if not 1 <= first_step <= last_step <= random_steps:
+        raise QuandaryError(f'Shard steps {first_step}-{last_step} are not within'
+                            f' 1-{random_steps}.')
+    if first_trial < 1 or first_trial > last_trial:
+        raise QuandaryError(f'Shard trials {first_trial}-{last_trial} are not a valid range.')
+    if (first_trial - 1) % SHARD_BLOCK_TRIALS != 0:
+        raise QuandaryError(f'Shard trials must start at a multiple of {SHARD_BLOCK_TRIALS}'
+                            f' plus 1, e.g. 1 or {SHARD_BLOCK_TRIALS + 1}.')
+    # Stability percentage does not affect trial counts, and exact
+    # randomizations cannot be split between shards.
+    with _open_step_runner(quandary, random_steps, last_trial, DEFAULT_STABILITY_PERCENTAGE,
+                           engine, jobs, seed, None, 0, top_k) as runner:
+        step_numbers = list(range(first_step, last_step + 1))
+        return dict(zip(step_numbers,
+                        runner.run_trial_blocks(step_numbers, first_trial, last_trial)))
+
+
+def merge_stability_steps(steps: Dict[int, StabilityStep],
+                          random_steps: int,
+                          stability_percentage: int = DEFAULT_STABILITY_PERCENTAGE,
+                          ) -> StabilityResults:
+    """
+    Calculate stability from merged shard step results.
+
+    Steps are checked from lowest to highest, like the linear search, and
+    only need to be present up to and including the first unstable step.
+
+    :param steps: merged step results by step number
+    :param random_steps: number of random steps (increments)
+    :param stability_percentage: percent limit for considering stable
+    :return: stability results with stability value and step results
+    """
+    if stability_percentage == 0:
+        return StabilityResults(None, [])
+    volatility_threshold = (100 - stability_percentage) / 100
+    stable_step = random_steps
+    for random_step in range(1, random_steps + 1):
+        if random_step not in steps:
+            raise QuandaryError(f'Stability step {random_step} is missing from the shard results.')
+        if _is_unstable(steps[random_step], volatility_threshold):
+            stable_step = random_step - 1
+            break
+    return StabilityResults(stable_step / random_steps,
+                            [steps[random_step] for random_step in sorted(steps)])
+
+
+def analyze_stability(quandary: AnyQuandary,
                       results: Results,
                       random_steps: int = DEFAULT_RANDOM_STEPS,
                       random_trials: int = DEFAULT_RANDOM_TRIALS,
                       stability_percentage: int = DEFAULT_STABILITY_PERCENTAGE,
+                      engine: str = DEFAULT_STABILITY_ENGINE,
+                      jobs: int = DEFAULT_JOBS,
+                      seed: int = None,
+                      error_rate: float = None,
+                      search: str = DEFAULT_STABILITY_SEARCH,
+                      refine_trials: int = 0,
+                      exact_limit: int = DEFAULT_EXACT_LIMIT,
+                      top_k: int = None,
                       ) -> Optional[float]:
     """
     Calculate stability (see README.md for more information).
@@ -82,66 +908,287 @@ def analyze_stability(quandary: Quandary,
     :param random_steps: number of random steps (increments)
     :param random_trials: number of random trials
     :param stability_percentage: percent limit for considering stable
+    :param engine: trial engine name, "python" or "numpy" (vectorized)
+    :param jobs: number of worker processes (0: one per CPU)
+    :param seed: optional random seed for reproducible results
+    :param error_rate: stop step trials early once the stable/unstable decision
+                       error rate is below this value (None: run all trials)
+    :param search: step search, "linear" scan, "bisect" (assumes monotonic
+                   changes, with fallback to linear when contradicted), or
+                   "sweep" of all steps with the same random signs
+    :param refine_trials: extra trials for bisect search boundary steps
+    :param exact_limit: maximum number of possible randomizations to evaluate
+                        all of them, instead of random trials (0: never)
+    :param top_k: only consider changes to the top K rankings (None: all)
     :return: stability value (between 0 and 1) or None if stability % is 0
     """
+    return run_stability_analysis(quandary,
+                                  results,
+                                  random_steps=random_steps,
+                                  random_trials=random_trials,
+                                  stability_percentage=stability_percentage,
+                                  engine=engine,
+                                  jobs=jobs,
+                                  seed=seed,
+                                  error_rate=error_rate,
+                                  search=search,
+                                  refine_trials=refine_trials,
+                                  exact_limit=exact_limit,
+                                  top_k=top_k).stability
+
+
+def iterate_stability(quandary: AnyQuandary,
+                      results: Results,
+                      random_steps: int = DEFAULT_RANDOM_STEPS,
+                      random_trials: int = DEFAULT_RANDOM_TRIALS,
+                      stability_percentage: int = DEFAULT_STABILITY_PERCENTAGE,
+                      engine: str = DEFAULT_STABILITY_ENGINE,
+                      jobs: int = DEFAULT_JOBS,
+                      seed: int = None,
+                      error_rate: float = None,
+                      exact_limit: int = DEFAULT_EXACT_LIMIT,
+                      top_k: int = None,
+                      cancel: threading.Event = None,
+                      ) -> Iterator[StabilityProgress]:
+    """
+    Calculate stability step by step, producing progress as each step finishes.
+
+    Steps are scanned linearly, and the last progress record, marked as
+    finished, has the same stability as run_stability_analysis() with the
+    "linear" search. Consumers can stop at any time, e.g. once the stability
+    is known precisely enough. Closing the generator releases worker
+    processes. No work runs while waiting for the consumer.
+
+    :param quandary: quandary definition
+    :param results: results data
+    :param random_steps: number of random steps (increments)
+    :param random_trials: number of random trials
+    :param stability_percentage: percent limit for considering stable
+    :param engine: trial engine name, "python" or "numpy" (vectorized)
+    :param jobs: number of worker processes (0: one per CPU)
+    :param seed: optional random seed for reproducible results
+    :param error_rate: stop step trials early once the stable/unstable decision
+                       error rate is below this value (None: run all trials)
+    :param exact_limit: maximum number of possible randomizations to evaluate
+                        all of them, instead of random trials (0: never)
+    :param top_k: only consider changes to the top K rankings (None: all)
+    :param cancel: optional event, e.g. set by another thread, that stops the
+                   analysis before the next step (or batch of steps with jobs)
+    :return: progress iterator, empty if stability % is 0
+    """
     if stability_percentage == 0:
-        return None
-    ranked_labels = [ranking.label for ranking in results.choice_rankings]
-    quandary_randomizer = _QuandaryRandomizer(quandary)
-    volatility_threshold = (100 - stability_percentage) / 100
-    stability = 0
-    for random_step in range(1, random_steps + 1):
-        perturbation = random_step / random_steps
-        changed_count = 0
-        for _trial in range(1, random_trials + 1):
-            randomized_quandary = quandary_randomizer.randomize(perturbation)
-            results = resolve_quandary(randomized_quandary)
-            trial_ranked_labels = [ranking.label for ranking in results.choice_rankings]
-            if trial_ranked_labels != ranked_labels:
-                changed_count += 1
-        if changed_count / random_trials >= volatility_threshold:
-            break
-        stability = perturbation
-    return stability
+        return
+    start_time = time.perf_counter()
+    with _open_step_runner(quandary, random_steps, random_trials, stability_percentage,
+                           engine, jobs, seed, error_rate, exact_limit, top_k) as runner:
+        for random_step, step in _iterate_linear(runner, cancel):
+            unstable = runner.is_unstable(random_step)
+            stable_step = random_step - 1 if unstable else random_step
+            yield StabilityProgress(random_step,
+                                    step.perturbation,
+                                    step.changed_count / step.trial_count,
+                                    step.trial_count,
+                                    time.perf_counter() - start_time,
+                                    stable_step / random_steps,
+                                    unstable or random_step == random_steps)
 
 
-def resolve_quandary(quandary: Quandary) -> Results:
+async def iterate_stability_async(quandary: AnyQuandary,
+                                  results: Results,
+                                  **kwargs,
+                                  ) -> AsyncIterator[StabilityProgress]:
     """
-    Analyze quandary and provide results.
+    Asyncio wrapper for iterate_stability(), which runs in a separate thread.
+
+    The event loop is not blocked by the analysis. Cancelling the consuming
+    task, or closing the generator early, stops the analysis after the step
+    that is running.
 
     :param quandary: quandary definition
-    :return: evaluation results
+    :param results: results data
+    :param kwargs: other iterate_stability() keyword arguments, except cancel
+    :return: asynchronous progress iterator
     """
-    total_choice_ratings: ChoiceRatings = {letter: 0 for letter in quandary.choices.keys()}
-    bad_ratings_criteria: Set[str] = set()
+    # Only asynchronous callers need these, and they have asyncio loaded already.
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    cancel = threading.Event()
+    progress_iterator = iterate_stability(quandary, results, cancel=cancel, **kwargs)
+    # A single thread runs the generator, so that closing it waits for any
+    # step in progress, without blocking the event loop.
+    executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            progress = await loop.run_in_executor(executor, next, progress_iterator, None)
+            if progress is None:
+                break
+            yield progress
+    finally:
+        cancel.set()
+        executor.submit(progress_iterator.close)
+        executor.shutdown(wait=False)
+
+
+def compile_quandary(quandary: AnyQuandary) -> CompiledQuandary:
+    """
+    Compile quandary for fast resolution and stability analysis.
+
+    :param quandary: quandary definition (returned as is if already compiled)
+    :return: compiled quandary
+    """
+    if isinstance(quandary, CompiledQuandary):
+        return quandary
+    choice_letters = list(quandary.choices.keys())
+    choice_indexes = {letter: idx for idx, letter in enumerate(choice_letters)}
+    criterion_letters: List[CriterionLetter] = []
     bad_ratings_choices: Set[str] = set()
-    missing_priority_factors: Set[str] = set()
-    missing_choice_ratings: Set[str] = set()
+    ratings = array('d')
+    rated_indexes = array('l')
+    priorities = array('d')
+    profile_priorities = array('d')
     for criterion_letter, criterion in quandary.criteria.items():
-        if criterion_letter not in quandary.criteria:
-            bad_ratings_criteria.add(criterion_letter)
-            continue
         if criterion_letter not in quandary.priority_ratings:
-            missing_priority_factors.add(criterion_letter)
             continue
-        bad_ratings_choices.update(filter(lambda letter: letter not in quandary.choices,
-                                          criterion.choice_ratings.keys()))
-        priority = quandary.priority_ratings[criterion_letter]
-        for choice_letter in quandary.choices.keys():
-            if choice_letter not in quandary.choices:
-                bad_ratings_choices.add(choice_letter)
-                continue
-            if choice_letter not in criterion.choice_ratings:
-                missing_choice_ratings.add(choice_letter)
-                continue
-            total_choice_ratings[choice_letter] += (
-                    criterion.choice_ratings[choice_letter] * priority)
-    _report_unknown_letters(bad_ratings_criteria, 'factor', 'ratings')
+        bad_ratings_choices.update(letter for letter in criterion.choice_ratings.keys()
+                                   if letter not in choice_indexes)
+        for choice_letter in choice_letters:
+            if choice_letter in criterion.choice_ratings:
+                rated_indexes.append(len(ratings))
+                ratings.append(criterion.choice_ratings[choice_letter])
+            else:
+                ratings.append(0)
+        criterion_letters.append(criterion_letter)
+        priorities.append(quandary.priority_ratings[criterion_letter])
     _report_unknown_letters(bad_ratings_choices, 'choice', 'ratings')
-    choice_rankings: List[ChoiceResult] = []
-    for choice_letter in quandary.choices.keys():
-        label = quandary.choices[choice_letter]
-        rating = total_choice_ratings[choice_letter]
-        choice_rankings.append(ChoiceResult(label, rating))
-    choice_rankings.sort(key=lambda choice_ranking: choice_ranking.rating, reverse=True)
-    return Results(choice_rankings)
+    for profile in quandary.priority_profiles.values():
+        profile_priorities.extend(profile[criterion_letter]
+                                  for criterion_letter in criterion_letters)
+    return CompiledQuandary(quandary,
+                            choice_letters,
+                            criterion_letters,
+                            ratings,
+                            rated_indexes,
+                            priorities,
+                            list(quandary.priority_profiles.keys()),
+                            profile_priorities)
+
+
+def relabel_results(compiled: CompiledQuandary, results: Results) -> Results:
+    """
+    Copy results with choice labels from a quandary with the same choice letters.
+
+    :param compiled: compiled quandary providing the labels
+    :param results: results with choice letters
+    :return: relabeled results
+    """
+    choices = compiled.quandary.choices
+
+    def _relabel(rankings: List[ChoiceResult]) -> List[ChoiceResult]:
+        return [ChoiceResult(choices[ranking.letter], ranking.rating, ranking.letter)
+                for ranking in rankings]
+
+    return Results(_relabel(results.choice_rankings),
+                   {name: _relabel(rankings)
+                    for name, rankings in results.profile_rankings.items()})
+
+
+def resolve_quandary(quandary: AnyQuandary) -> Results:
+    """
+    Analyze quandary and provide results.
+
+    With priority profiles, the consensus rankings use the average profile.
+
+    :param quandary: quandary definition
+    :return: evaluation results
+    """
+    compiled = compile_quandary(quandary)
+    choices = compiled.quandary.choices
+
+    def _rankings(totals: List[float]) -> List[ChoiceResult]:
+        choice_rankings: List[ChoiceResult] = []
+        for choice_idx in _rank_choices(totals):
+            choice_letter = compiled.choice_letters[choice_idx]
+            choice_rankings.append(ChoiceResult(choices[choice_letter],
+                                                totals[choice_idx],
+                                                choice_letter))
+        return choice_rankings
+
+    totals = _calculate_totals(compiled.choice_count, compiled.ratings, compiled.priorities)
+    return Results(_rankings(totals),
+                   {name: _rankings(profile_totals)
+                    for name, profile_totals in zip(compiled.profile_names,
+                                                    _calculate_profile_totals(compiled))})
+
+
+def _smallest_change(compiled: CompiledQuandary,
+                     criterion_idx: int,
+                     choice_idx: Optional[int],
+                     value: float,
+                     candidates: Iterable[Tuple[float, int, int]],
+                     ) -> Sensitivity:
+    # Candidates are (change, higher index, lower index) tuples. Only changes
+    # that keep the value between 0 and 1 are possible.
+    feasible = [candidate for candidate in candidates if 0 <= value + candidate[0] <= 1]
+    criterion_letter = compiled.criterion_letters[criterion_idx]
+    choice_letter = compiled.choice_letters[choice_idx] if choice_idx is not None else None
+    if not feasible:
+        return Sensitivity(criterion_letter, choice_letter, value, None)
+    change, higher_idx, lower_idx = min(feasible, key=lambda candidate: abs(candidate[0]))
+    return Sensitivity(criterion_letter,
+                       choice_letter,
+                       value,
+                       change,
+                       compiled.choice_letters[higher_idx],
+                       compiled.choice_letters[lower_idx])
+
+
+def analyze_sensitivity(quandary: AnyQuandary, top_k: int = None) -> List[Sensitivity]:
+    """
+    Find the smallest change to each priority and choice rating that alters the rankings.
+
+    Totals are sums of ratings weighted by priorities, so the change that
+    closes the gap between any pair of choice totals has a closed form. Only
+    the pairs that must keep their order for the (top K) rankings to stay the
+    same are considered, since a single change swaps one of them first.
+
+    :param quandary: quandary definition
+    :param top_k: only consider changes to the top K rankings (None: all)
+    :return: sensitivities, from the most to the least fragile, with values
+             that no possible change can flip last
+    """
+    compiled = compile_quandary(quandary)
+    choice_count = compiled.choice_count
+    totals = _calculate_totals(choice_count, compiled.ratings, compiled.priorities)
+    order_checks = [(higher_idx, lower_idx, totals[higher_idx] - totals[lower_idx])
+                    for higher_idx, lower_idx, _strict in _order_checks(_rank_choices(totals),
+                                                                        top_k)]
+    choice_checks: Dict[int, List[Tuple[int, int, float]]] = {}
+    for order_check in order_checks:
+        choice_checks.setdefault(order_check[0], []).append(order_check)
+        choice_checks.setdefault(order_check[1], []).append(order_check)
+    sensitivities: List[Sensitivity] = []
+    # A priority change moves each total by the change times the choice rating.
+    for criterion_idx, priority in enumerate(compiled.priorities):
+        criterion_ratings = compiled.ratings[criterion_idx * choice_count:
+                                             (criterion_idx + 1) * choice_count]
+        candidates = []
+        for higher_idx, lower_idx, gap in order_checks:
+            slope = criterion_ratings[higher_idx] - criterion_ratings[lower_idx]
+            if slope != 0:
+                candidates.append((-gap / slope, higher_idx, lower_idx))
+        sensitivities.append(_smallest_change(compiled, criterion_idx, None, priority, candidates))
+    # A choice rating change only moves that choice's total, weighted by priority.
+    for rating_idx in compiled.rated_indexes:
+        criterion_idx, choice_idx = divmod(rating_idx, choice_count)
+        priority = compiled.priorities[criterion_idx]
+        candidates = []
+        if priority != 0:
+            for higher_idx, lower_idx, gap in choice_checks.get(choice_idx, []):
+                change = -gap / priority if choice_idx == higher_idx else gap / priority
+                candidates.append((change, higher_idx, lower_idx))
+        sensitivities.append(_smallest_change(compiled, criterion_idx, choice_idx,
+                                              compiled.ratings[rating_idx], candidates))
+    sensitivities.sort(key=lambda sensitivity: (sensitivity.change is None,
+                                                abs(sensitivity.change or 0)))
+    return sensitivities
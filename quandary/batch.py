@@ -0,0 +1,234 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Quandary file processing, including parallel batches."""
+
+import dataclasses
+import os
+import sqlite3
+from typing import Optional, Tuple, Dict, Any, Iterator, List
+
+from .analysis import compile_quandary, resolve_quandary, run_stability_analysis, \
+    analyze_sensitivity
+from .cache import ResultCache, fingerprint_seed
+from .configuration import iterate_configuration_file
+from .data import Options, CompiledQuandary, Results, StabilityResults
+from .metrics import FileMetrics, phase, start_file, count_stability, enable_metrics, \
+    get_metrics
+from .report import format_report, ReportWriter
+from .utility import error, warning, QuandaryError
+
+
+# Result cache opened by the current process. Database connections must not
+# be shared with forked worker processes, hence the process ID check.
+_result_cache: Optional[ResultCache] = None
+_result_cache_pid: Optional[int] = None
+
+
+def open_result_cache(options: Options) -> Optional[ResultCache]:
+    """
+    Open the result cache once per process, unless caching is disabled.
+
+    If the cache can not be opened, e.g. in a read-only or missing directory,
+    there is a warning, and the process continues without caching.
+
+    :param options: runtime options
+    :return: result cache or None if disabled or unavailable
+    """
+    global _result_cache, _result_cache_pid
+    if options.cache_directory is None:
+        return None
+    if _result_cache_pid != os.getpid():
+        _result_cache_pid = os.getpid()
+        try:
+            _result_cache = ResultCache(options.cache_directory, options.cache_size)
+        except (OSError, sqlite3.Error) as exc:
+            warning(f'Result cache unavailable: {options.cache_directory}: {exc}')
+            _result_cache = None
+    return _result_cache
+
+
+def worker_options(options: Options) -> Options:
+    """
+    Get runtime options for worker processes.
+
+    The result cache is opened first, and disabled for the workers if it is
+    unavailable, so that there is only one warning.
+
+    :param options: runtime options
+    :return: worker runtime options
+    """
+    if options.cache_directory is not None and open_result_cache(options) is None:
+        return dataclasses.replace(options, cache_directory=None)
+    return options
+
+
+def stability_arguments(options: Options) -> Dict[str, Any]:
+    """
+    Get run_stability_analysis() keyword arguments that affect its results.
+
+    :param options: runtime options
+    :return: keyword arguments
+    """
+    arguments = dict(random_steps=options.random_steps,
+                     random_trials=options.random_trials,
+                     stability_percentage=options.stability_percentage,
+                     engine=options.engine,
+                     seed=options.seed,
+                     error_rate=options.error_percentage / 100 if options.adaptive else None,
+                     search=options.search,
+                     refine_trials=options.refine_trials,
+                     exact_limit=options.exact_limit,
+                     top_k=options.top_k)
+    # Only added when enabled, to keep result cache keys for earlier runs.
+    if options.rank_statistics:
+        arguments['rank_statistics'] = True
+    return arguments
+
+
+def analyze_quandary(compiled: CompiledQuandary,
+                     options: Options,
+                     jobs: int,
+                     ) -> Tuple[Results, StabilityResults]:
+    """
+    Resolve quandary and analyze stability, using the result cache if enabled.
+
+    :param compiled: compiled quandary
+    :param options: runtime options
+    :param jobs: number of stability worker processes
+    :return: (results, stability results) pair
+    """
+    arguments = stability_arguments(options)
+    with phase('cache'):
+        result_cache = open_result_cache(options)
+        cached = result_cache.get(compiled, arguments) if result_cache is not None else None
+    if cached is not None:
+        count_stability(cached[1], True)
+        return cached
+    with phase('resolve'):
+        results = resolve_quandary(compiled)
+    run_arguments = arguments
+    if result_cache is not None and arguments['seed'] is None:
+        # Cached unseeded runs use a seed derived from the quandary, so that
+        # the cached results are the same as running them again.
+        run_arguments = dict(arguments, seed=fingerprint_seed(compiled))
+    with phase('stability'):
+        stability_results = run_stability_analysis(compiled, results, jobs=jobs, **run_arguments)
+    count_stability(stability_results, False)
+    if result_cache is not None:
+        with phase('cache'):
+            result_cache.put(compiled, arguments, results, stability_results)
+    return results, stability_results
+
+
+def report_quandary(compiled: CompiledQuandary,
+                    results: Results,
+                    stability_results: StabilityResults,
+                    options: Options,
+                    path: str = None,
+                    ) -> str:
+    """
+    Format quandary report based on runtime options.
+
+    :param compiled: compiled quandary
+    :param results: analysis results
+    :param stability_results: stability analysis results
+    :param options: runtime options
+    :param path: optional quandary file path
+    :return: report chunk for a ReportWriter
+    """
+    sensitivities = None
+    if options.sensitivity:
+        with phase('sensitivity'):
+            sensitivities = analyze_sensitivity(compiled, options.top_k)
+    with phase('report'):
+        return format_report(options.report_format,
+                             compiled.quandary,
+                             results,
+                             stability_results,
+                             decimal_places=options.decimal_places,
+                             details=options.details,
+                             top_k=options.top_k,
+                             path=path,
+                             sensitivities=sensitivities)
+
+
+def process_quandary_file(config_path: str, options: Options, jobs: int) -> Iterator[str]:
+    """
+    Parse, analyze and report on the quandaries in one file.
+
+    :param config_path: configuration file path
+    :param options: runtime options
+    :param jobs: number of stability worker processes
+    :return: report chunk iterator, one per quandary
+    """
+    start_file(config_path)
+    for quandary in iterate_configuration_file(config_path, options.cache_directory):
+        with phase('compile'):
+            compiled = compile_quandary(quandary)
+        results, stability_results = analyze_quandary(compiled, options, jobs)
+        yield report_quandary(compiled, results, stability_results, options, config_path)
+
+
+def _process_in_worker(config_path: str,
+                       options: Options,
+                       ) -> Tuple[List[str], Optional[str], Optional[FileMetrics]]:
+    # Returns report chunks, error message (None if successful), and metrics
+    # (None if disabled). Unexpected exceptions are also caught, since one bad
+    # file must not end the batch.
+    metrics = enable_metrics() if options.timings or options.metrics_path else None
+    chunks: List[str] = []
+    message = None
+    try:
+        for chunk in process_quandary_file(config_path, options, 1):
+            chunks.append(chunk)
+    except QuandaryError as exc:
+        message = str(exc)
+    except Exception as exc:
+        message = f'{exc.__class__.__name__}: {exc}'
+    return chunks, message, metrics.current if metrics is not None else None
+
+
+def run_batch(options: Options, writer: ReportWriter) -> int:
+    """
+    Process quandary files in parallel, and write reports in command line order.
+
+    Each report is written as soon as it and all earlier reports are done.
+    Failures are reported as errors, without stopping the batch.
+
+    :param options: runtime options, with --jobs as the number of file workers
+    :param writer: report writer
+    :return: number of failed files
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = options.jobs or os.cpu_count() or 1
+    failure_count = 0
+    options = worker_options(options)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        outputs = executor.map(_process_in_worker,
+                               options.quandary_paths,
+                               [options] * len(options.quandary_paths))
+        for config_path, (chunks, message, file_metrics) in zip(options.quandary_paths, outputs):
+            if file_metrics is not None:
+                get_metrics().add_file(file_metrics)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.flush()
+            if message is not None:
+                error(f'{config_path}: {message}')
+                failure_count += 1
+    return failure_count
@@ -0,0 +1,250 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Persistent stability analysis result cache."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from array import array
+from typing import Optional, Tuple, Dict, Any, List
+
+from .data import CompiledQuandary, Results, ChoiceResult, StabilityResults, StabilityStep, \
+    RankStatistics, DEFAULT_CACHE_SIZE
+from .utility import warning
+
+CACHE_FILE_NAME = 'results.sqlite'
+
+
+def default_cache_directory() -> str:
+    """
+    Get the default cache directory, based on XDG_CACHE_HOME if it is set.
+
+    :return: cache directory path
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'quandary')
+
+
+def quandary_fingerprint(compiled: CompiledQuandary) -> str:
+    """
+    Produce a canonical hash of the numeric quandary data.
+
+    Descriptions and choice/criterion names do not affect results, and are
+    left out, so that relabeling a quandary keeps the same fingerprint.
+
+    :param compiled: compiled quandary
+    :return: hexadecimal fingerprint
+    """
+    data = {
+        'choices': compiled.choice_letters,
+        'criteria': compiled.criterion_letters,
+        'ratings': list(compiled.ratings),
+        'rated': list(compiled.rated_indexes),
+        'priorities': list(compiled.priorities),
+    }
+    # Added only when present, to keep fingerprints without profiles unchanged.
+    if compiled.profile_names:
+        data['profiles'] = compiled.profile_names
+        data['profile_priorities'] = list(compiled.profile_priorities)
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def fingerprint_seed(compiled: CompiledQuandary) -> int:
+    """
+    Derive a random seed from the numeric quandary data.
+
+    :param compiled: compiled quandary
+    :return: seed, the same for quandaries with the same fingerprint
+    """
+    return int(quandary_fingerprint(compiled)[:16], 16)
+
+
+def _cache_key(compiled: CompiledQuandary, stability_arguments: Dict[str, Any]) -> str:
+    arguments = json.dumps(stability_arguments, sort_keys=True)
+    return hashlib.sha256(f'{quandary_fingerprint(compiled)}:{arguments}'.encode()).hexdigest()
+
+
+def _encode_step(step: StabilityStep) -> list:
+    step_data = [step.perturbation, step.changed_count, step.trial_count]
+    rank_statistics = step.rank_statistics
+    if rank_statistics is not None:
+        step_data.append([rank_statistics.trial_count,
+                          list(rank_statistics.rank_counts),
+                          list(rank_statistics.total_sums),
+                          list(rank_statistics.total_squares)])
+    return step_data
+
+
+def _decode_step(compiled: CompiledQuandary, step_data: list) -> StabilityStep:
+    if len(step_data) < 4:
+        return StabilityStep(*step_data)
+    perturbation, changed_count, trial_count, statistics_data = step_data
+    statistics_trial_count, rank_counts, total_sums, total_squares = statistics_data
+    return StabilityStep(perturbation,
+                         changed_count,
+                         trial_count,
+                         RankStatistics(compiled.choice_letters,
+                                        statistics_trial_count,
+                                        array('q', rank_counts),
+                                        array('d', total_sums),
+                                        array('d', total_squares)))
+
+
+def _encode_value(results: Results, stability_results: StabilityResults) -> str:
+    return json.dumps({
+        'rankings': [[ranking.letter, ranking.rating] for ranking in results.choice_rankings],
+        'stability': stability_results.stability,
+        'steps': [_encode_step(step) for step in stability_results.steps],
+        'profiles': [[name,
+                      [[ranking.letter, ranking.rating] for ranking in rankings],
+                      stability_results.profile_stability.get(name)]
+                     for name, rankings in results.profile_rankings.items()],
+    })
+
+
+def _decode_value(compiled: CompiledQuandary, value: str) -> Tuple[Results, StabilityResults]:
+    # Labels come from the current quandary, since they are not part of the key.
+    data = json.loads(value)
+    choices = compiled.quandary.choices
+
+    def _rankings(rankings_data: list) -> List[ChoiceResult]:
+        return [ChoiceResult(choices[letter], rating, letter) for letter, rating in rankings_data]
+
+    profiles_data = data.get('profiles', [])
+    results = Results(_rankings(data['rankings']),
+                      {name: _rankings(rankings_data)
+                       for name, rankings_data, _stability in profiles_data})
+    steps = [_decode_step(compiled, step_data) for step_data in data['steps']]
+    return results, StabilityResults(data['stability'],
+                                     steps,
+                                     {name: stability
+                                      for name, _rankings_data, stability in profiles_data})
+
+
+class ResultCache:
+    """
+    SQLite database of resolved rankings and stability results.
+
+    Entries are keyed by the quandary fingerprint and stability arguments.
+    The least recently used entries are evicted to stay within the maximum
+    size. Hit and miss counters are kept in the database.
+
+    Opening the database raises OSError or sqlite3.Error on failure. After
+    that, the cache is advisory, and database errors, e.g. from a locked or
+    corrupt database, are cache misses, with a single warning.
+    """
+
+    def __init__(self, directory: str, max_entries: int = DEFAULT_CACHE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.warned = False
+        self.connection = sqlite3.connect(os.path.join(directory, CACHE_FILE_NAME), timeout=60)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results'
+                                    ' (key TEXT PRIMARY KEY, value TEXT, last_used REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_used'
+                                    ' ON results (last_used)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS counters'
+                                    ' (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+    def _warn(self, exc: Exception):
+        if not self.warned:
+            warning(f'Result cache unavailable: {exc}')
+            self.warned = True
+
+    def _count(self, name: str):
+        self.connection.execute('INSERT INTO counters VALUES (?, 1)'
+                                ' ON CONFLICT (name) DO UPDATE SET value = value + 1',
+                                (name,))
+
+    def get(self,
+            compiled: CompiledQuandary,
+            stability_arguments: Dict[str, Any],
+            ) -> Optional[Tuple[Results, StabilityResults]]:
+        """
+        Look up cached results.
+
+        :param compiled: compiled quandary
+        :param stability_arguments: run_stability_analysis() keyword arguments
+        :return: (results, stability results) pair or None if not cached
+        """
+        key = _cache_key(compiled, stability_arguments)
+        try:
+            with self.connection:
+                row = self.connection.execute('SELECT value FROM results WHERE key = ?',
+                                              (key,)).fetchone()
+                if row is None:
+                    self._count('misses')
+                    return None
+                self._count('hits')
+                self.connection.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                                        (time.time(), key))
+            return _decode_value(compiled, row[0])
+        except (sqlite3.Error, ValueError, KeyError, TypeError) as exc:
+            self._warn(exc)
+            return None
+
+    def put(self,
+            compiled: CompiledQuandary,
+            stability_arguments: Dict[str, Any],
+            results: Results,
+            stability_results: StabilityResults,
+            ):
+        """
+        Save results, evicting least recently used entries as needed.
+
+        :param compiled: compiled quandary
+        :param stability_arguments: run_stability_analysis() keyword arguments
+        :param results: resolved results
+        :param stability_results: stability analysis results
+        """
+        key = _cache_key(compiled, stability_arguments)
+        try:
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                        (key, _encode_value(results, stability_results),
+                                         time.time()))
+                self.connection.execute('DELETE FROM results WHERE key IN'
+                                        ' (SELECT key FROM results ORDER BY last_used DESC'
+                                        ' LIMIT -1 OFFSET ?)',
+                                        (self.max_entries,))
+        except sqlite3.Error as exc:
+            self._warn(exc)
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Get counters and the number of entries.
+
+        :return: dictionary with "hits", "misses", and "entries" counts
+        """
+        try:
+            counters = dict(self.connection.execute('SELECT name, value FROM counters'))
+            entries = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        except sqlite3.Error as exc:
+            self._warn(exc)
+            counters = {}
+            entries = 0
+        return {'hits': counters.get('hits', 0),
+                'misses': counters.get('misses', 0),
+                'entries': entries}
@@ -17,23 +17,75 @@
 
 """Quandary configuration loading, parsing, and checking."""
 
+import hashlib
+import os
+import pickle
 import yaml
-from typing import Iterable, Any, Optional, Tuple, List
+from typing import Iterable, Any, Optional, Tuple, List, Iterator, Union
 
-from .data import ChoicesMap, CriteriaMap, GenericRatings, PriorityRatings, \
-    Quandary, Criterion, MINIMUM_RATINGS_BAR_WIDTH
-from .utility import critical_error
+from .data import ChoicesMap, CriteriaMap, GenericRatings, PriorityRatings, PriorityProfiles, \
+    Quandary, Criterion, AnyQuandary, MINIMUM_RATINGS_BAR_WIDTH
+from .matrix import is_matrix_file, load_matrix_file
+from .metrics import phase
+from .utility import QuandaryError
+
+# The libyaml based loader is much faster, but is not always available.
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+CONFIGURATION_CACHE_FOLDER = 'configurations'
+# Bumped when the pickled quandary layout changes, to ignore older entries.
+CONFIGURATION_CACHE_VERSION = 2
+# Files with more quandaries are not cached, to keep loading them one at a time.
+CONFIGURATION_CACHE_MAXIMUM_QUANDARIES = 1000
+
+
+def _check_raw_data(raw_data: Any) -> dict:
+    if not isinstance(raw_data, dict):
+        raise QuandaryError('Configuration is not a YAML dictionary.')
+    return raw_data
 
 
 def _load(config_path: str) -> dict:
     try:
         with open(config_path, encoding='utf-8') as stream:
-            raw_data = yaml.safe_load(stream)
-            if not isinstance(raw_data, dict):
-                critical_error('Configuration is not a YAML dictionary.')
-            return raw_data
+            return _check_raw_data(yaml.load(stream, Loader=_YamlLoader))
     except (IOError, OSError) as exc:
-        critical_error(f'Failed to load configuration file: {config_path}: {exc}')
+        raise QuandaryError(f'Failed to load configuration file: {config_path}: {exc}')
+    except yaml.YAMLError as exc:
+        raise QuandaryError(f'Failed to parse configuration file: {config_path}: {exc}')
+
+
+def load_configuration_text(text: Union[str, bytes]) -> dict:
+    """
+    Load YAML (or JSON) configuration text, without parsing the quandary.
+
+    :param text: configuration text
+    :return: configuration dictionary
+    """
+    try:
+        return _check_raw_data(yaml.load(text, Loader=_YamlLoader))
+    except yaml.YAMLError as exc:
+        raise QuandaryError(f'Failed to parse configuration: {exc}')
+
+
+def _load_all(config_path: str) -> Iterator[Tuple[int, dict]]:
+    # Documents are parsed lazily, one at a time, and yielded with their
+    # document numbers, which include empty documents, for error messages.
+    try:
+        with open(config_path, encoding='utf-8') as stream:
+            for document_number, raw_data in enumerate(yaml.load_all(stream, Loader=_YamlLoader),
+                                                       start=1):
+                # Empty documents, e.g. after a trailing "---", are ignored.
+                if raw_data is None:
+                    continue
+                try:
+                    yield document_number, _check_raw_data(raw_data)
+                except QuandaryError as exc:
+                    raise QuandaryError(f'document {document_number}: {exc}')
+    except (IOError, OSError) as exc:
+        raise QuandaryError(f'Failed to load configuration file: {config_path}: {exc}')
+    except yaml.YAMLError as exc:
+        raise QuandaryError(f'Failed to parse configuration file: {config_path}: {exc}')
 
 
 def _parse_ratings(label: str,
@@ -42,11 +94,11 @@ def _parse_ratings(label: str,
                    valid_letters: Iterable[str],
                    ) -> GenericRatings:
     if not isinstance(raw_ratings_data, str):
-        critical_error(f'{label}: ratings bar is not a string.')
+        raise QuandaryError(f'{label}: ratings bar is not a string.')
     ratings_bar = raw_ratings_data
     if len(ratings_bar) < MINIMUM_RATINGS_BAR_WIDTH:
-        critical_error(f'{label}: ratings bar is not at least'
-                       f' {MINIMUM_RATINGS_BAR_WIDTH} characters wide.')
+        raise QuandaryError(f'{label}: ratings bar is not at least'
+                            f' {MINIMUM_RATINGS_BAR_WIDTH} characters wide.')
     divisor = len(ratings_bar) - 1
     ratings = {
         letter.upper(): pos / divisor
@@ -75,13 +127,13 @@ def _check_letters(label: str,
         letter_errors.append(f'missing {valid_label} letter(s):'
                              f' {", ".join(missing_letters)}')
     if letter_errors:
-        critical_error(f'{label}: {", ".join(letter_errors)}')
+        raise QuandaryError(f'{label}: {", ".join(letter_errors)}')
 
 
 class _ConfigurationLoader:
 
-    def __init__(self, config_path: str):
-        self.raw_data = _load(config_path)
+    def __init__(self, raw_data: dict):
+        self.raw_data = raw_data
         self._configuration: Optional[Quandary] = None
 
     @property
@@ -90,14 +142,14 @@ class _ConfigurationLoader:
             description = self._parse_description()
             choices = self._parse_choices()
             criteria = self._parse_criteria(choices)
-            priorities = self._parse_priorities(criteria)
-            self._configuration = Quandary(description, choices, criteria, priorities)
+            priorities, profiles = self._parse_priorities(criteria)
+            self._configuration = Quandary(description, choices, criteria, priorities, profiles)
         return self._configuration
 
     def _parse_description(self) -> str:
         label, quandary_data = self._get_block('quandary')
         if 'description' not in quandary_data:
-            critical_error(f'{label} has no "description" element.')
+            raise QuandaryError(f'{label} has no "description" element.')
         return str(quandary_data['description'])
 
     def _parse_choices(self) -> ChoicesMap:
@@ -106,9 +158,9 @@ class _ConfigurationLoader:
         for choice_letter, choice_data in choices_data.items():
             choice_letter = choice_letter.upper()
             if not isinstance(choice_data, dict):
-                critical_error(f'Choice "{choice_letter}" is not a dictionary.')
+                raise QuandaryError(f'Choice "{choice_letter}" is not a dictionary.')
             if 'name' not in choice_data:
-                critical_error(f'Choice "{choice_letter}" has no "name" element.')
+                raise QuandaryError(f'Choice "{choice_letter}" has no "name" element.')
             choices_map[choice_letter] = str(choice_data['name'])
         return choices_map
 
@@ -120,11 +172,11 @@ class _ConfigurationLoader:
             criterion_label = f'criterion.{criterion_letter}'
             ratings_label = f'{criterion_label}.ratings'
             if not isinstance(criterion_data, dict):
-                critical_error(f'{criterion_label} is not a dictionary.')
+                raise QuandaryError(f'{criterion_label} is not a dictionary.')
             if 'name' not in criterion_data:
-                critical_error(f'{criterion_label} has no "name" element.')
+                raise QuandaryError(f'{criterion_label} has no "name" element.')
             if 'ratings' not in criterion_data:
-                critical_error(f'{ratings_label} is missing.')
+                raise QuandaryError(f'{ratings_label} is missing.')
             choice_ratings = _parse_ratings(ratings_label,
                                             criterion_data['ratings'],
                                             'choice',
@@ -133,23 +185,60 @@ class _ConfigurationLoader:
             criteria_map[criterion_letter] = Criterion(name, choice_ratings)
         return criteria_map
 
-    def _parse_priorities(self, criteria: CriteriaMap) -> PriorityRatings:
+    def _parse_priorities(self, criteria: CriteriaMap) -> Tuple[PriorityRatings,
+                                                                PriorityProfiles]:
         label, priorities_data = self._get_block('priorities')
         ratings_label = f'{label}.ratings'
+        if 'profiles' in priorities_data:
+            if 'ratings' in priorities_data:
+                raise QuandaryError(f'{label}: "ratings" and "profiles" are mutually exclusive.')
+            profiles = self._parse_profiles(label, priorities_data['profiles'], criteria)
+            # The consensus priorities are the profile averages, which by
+            # linearity rank choices by their average profile rating.
+            priorities = {criterion_letter: sum(profile[criterion_letter]
+                                                for profile in profiles.values()) / len(profiles)
+                          for criterion_letter in criteria.keys()}
+            return priorities, profiles
         if 'ratings' not in priorities_data:
-            critical_error(f'{ratings_label}: missing ratings bar.')
+            raise QuandaryError(f'{ratings_label}: missing ratings bar.')
         return _parse_ratings(ratings_label,
                               priorities_data['ratings'],
                               'criterion',
-                              criteria.keys())
+                              criteria.keys()), {}
+
+    @staticmethod
+    def _parse_profiles(label: str,
+                        profiles_data: Any,
+                        criteria: CriteriaMap,
+                        ) -> PriorityProfiles:
+        profiles_label = f'{label}.profiles'
+        if not isinstance(profiles_data, list) or not profiles_data:
+            raise QuandaryError(f'{profiles_label}: not a non-empty list.')
+        profiles: PriorityProfiles = {}
+        for profile_idx, profile_data in enumerate(profiles_data):
+            profile_label = f'{profiles_label}[{profile_idx}]'
+            if not isinstance(profile_data, dict):
+                raise QuandaryError(f'{profile_label} is not a dictionary.')
+            if 'name' not in profile_data:
+                raise QuandaryError(f'{profile_label} has no "name" element.')
+            if 'ratings' not in profile_data:
+                raise QuandaryError(f'{profile_label}.ratings: missing ratings bar.')
+            name = str(profile_data['name'])
+            if name in profiles:
+                raise QuandaryError(f'{profile_label}: duplicate profile name "{name}".')
+            profiles[name] = _parse_ratings(f'{profile_label}.ratings',
+                                            profile_data['ratings'],
+                                            'criterion',
+                                            criteria.keys())
+        return profiles
 
     def _get_block(self, name: str) -> Tuple[str, dict]:
         label = f'configuration.{name}'
         if name not in self.raw_data:
-            critical_error(f'{label}: missing block.')
+            raise QuandaryError(f'{label}: missing block.')
         block_data = self.raw_data[name]
         if not isinstance(block_data, dict):
-            critical_error(f'{label}: block is not a dictionary.')
+            raise QuandaryError(f'{label}: block is not a dictionary.')
         return label, block_data
 
 
@@ -160,4 +249,113 @@ def parse_configuration_file(path: str) -> Quandary:
     :param path: configuration file path
     :return: parsed quandary data
     """
-    return _ConfigurationLoader(path).configuration
+    return _ConfigurationLoader(_load(path)).configuration
+
+
+def parse_configuration_data(raw_data: Any) -> Quandary:
+    """
+    Parse already loaded configuration data, e.g. from YAML or JSON.
+
+    :param raw_data: configuration dictionary
+    :return: parsed quandary data
+    """
+    return _ConfigurationLoader(_check_raw_data(raw_data)).configuration
+
+
+class _ConfigurationCache:
+    """
+    Pickled parsed and validated quandaries, by configuration file path.
+
+    Entries are only used if the file modification time and size still match.
+    """
+
+    def __init__(self, directory: str, config_path: str):
+        self.path = os.path.join(
+            directory,
+            CONFIGURATION_CACHE_FOLDER,
+            hashlib.sha256(os.path.abspath(config_path).encode()).hexdigest() + '.pickle')
+        try:
+            stat = os.stat(config_path)
+            self.signature = (CONFIGURATION_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            self.signature = None
+
+    def load(self) -> Optional[List[Quandary]]:
+        if self.signature is None:
+            return None
+        try:
+            with open(self.path, 'rb') as stream:
+                signature, quandaries = pickle.load(stream)
+        except Exception:
+            # The cache is only advisory, and stale or foreign data can raise
+            # just about anything when unpickled.
+            return None
+        return quandaries if signature == self.signature else None
+
+    def save(self, quandaries: List[Quandary]):
+        if self.signature is None:
+            return
+        # Write to a temporary file first, so that concurrent readers never
+        # see partially written data.
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f'{self.path}.{os.getpid()}'
+        with open(temporary_path, 'wb') as stream:
+            pickle.dump((self.signature, quandaries), stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.path)
+
+
+def iterate_configuration_file(path: str, cache_directory: str = None) -> Iterator[AnyQuandary]:
+    """
+    Parse YAML configuration file with one or more documents, one at a time.
+
+    CSV and NumPy matrix files are also accepted, and produce a single
+    quandary that is already compiled.
+
+    :param path: configuration file path
+    :param cache_directory: optional directory for caching parsed quandaries
+    :return: parsed quandary data iterator
+    """
+    if is_matrix_file(path):
+        # Matrix files load quickly enough without caching.
+        with phase('load'):
+            compiled = load_matrix_file(path)
+        yield compiled
+        return
+    configuration_cache = None
+    if cache_directory is not None:
+        with phase('load'):
+            configuration_cache = _ConfigurationCache(cache_directory, path)
+            quandaries = configuration_cache.load()
+        if quandaries is not None:
+            yield from quandaries
+            return
+    quandaries: List[Quandary] = []
+    quandary_count = 0
+    documents = _load_all(path)
+    while True:
+        # Documents are loaded lazily, so loading is timed one document at a time.
+        with phase('load'):
+            document = next(documents, None)
+        if document is None:
+            break
+        document_number, raw_data = document
+        quandary_count += 1
+        with phase('validate'):
+            try:
+                quandary = _ConfigurationLoader(raw_data).configuration
+            except QuandaryError as exc:
+                raise QuandaryError(f'document {document_number}: {exc}')
+        if configuration_cache is not None:
+            if quandary_count > CONFIGURATION_CACHE_MAXIMUM_QUANDARIES:
+                configuration_cache = None
+                quandaries = []
+            else:
+                quandaries.append(quandary)
+        yield quandary
+    if quandary_count == 0:
+        raise QuandaryError(f'Configuration file has no quandaries: {path}')
+    if configuration_cache is not None:
+        try:
+            configuration_cache.save(quandaries)
+        except OSError:
+            pass
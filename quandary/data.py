@@ -17,8 +17,9 @@
 
 """Quandary data types and constants."""
 
-from dataclasses import dataclass
-from typing import List, Dict
+from array import array
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Union
 
 # GenericLetter type is cast or replaced by more specific type where it is known.
 GenericLetter = str
@@ -36,6 +37,8 @@ ChoiceRatings = Dict[ChoiceLetter, Rating]
 CriteriaChoiceRatings = Dict[CriterionLetter, ChoiceRatings]
 PriorityRatings = Dict[CriterionLetter, Rating]
 ChoicesMap = Dict[ChoiceLetter, ChoiceLabel]
+ProfileName = str
+PriorityProfiles = Dict[ProfileName, PriorityRatings]
 
 # Various constants and defaults.
 DESCRIPTION = 'Quandary resolver'
@@ -50,6 +53,51 @@ MINIMUM_RANDOM_TRIALS = 10
 MAXIMUM_RANDOM_TRIALS = 10000
 DEFAULT_STABILITY_PERCENTAGE = 70
 MINIMUM_RATINGS_BAR_WIDTH = 20
+STABILITY_ENGINES = ['python', 'numpy']
+DEFAULT_STABILITY_ENGINE = 'python'
+DEFAULT_JOBS = 1
+MINIMUM_JOBS = 0
+MAXIMUM_JOBS = 1024
+MINIMUM_SEED = 0
+MAXIMUM_SEED = 2 ** 64 - 1
+DEFAULT_ERROR_PERCENTAGE = 1.0
+MINIMUM_ERROR_PERCENTAGE = 0.001
+MAXIMUM_ERROR_PERCENTAGE = 50.0
+ADAPTIVE_BLOCK_TRIALS = 100
+STABILITY_SEARCHES = ['linear', 'bisect', 'sweep']
+DEFAULT_STABILITY_SEARCH = 'linear'
+BISECT_VERIFY_STEPS = 3
+SWEEP_BLOCK_TRIALS = 100
+SHARD_BLOCK_TRIALS = 100
+SHARD_FILE_VERSION = 2
+HISTORY_CSV_COLUMNS = ['path', 'commit', 'time', 'ranking', 'confidence', 'error']
+DEFAULT_HISTORY_REVISIONS = 'HEAD'
+DEFAULT_HISTORY_COUNT = 0
+MINIMUM_HISTORY_COUNT = 0
+MAXIMUM_HISTORY_COUNT = 1000000
+DEFAULT_REFINE_TRIALS = 0
+MINIMUM_REFINE_TRIALS = 0
+MAXIMUM_REFINE_TRIALS = MAXIMUM_RANDOM_TRIALS
+DEFAULT_CACHE_SIZE = 10000
+MINIMUM_CACHE_SIZE = 1
+MAXIMUM_CACHE_SIZE = 10000000
+DEFAULT_WATCH_INTERVAL = 0.1
+MINIMUM_WATCH_INTERVAL = 0.01
+MAXIMUM_WATCH_INTERVAL = 60.0
+DEFAULT_EXACT_LIMIT = 4096
+MINIMUM_EXACT_LIMIT = 0
+MAXIMUM_EXACT_LIMIT = 2 ** 24
+DEFAULT_TOP_K = 0
+MINIMUM_TOP_K = 0
+MAXIMUM_TOP_K = 1000000
+MATRIX_FILE_EXTENSIONS = ('.csv', '.npy')
+DEFAULT_SERVE_HOST = '127.0.0.1'
+DEFAULT_SERVE_PORT = 8470
+MINIMUM_SERVE_PORT = 0
+MAXIMUM_SERVE_PORT = 65535
+SERVE_LATENCY_SAMPLES = 1000
+REPORT_FORMATS = ['text', 'json', 'ndjson', 'csv']
+DEFAULT_REPORT_FORMAT = 'text'
 
 
 @dataclass
@@ -60,6 +108,27 @@ class Options:
     random_trials: int
     stability_percentage: int
     details: bool
+    engine: str
+    jobs: int
+    seed: Optional[int]
+    adaptive: bool
+    error_percentage: float
+    search: str
+    refine_trials: int
+    batch: bool
+    cache_directory: Optional[str]
+    cache_size: int
+    cache_stats: bool
+    watch: bool
+    watch_interval: float
+    exact_limit: int
+    top_k: Optional[int]
+    timings: bool
+    metrics_path: Optional[str]
+    profile_path: Optional[str]
+    report_format: str
+    sensitivity: bool
+    rank_statistics: bool
     quandary_paths: List[str]
 
 
@@ -75,11 +144,84 @@ CriteriaMap = Dict[CriterionLetter, Criterion]
 
 @dataclass
 class Quandary:
-    """Quandary definition based on the parsed configuration."""
+    """
+    Quandary definition based on the parsed configuration.
+
+    With priority profiles, the priority ratings are the profile averages.
+    """
     description: str
     choices: ChoicesMap
     criteria: CriteriaMap
     priority_ratings: PriorityRatings
+    priority_profiles: PriorityProfiles = field(default_factory=dict)
+
+
+class CompiledQuandary:
+    """
+    Quandary compiled for fast resolution.
+
+    Choices and criteria are identified by integer indexes. Choice ratings are
+    stored flat, in criteria x choices order, with unrated choices set to zero
+    and excluded from the rated indexes. Criteria without priority ratings are
+    left out, since they do not contribute to totals.
+
+    Priority profiles, if any, are stored flat too, in profiles x criteria
+    order, and share the choice ratings.
+
+    The original quandary is kept as a view for reporting.
+    """
+    __slots__ = ('quandary', 'choice_letters', 'criterion_letters',
+                 'ratings', 'rated_indexes', 'priorities',
+                 'profile_names', 'profile_priorities')
+
+    def __init__(self,
+                 quandary: Quandary,
+                 choice_letters: List[ChoiceLetter],
+                 criterion_letters: List[CriterionLetter],
+                 ratings: array,
+                 rated_indexes: array,
+                 priorities: array,
+                 profile_names: List[ProfileName] = None,
+                 profile_priorities: array = None,
+                 ):
+        self.quandary = quandary
+        self.choice_letters = choice_letters
+        self.criterion_letters = criterion_letters
+        self.ratings = ratings
+        self.rated_indexes = rated_indexes
+        self.priorities = priorities
+        self.profile_names = profile_names if profile_names is not None else []
+        self.profile_priorities = profile_priorities if profile_priorities is not None \
+            else array('d')
+
+    @property
+    def choice_count(self) -> int:
+        return len(self.choice_letters)
+
+    @property
+    def criterion_count(self) -> int:
+        return len(self.criterion_letters)
+
+    def profile(self, profile_idx: int) -> 'CompiledQuandary':
+        """
+        Get a priority profile as a compiled quandary, sharing the choice ratings.
+
+        :param profile_idx: profile index
+        :return: compiled quandary with the profile's priorities
+        """
+        criterion_count = self.criterion_count
+        priorities = self.profile_priorities[profile_idx * criterion_count:
+                                             (profile_idx + 1) * criterion_count]
+        return CompiledQuandary(self.quandary,
+                                self.choice_letters,
+                                self.criterion_letters,
+                                self.ratings,
+                                self.rated_indexes,
+                                priorities)
+
+
+# Quandary-accepting functions also accept compiled quandaries.
+AnyQuandary = Union[Quandary, CompiledQuandary]
 
 
 @dataclass
@@ -87,9 +229,242 @@ class ChoiceResult:
     """Choice result, with rating."""
     label: ChoiceLabel
     rating: float
+    letter: Optional[ChoiceLetter] = None
+
+
+@dataclass
+class RankingMove:
+    """Choice ranking position change, with ranks starting at 1."""
+    letter: ChoiceLetter
+    old_rank: int
+    new_rank: int
 
 
 @dataclass
 class Results:
-    """Evaluation results with ranked choice results."""
+    """
+    Evaluation results with ranked choice results.
+
+    With priority profiles, the choice rankings are the consensus rankings,
+    i.e. for the average profile, and each profile also has its own.
+    """
     choice_rankings: List[ChoiceResult]
+    profile_rankings: Dict[ProfileName, List[ChoiceResult]] = field(default_factory=dict)
+
+
+@dataclass
+class RankStatistics:
+    """
+    Rank frequencies and total rating sums by choice, for one stability step.
+
+    Arrays are allocated once, and are flat, in compiled choice order. Rank
+    counts are choices x ranks, with the top rank first.
+    """
+    choice_letters: List[ChoiceLetter]
+    trial_count: int
+    rank_counts: array
+    total_sums: array
+    total_squares: array
+
+    @classmethod
+    def allocate(cls, choice_letters: List[ChoiceLetter]) -> 'RankStatistics':
+        """
+        Create empty statistics.
+
+        :param choice_letters: choice letters, in compiled order
+        :return: statistics with zero counts
+        """
+        choice_count = len(choice_letters)
+        return cls(choice_letters,
+                   0,
+                   array('q', bytes(8 * choice_count * choice_count)),
+                   array('d', bytes(8 * choice_count)),
+                   array('d', bytes(8 * choice_count)))
+
+    def add_trial(self, totals: List[float], order: List[int]):
+        """
+        Add one trial.
+
+        :param totals: choice totals
+        :param order: choice indexes, in ranked order
+        """
+        choice_count = len(totals)
+        rank_counts = self.rank_counts
+        for rank_idx, choice_idx in enumerate(order):
+            rank_counts[choice_idx * choice_count + rank_idx] += 1
+        total_sums = self.total_sums
+        total_squares = self.total_squares
+        for choice_idx, total in enumerate(totals):
+            total_sums[choice_idx] += total
+            total_squares[choice_idx] += total * total
+        self.trial_count += 1
+
+    def add(self, other: 'RankStatistics'):
+        """
+        Add statistics for more trials of the same step.
+
+        :param other: other statistics
+        """
+        for idx, count in enumerate(other.rank_counts):
+            self.rank_counts[idx] += count
+        for idx, (total_sum, total_square) in enumerate(zip(other.total_sums,
+                                                            other.total_squares)):
+            self.total_sums[idx] += total_sum
+            self.total_squares[idx] += total_square
+        self.trial_count += other.trial_count
+
+    def rank_frequencies(self, choice_idx: int) -> List[float]:
+        """
+        Get the fraction of trials with each rank for a choice.
+
+        :param choice_idx: choice index
+        :return: fractions by rank, with the top rank first
+        """
+        choice_count = len(self.choice_letters)
+        counts = self.rank_counts[choice_idx * choice_count:(choice_idx + 1) * choice_count]
+        return [count / self.trial_count for count in counts]
+
+    def top_probability(self, choice_idx: int) -> float:
+        """
+        Get the fraction of trials where a choice ranks first.
+
+        :param choice_idx: choice index
+        :return: top rank fraction
+        """
+        return self.rank_counts[choice_idx * len(self.choice_letters)] / self.trial_count
+
+    def total_mean(self, choice_idx: int) -> float:
+        """
+        Get the mean total rating of a choice.
+
+        :param choice_idx: choice index
+        :return: mean total rating
+        """
+        return self.total_sums[choice_idx] / self.trial_count
+
+    def total_variance(self, choice_idx: int) -> float:
+        """
+        Get the (population) variance of the total rating of a choice.
+
+        :param choice_idx: choice index
+        :return: total rating variance
+        """
+        mean = self.total_mean(choice_idx)
+        return max(self.total_squares[choice_idx] / self.trial_count - mean * mean, 0.0)
+
+
+@dataclass
+class StabilityStep:
+    """
+    Stability trial results for one randomization step.
+
+    Rank statistics are only collected when requested.
+    """
+    perturbation: float
+    changed_count: int
+    trial_count: int
+    rank_statistics: Optional[RankStatistics] = None
+
+
+@dataclass
+class Sensitivity:
+    """
+    Smallest change to one priority or choice rating that alters the rankings.
+
+    The change is None when no change that keeps the value between 0 and 1
+    alters the rankings. Otherwise, the higher and lower ranked choices are
+    the first pair to swap.
+    """
+    criterion_letter: CriterionLetter
+    choice_letter: Optional[ChoiceLetter]
+    value: float
+    change: Optional[float]
+    higher_letter: Optional[ChoiceLetter] = None
+    lower_letter: Optional[ChoiceLetter] = None
+
+    @property
+    def is_priority(self) -> bool:
+        return self.choice_letter is None
+
+
+@dataclass
+class StabilityProgress:
+    """Stability analysis progress, reported as each randomization step finishes."""
+    random_step: int
+    perturbation: float
+    changed_fraction: float
+    trial_count: int
+    elapsed: float
+    stability: float
+    finished: bool
+
+
+@dataclass
+class StabilityResults:
+    """
+    Stability analysis results, with the randomization steps that ran.
+
+    With priority profiles, each profile also has its own stability.
+    """
+    stability: Optional[float]
+    steps: List[StabilityStep]
+    profile_stability: Dict[ProfileName, Optional[float]] = field(default_factory=dict)
+
+    @property
+    def rank_statistics_step(self) -> Optional[StabilityStep]:
+        """
+        Get the step with rank statistics at the confidence level.
+
+        :return: highest stable step, or the lowest step if none are stable,
+                 or None without rank statistics
+        """
+        if not self.steps or self.steps[0].rank_statistics is None:
+            return None
+        stable_steps = [step for step in self.steps
+                        if self.stability is not None
+                        and step.perturbation <= self.stability + 1e-9]
+        return stable_steps[-1] if stable_steps else self.steps[0]
+
+    @property
+    def rank_statistics(self) -> Optional[RankStatistics]:
+        """
+        Get the rank statistics at the confidence level.
+
+        :return: rank statistics or None if not collected
+        """
+        step = self.rank_statistics_step
+        return step.rank_statistics if step is not None else None
+
+
+@dataclass
+class StabilityShard:
+    """
+    Partial stability results for a range of steps and trials, to be merged.
+
+    Steps are keyed by step number, and trials are numbered from 1.
+    """
+    fingerprint: str
+    random_steps: int
+    random_trials: int
+    seed: Optional[int]
+    engine: str
+    top_k: Optional[int]
+    first_trial: int
+    last_trial: int
+    steps: Dict[int, StabilityStep]
+
+
+@dataclass
+class HistoryRevision:
+    """
+    Quandary results for one git revision of a configuration file.
+
+    Revisions with the same numeric data (fingerprint) share their results.
+    The error is set, and the results are not, if the revision failed to load.
+    """
+    commit: str
+    time: str
+    fingerprint: Optional[str] = None
+    results: Optional[Results] = None
+    stability_results: Optional[StabilityResults] = None
+    error: Optional[str] = None
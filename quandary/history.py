@@ -0,0 +1,191 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Quandary results across the git revision history of a configuration file."""
+
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Dict, Optional
+
+from .analysis import compile_quandary, relabel_results
+from .batch import analyze_quandary, worker_options
+from .cache import quandary_fingerprint
+from .configuration import load_configuration_text, parse_configuration_data
+from .data import Options, CompiledQuandary, Results, StabilityResults, HistoryRevision
+from .matrix import is_matrix_file
+from .metrics import start_file, phase
+from .utility import QuandaryError
+
+
+def _run_git(directory: str, arguments: List[str], input_data: bytes = None) -> bytes:
+    try:
+        completed = subprocess.run(['git', '-C', directory] + arguments,
+                                   input=input_data,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   check=False)
+    except OSError as exc:
+        raise QuandaryError(f'Failed to run git: {exc}')
+    if completed.returncode != 0:
+        message = completed.stderr.decode(errors='replace').strip()
+        raise QuandaryError(f'git {arguments[0]} failed: {message}')
+    return completed.stdout
+
+
+def list_revisions(config_path: str,
+                   revisions: str,
+                   max_count: int,
+                   ) -> List[Tuple[str, str, str]]:
+    """
+    List the commits that changed a configuration file, oldest first.
+
+    :param config_path: configuration file path, in a git working tree
+    :param revisions: git revision range, e.g. "HEAD" or "v1.0..main"
+    :param max_count: maximum number of (most recent) commits, 0 for all
+    :return: (commit, ISO 8601 commit time, repository-relative path) triples
+    """
+    directory = os.path.dirname(os.path.abspath(config_path))
+    prefix = _run_git(directory, ['rev-parse', '--show-prefix']).decode().strip()
+    repository_path = prefix + os.path.basename(config_path)
+    arguments = ['log', '--format=%H %cI']
+    if max_count:
+        arguments.append(f'--max-count={max_count}')
+    # Path specifications are relative to the directory, unlike object names.
+    output = _run_git(directory, arguments + [revisions, '--', os.path.basename(config_path)])
+    commits = [line.split(' ', 1) for line in output.decode().splitlines() if line]
+    return [(commit, time, repository_path) for commit, time in reversed(commits)]
+
+
+def _read_blob_ids(directory: str, object_names: List[str]) -> List[Optional[str]]:
+    # One "git cat-file" process for all revisions. Deleted files are missing.
+    output = _run_git(directory,
+                      ['cat-file', '--batch-check=%(objectname) %(objecttype)'],
+                      ''.join(f'{name}\n' for name in object_names).encode())
+    blob_ids: List[Optional[str]] = []
+    for line in output.decode().splitlines():
+        fields = line.rsplit(' ', 1)
+        blob_ids.append(fields[0] if fields[1] == 'blob' else None)
+    return blob_ids
+
+
+def _read_blobs(directory: str, blob_ids: List[str]) -> Dict[str, bytes]:
+    # Each object is a "<id> <type> <size>" header line, and the content
+    # followed by a newline.
+    output = _run_git(directory,
+                      ['cat-file', '--batch'],
+                      ''.join(f'{blob_id}\n' for blob_id in blob_ids).encode())
+    blobs: Dict[str, bytes] = {}
+    position = 0
+    for blob_id in blob_ids:
+        header_end = output.index(b'\n', position)
+        size = int(output[position:header_end].split()[2])
+        blobs[blob_id] = output[header_end + 1:header_end + 1 + size]
+        position = header_end + 2 + size
+    return blobs
+
+
+def _compile_blob(blob: bytes) -> CompiledQuandary:
+    with phase('load'):
+        raw_data = load_configuration_text(blob)
+    with phase('validate'):
+        quandary = parse_configuration_data(raw_data)
+    with phase('compile'):
+        return compile_quandary(quandary)
+
+
+def _analyze_in_worker(compiled: CompiledQuandary,
+                       options: Options,
+                       ) -> Tuple[Results, StabilityResults]:
+    return analyze_quandary(compiled, options, 1)
+
+
+def _analyze_distinct(compiled_quandaries: List[CompiledQuandary],
+                      options: Options,
+                      ) -> List[Tuple[Results, StabilityResults]]:
+    # Distinct revisions are analyzed in parallel, like batch files, and each
+    # worker runs stability analysis inline.
+    jobs = min(options.jobs or os.cpu_count() or 1, len(compiled_quandaries))
+    if jobs <= 1:
+        return [analyze_quandary(compiled, options, options.jobs)
+                for compiled in compiled_quandaries]
+    options = worker_options(options)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_analyze_in_worker,
+                                 compiled_quandaries,
+                                 [options] * len(compiled_quandaries)))
+
+
+def run_history(config_path: str,
+                options: Options,
+                revisions: str,
+                max_count: int,
+                ) -> List[HistoryRevision]:
+    """
+    Resolve and analyze a configuration file at each git revision that changed it.
+
+    Revisions are read from the repository without checking them out. Each
+    file version is parsed once, and revisions with the same numeric data
+    (fingerprint) are analyzed once, so that e.g. reworded labels or reverted
+    changes cost nothing extra. The result cache is also used, if enabled.
+
+    :param config_path: YAML configuration file path, with one quandary
+    :param options: runtime options
+    :param revisions: git revision range, e.g. "HEAD" or "v1.0..main"
+    :param max_count: maximum number of (most recent) revisions, 0 for all
+    :return: results by revision, oldest first
+    """
+    if is_matrix_file(config_path):
+        raise QuandaryError('History is only available for YAML configuration files.')
+    start_file(config_path)
+    directory = os.path.dirname(os.path.abspath(config_path))
+    commits = list_revisions(config_path, revisions, max_count)
+    if not commits:
+        raise QuandaryError(f'No git revisions found for "{revisions}".')
+    blob_ids = _read_blob_ids(directory,
+                              [f'{commit}:{path}' for commit, _time, path in commits])
+    unique_blob_ids = list(dict.fromkeys(blob_id for blob_id in blob_ids if blob_id is not None))
+    blobs = _read_blobs(directory, unique_blob_ids)
+    compiled_by_blob: Dict[str, CompiledQuandary] = {}
+    errors_by_blob: Dict[str, str] = {}
+    for blob_id in unique_blob_ids:
+        try:
+            compiled_by_blob[blob_id] = _compile_blob(blobs[blob_id])
+        except QuandaryError as exc:
+            errors_by_blob[blob_id] = str(exc)
+    fingerprints = {blob_id: quandary_fingerprint(compiled)
+                    for blob_id, compiled in compiled_by_blob.items()}
+    distinct: Dict[str, CompiledQuandary] = {}
+    for blob_id, compiled in compiled_by_blob.items():
+        distinct.setdefault(fingerprints[blob_id], compiled)
+    analyses = dict(zip(distinct, _analyze_distinct(list(distinct.values()), options)))
+    history: List[HistoryRevision] = []
+    for (commit, time, _path), blob_id in zip(commits, blob_ids):
+        if blob_id is None:
+            history.append(HistoryRevision(commit, time, error='file not found'))
+        elif blob_id in errors_by_blob:
+            history.append(HistoryRevision(commit, time, error=errors_by_blob[blob_id]))
+        else:
+            fingerprint = fingerprints[blob_id]
+            results, stability_results = analyses[fingerprint]
+            history.append(HistoryRevision(commit,
+                                           time,
+                                           fingerprint,
+                                           relabel_results(compiled_by_blob[blob_id], results),
+                                           stability_results))
+    return history
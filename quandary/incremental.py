@@ -0,0 +1,213 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Incremental resolution for interactive ratings editing."""
+
+import operator
+from array import array
+from typing import List, Optional, Iterable
+
+from .analysis import compile_quandary, resolve_quandary
+from .data import AnyQuandary, CompiledQuandary, Results, ChoiceResult, RankingMove, \
+    ChoiceLetter, CriterionLetter
+from .utility import QuandaryError
+
+# Neighboring totals closer than this may be exact ties, and are recalculated.
+_TIE_TOLERANCE = 1e-9
+
+
+class IncrementalResolver:
+    """
+    Keeps choice totals and rankings up to date as single ratings change.
+
+    A choice rating change adjusts one total, and moves the choice to its new
+    ranking position, found by binary search. A priority change adjusts every
+    total, and re-sorts the nearly sorted ranking. Neither change parses the
+    configuration, or recalculates totals from all ratings.
+
+    Totals are kept up to date by adding differences, so after many changes
+    they may differ from resolve_quandary() by floating point rounding. Totals
+    that are nearly tied with a neighbor are recalculated, so that ties are
+    ranked like resolve_quandary() ranks them, and refresh() recalculates all
+    totals.
+    """
+
+    def __init__(self, quandary: AnyQuandary):
+        # The compiled ratings are copied, since they are changed in place.
+        compiled = compile_quandary(quandary)
+        self.quandary = compiled.quandary
+        self.choice_letters = compiled.choice_letters
+        self.criterion_letters = compiled.criterion_letters
+        self.choice_count = compiled.choice_count
+        self.choice_indexes = {letter: idx for idx, letter in enumerate(self.choice_letters)}
+        self.criterion_indexes = {letter: idx for idx, letter in enumerate(self.criterion_letters)}
+        self.ratings = array('d', compiled.ratings)
+        self.rated = set(compiled.rated_indexes)
+        self.priorities = array('d', compiled.priorities)
+        self.totals: List[float] = []
+        self.order: List[int] = []
+        self.refresh()
+
+    def refresh(self):
+        """Recalculate totals and rankings from all ratings."""
+        compiled = CompiledQuandary(self.quandary,
+                                    self.choice_letters,
+                                    self.criterion_letters,
+                                    self.ratings,
+                                    array('l', sorted(self.rated)),
+                                    self.priorities)
+        choice_rankings = resolve_quandary(compiled).choice_rankings
+        self.order = [self.choice_indexes[ranking.letter] for ranking in choice_rankings]
+        self.totals = [0.0] * self.choice_count
+        for ranking in choice_rankings:
+            self.totals[self.choice_indexes[ranking.letter]] = ranking.rating
+
+    def _rank_key(self, choice_idx: int):
+        # Ranked by descending total, with ties in configuration order.
+        return -self.totals[choice_idx], choice_idx
+
+    def _rating_index(self,
+                      criterion_letter: CriterionLetter,
+                      choice_letter: ChoiceLetter,
+                      ) -> int:
+        if criterion_letter not in self.criterion_indexes:
+            raise QuandaryError(f'Unknown criterion letter: {criterion_letter}')
+        if choice_letter not in self.choice_indexes:
+            raise QuandaryError(f'Unknown choice letter: {choice_letter}')
+        return (self.criterion_indexes[criterion_letter] * self.choice_count
+                + self.choice_indexes[choice_letter])
+
+    @staticmethod
+    def _check_rating(rating: float):
+        if not 0 <= rating <= 1:
+            raise QuandaryError(f'Rating must be between 0 and 1: {rating}')
+
+    def set_rating(self,
+                   criterion_letter: CriterionLetter,
+                   choice_letter: ChoiceLetter,
+                   rating: Optional[float],
+                   ) -> List[RankingMove]:
+        """
+        Change one choice rating for a criterion.
+
+        :param criterion_letter: criterion letter
+        :param choice_letter: choice letter
+        :param rating: new rating, between 0 and 1, or None to leave it unrated
+        :return: ranking moves, for the choices with new ranks
+        """
+        rating_idx = self._rating_index(criterion_letter, choice_letter)
+        if rating is None:
+            self.rated.discard(rating_idx)
+            rating = 0.0
+        else:
+            self._check_rating(rating)
+            self.rated.add(rating_idx)
+        change = rating - self.ratings[rating_idx]
+        self.ratings[rating_idx] = rating
+        if change == 0:
+            return []
+        choice_idx = self.choice_indexes[choice_letter]
+        priority = self.priorities[self.criterion_indexes[criterion_letter]]
+        self.totals[choice_idx] += change * priority
+        old_order = list(self.order)
+        # The choice moves to its new position, found by binary search, and
+        # the choices in between shift by one position.
+        order = self.order
+        del order[order.index(choice_idx)]
+        key = self._rank_key(choice_idx)
+        low = 0
+        high = len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._rank_key(order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        order.insert(low, choice_idx)
+        self._repair_ties([low])
+        return self._moves(old_order)
+
+    def _exact_total(self, choice_idx: int) -> float:
+        # Same calculation as resolve_quandary().
+        return sum(map(operator.mul,
+                       self.ratings[choice_idx::self.choice_count],
+                       self.priorities))
+
+    def _repair_ties(self, positions: Iterable[int]):
+        # Recalculates nearly tied totals next to the given ranking positions.
+        order = self.order
+        totals = self.totals
+        repaired = False
+        for position in positions:
+            for neighbor_position in (position - 1, position + 1):
+                if not 0 <= neighbor_position < len(order):
+                    continue
+                choice_idx = order[position]
+                neighbor_idx = order[neighbor_position]
+                if abs(totals[choice_idx] - totals[neighbor_idx]) <= _TIE_TOLERANCE:
+                    totals[choice_idx] = self._exact_total(choice_idx)
+                    totals[neighbor_idx] = self._exact_total(neighbor_idx)
+                    repaired = True
+        if repaired:
+            self.order = sorted(order, key=self._rank_key)
+
+    def _moves(self, old_order: List[int]) -> List[RankingMove]:
+        old_ranks = {choice_idx: position + 1 for position, choice_idx in enumerate(old_order)}
+        return [RankingMove(self.choice_letters[choice_idx], old_ranks[choice_idx], position + 1)
+                for position, choice_idx in enumerate(self.order)
+                if old_ranks[choice_idx] != position + 1]
+
+    def set_priority(self,
+                     criterion_letter: CriterionLetter,
+                     priority: float,
+                     ) -> List[RankingMove]:
+        """
+        Change one criterion priority rating.
+
+        :param criterion_letter: criterion letter
+        :param priority: new priority rating, between 0 and 1
+        :return: ranking moves, for the choices with new ranks
+        """
+        if criterion_letter not in self.criterion_indexes:
+            raise QuandaryError(f'Unknown criterion letter: {criterion_letter}')
+        self._check_rating(priority)
+        criterion_idx = self.criterion_indexes[criterion_letter]
+        change = priority - self.priorities[criterion_idx]
+        self.priorities[criterion_idx] = priority
+        if change == 0:
+            return []
+        first_rating_idx = criterion_idx * self.choice_count
+        totals = self.totals
+        for choice_idx in range(self.choice_count):
+            totals[choice_idx] += change * self.ratings[first_rating_idx + choice_idx]
+        old_order = self.order
+        # The previous order is nearly sorted, which sorts in close to linear time.
+        self.order = sorted(old_order, key=self._rank_key)
+        self._repair_ties(range(self.choice_count))
+        return self._moves(old_order)
+
+    def results(self) -> Results:
+        """
+        Get the current rankings, like resolve_quandary().
+
+        :return: evaluation results
+        """
+        choices = self.quandary.choices
+        return Results([ChoiceResult(choices[self.choice_letters[choice_idx]],
+                                     self.totals[choice_idx],
+                                     self.choice_letters[choice_idx])
+                        for choice_idx in self.order])
@@ -17,19 +17,37 @@
 
 """Quandary main."""
 
-from quandary.analysis import resolve_quandary, analyze_stability
-from quandary.configuration import parse_configuration_file
-from quandary.report import produce_report
+# Modules for the other commands and modes, e.g. the resolver service, are
+# imported where they are used, to keep them out of the start of normal runs.
+from quandary.batch import process_quandary_file, open_result_cache
+from quandary.cache import default_cache_directory
+from quandary.report import ReportWriter
 
 
 import argparse
+import cProfile
+import os
+import sys
+from typing import List, Tuple
 
 from .data import Options, DESCRIPTION, \
     DEFAULT_DECIMAL_PLACES, MINIMUM_DECIMAL_PLACES, MAXIMUM_DECIMAL_PLACES, \
     DEFAULT_RANDOM_STEPS, MINIMUM_RANDOM_STEPS, MAXIMUM_RANDOM_STEPS, \
     DEFAULT_RANDOM_TRIALS, MINIMUM_RANDOM_TRIALS, MAXIMUM_RANDOM_TRIALS, \
-    DEFAULT_STABILITY_PERCENTAGE
-from .utility import critical_error
+    DEFAULT_STABILITY_PERCENTAGE, DEFAULT_STABILITY_ENGINE, STABILITY_ENGINES, \
+    DEFAULT_JOBS, MINIMUM_JOBS, MAXIMUM_JOBS, MINIMUM_SEED, MAXIMUM_SEED, \
+    DEFAULT_ERROR_PERCENTAGE, MINIMUM_ERROR_PERCENTAGE, MAXIMUM_ERROR_PERCENTAGE, \
+    DEFAULT_STABILITY_SEARCH, STABILITY_SEARCHES, \
+    DEFAULT_REFINE_TRIALS, MINIMUM_REFINE_TRIALS, MAXIMUM_REFINE_TRIALS, \
+    DEFAULT_CACHE_SIZE, MINIMUM_CACHE_SIZE, MAXIMUM_CACHE_SIZE, \
+    DEFAULT_WATCH_INTERVAL, MINIMUM_WATCH_INTERVAL, MAXIMUM_WATCH_INTERVAL, \
+    DEFAULT_EXACT_LIMIT, MINIMUM_EXACT_LIMIT, MAXIMUM_EXACT_LIMIT, \
+    DEFAULT_TOP_K, MINIMUM_TOP_K, MAXIMUM_TOP_K, \
+    DEFAULT_SERVE_HOST, DEFAULT_SERVE_PORT, MINIMUM_SERVE_PORT, MAXIMUM_SERVE_PORT, \
+    REPORT_FORMATS, DEFAULT_REPORT_FORMAT, SHARD_BLOCK_TRIALS, HISTORY_CSV_COLUMNS, \
+    DEFAULT_HISTORY_REVISIONS, DEFAULT_HISTORY_COUNT, MINIMUM_HISTORY_COUNT, MAXIMUM_HISTORY_COUNT
+from .metrics import enable_metrics, get_metrics
+from .utility import critical_error, error, QuandaryError
 
 
 def _get_integer_argument(args: argparse.Namespace,
@@ -44,12 +62,48 @@ def _get_integer_argument(args: argparse.Namespace,
         if value > max_value:
             critical_error(f'{dest} value must be <= {max_value}.')
         return value
-    except TypeError as exc:
+    except (TypeError, ValueError) as exc:
         critical_error(f'{dest} value exception: {getattr(args, dest)}: {exc}')
 
 
-def _parse_command_line() -> Options:
-    parser = argparse.ArgumentParser(description=DESCRIPTION)
+def _get_float_argument(args: argparse.Namespace,
+                        dest: str,
+                        min_value: float,
+                        max_value: float,
+                        ) -> float:
+    try:
+        value = float(getattr(args, dest))
+        if value < min_value:
+            critical_error(f'{dest} value must be >= {min_value}.')
+        if value > max_value:
+            critical_error(f'{dest} value must be <= {max_value}.')
+        return value
+    except (TypeError, ValueError) as exc:
+        critical_error(f'{dest} value exception: {getattr(args, dest)}: {exc}')
+
+
+def _get_range_argument(args: argparse.Namespace,
+                        dest: str,
+                        min_value: int,
+                        max_value: int,
+                        ) -> Tuple[int, int]:
+    # Ranges are "FIRST-LAST", inclusive, or a single number.
+    value = getattr(args, dest)
+    if value is None:
+        return min_value, max_value
+    try:
+        first_string, _separator, last_string = value.partition('-')
+        first_value = int(first_string)
+        last_value = int(last_string) if last_string else first_value
+    except ValueError as exc:
+        critical_error(f'{dest} value exception: {value}: {exc}')
+    if first_value < min_value or last_value > max_value or first_value > last_value:
+        critical_error(f'{dest} value must be a range within {min_value}-{max_value}.')
+    return first_value, last_value
+
+
+def _create_argument_parser(prog: str = None) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog=prog, description=DESCRIPTION)
     parser.add_argument(
         '-p', '--decimal-places',
         dest='DECIMAL_PLACES',
@@ -81,10 +135,135 @@ def _parse_command_line() -> Options:
         action='store_true',
         help='display extra details in report')
     parser.add_argument(
-        dest='QUANDARY_PATHS',
-        nargs='+',
-        help='configuration file path(s)')
-    args = parser.parse_args()
+        '-b', '--batch',
+        dest='BATCH',
+        action='store_true',
+        help='process files in parallel (--jobs workers), in order,'
+             ' and continue after failures')
+    parser.add_argument(
+        '--cache-dir',
+        dest='CACHE_DIRECTORY',
+        default=default_cache_directory(),
+        help=f'result cache directory (default: {default_cache_directory()})')
+    parser.add_argument(
+        '--cache-size',
+        dest='CACHE_SIZE',
+        default=DEFAULT_CACHE_SIZE,
+        help=f'maximum number of cached results (default: {DEFAULT_CACHE_SIZE})')
+    parser.add_argument(
+        '--no-cache',
+        dest='NO_CACHE',
+        action='store_true',
+        help='bypass the result cache')
+    parser.add_argument(
+        '--cache-stats',
+        dest='CACHE_STATS',
+        action='store_true',
+        help='display result cache hit and miss counts')
+    parser.add_argument(
+        '-w', '--watch',
+        dest='WATCH',
+        action='store_true',
+        help='keep running and report again when files (or directory contents) change')
+    parser.add_argument(
+        '--watch-interval',
+        dest='WATCH_INTERVAL',
+        default=DEFAULT_WATCH_INTERVAL,
+        help=f'seconds between watch mode file checks'
+             f' (default: {DEFAULT_WATCH_INTERVAL})')
+    parser.add_argument(
+        '-e', '--engine',
+        dest='ENGINE',
+        choices=STABILITY_ENGINES,
+        default=DEFAULT_STABILITY_ENGINE,
+        help=f'stability trial engine, "numpy" requires NumPy'
+             f' (default: {DEFAULT_STABILITY_ENGINE})')
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='JOBS',
+        default=DEFAULT_JOBS,
+        help=f'number of stability worker processes'
+             f' (default: {DEFAULT_JOBS}, 0: one per CPU)')
+    parser.add_argument(
+        '--seed',
+        dest='SEED',
+        help='random seed for reproducible stability results')
+    parser.add_argument(
+        '-a', '--adaptive',
+        dest='ADAPTIVE',
+        action='store_true',
+        help='stop stability step trials early once the result is clear')
+    parser.add_argument(
+        '--error-percent',
+        dest='ERROR_PERCENTAGE',
+        default=DEFAULT_ERROR_PERCENTAGE,
+        help=f'adaptive stability step decision error %%'
+             f' (default: {DEFAULT_ERROR_PERCENTAGE}%%)')
+    parser.add_argument(
+        '--search',
+        dest='SEARCH',
+        choices=STABILITY_SEARCHES,
+        default=DEFAULT_STABILITY_SEARCH,
+        help=f'stability step search, "bisect" assumes changes increase with'
+             f' stress, "sweep" runs all steps with the same random trials'
+             f' (default: {DEFAULT_STABILITY_SEARCH})')
+    parser.add_argument(
+        '--refine-trials',
+        dest='REFINE_TRIALS',
+        default=DEFAULT_REFINE_TRIALS,
+        help=f'extra trials for bisect search boundary steps'
+             f' (default: {DEFAULT_REFINE_TRIALS})')
+    parser.add_argument(
+        '--exact-limit',
+        dest='EXACT_LIMIT',
+        default=DEFAULT_EXACT_LIMIT,
+        help=f'evaluate every possible randomization instead of random trials'
+             f' when there are no more than this many'
+             f' (default: {DEFAULT_EXACT_LIMIT}, 0: never)')
+    parser.add_argument(
+        '-k', '--top-k',
+        dest='TOP_K',
+        default=DEFAULT_TOP_K,
+        help=f'only consider the top K rankings for stability'
+             f' (default: {DEFAULT_TOP_K}, 0: all)')
+    parser.add_argument(
+        '-f', '--format',
+        dest='REPORT_FORMAT',
+        choices=REPORT_FORMATS,
+        default=DEFAULT_REPORT_FORMAT,
+        help=f'report format, "ndjson" writes one JSON record per quandary'
+             f' (default: {DEFAULT_REPORT_FORMAT})')
+    parser.add_argument(
+        '--sensitivity',
+        dest='SENSITIVITY',
+        action='store_true',
+        help='report the smallest change to each priority and choice rating'
+             ' that alters the (top K) rankings')
+    parser.add_argument(
+        '--rank-stats',
+        dest='RANK_STATISTICS',
+        action='store_true',
+        help='collect rank frequencies and total rating statistics for each choice'
+             ' during stability trials')
+    parser.add_argument(
+        '--timings',
+        dest='TIMINGS',
+        action='store_true',
+        help='display wall and CPU time by phase and file, stability trial counts,'
+             ' and peak memory')
+    parser.add_argument(
+        '--metrics-json',
+        dest='METRICS_PATH',
+        help='write timings and other run metrics to a JSON file')
+    parser.add_argument(
+        '--profile',
+        dest='PROFILE_PATH',
+        help='profile the run (excluding worker processes) with cProfile,'
+             ' and write statistics to a .pstats file')
+    return parser
+
+
+def _get_options(args: argparse.Namespace, quandary_paths: List[str]) -> Options:
     decimal_places = _get_integer_argument(
         args, 'DECIMAL_PLACES', MINIMUM_DECIMAL_PLACES, MAXIMUM_DECIMAL_PLACES)
     random_steps = _get_integer_argument(
@@ -93,30 +272,272 @@ def _parse_command_line() -> Options:
         args, 'RANDOM_TRIALS', MINIMUM_RANDOM_TRIALS, MAXIMUM_RANDOM_TRIALS)
     stability_percentage = _get_integer_argument(
         args, 'STABILITY_PERCENTAGE', 0, 100)
+    jobs = _get_integer_argument(
+        args, 'JOBS', MINIMUM_JOBS, MAXIMUM_JOBS)
+    seed = None
+    if args.SEED is not None:
+        seed = _get_integer_argument(
+            args, 'SEED', MINIMUM_SEED, MAXIMUM_SEED)
+    error_percentage = _get_float_argument(
+        args, 'ERROR_PERCENTAGE', MINIMUM_ERROR_PERCENTAGE, MAXIMUM_ERROR_PERCENTAGE)
+    refine_trials = _get_integer_argument(
+        args, 'REFINE_TRIALS', MINIMUM_REFINE_TRIALS, MAXIMUM_REFINE_TRIALS)
+    cache_size = _get_integer_argument(
+        args, 'CACHE_SIZE', MINIMUM_CACHE_SIZE, MAXIMUM_CACHE_SIZE)
+    exact_limit = _get_integer_argument(
+        args, 'EXACT_LIMIT', MINIMUM_EXACT_LIMIT, MAXIMUM_EXACT_LIMIT)
+    top_k = _get_integer_argument(
+        args, 'TOP_K', MINIMUM_TOP_K, MAXIMUM_TOP_K)
+    watch_interval = _get_float_argument(
+        args, 'WATCH_INTERVAL', MINIMUM_WATCH_INTERVAL, MAXIMUM_WATCH_INTERVAL)
+    if args.RANK_STATISTICS and args.SEARCH == 'sweep':
+        critical_error('RANK_STATISTICS is not available with the "sweep" SEARCH.')
     return Options(decimal_places,
                    random_steps,
                    random_trials,
                    stability_percentage,
                    args.DETAILS,
-                   args.QUANDARY_PATHS)
+                   args.ENGINE,
+                   jobs,
+                   seed,
+                   args.ADAPTIVE,
+                   error_percentage,
+                   args.SEARCH,
+                   refine_trials,
+                   args.BATCH,
+                   None if args.NO_CACHE else args.CACHE_DIRECTORY,
+                   cache_size,
+                   args.CACHE_STATS,
+                   args.WATCH,
+                   watch_interval,
+                   exact_limit,
+                   top_k or None,
+                   args.TIMINGS,
+                   args.METRICS_PATH,
+                   args.PROFILE_PATH,
+                   args.REPORT_FORMAT,
+                   args.SENSITIVITY,
+                   args.RANK_STATISTICS,
+                   quandary_paths)
+
+
+def _parse_command_line() -> Options:
+    parser = _create_argument_parser()
+    parser.add_argument(
+        dest='QUANDARY_PATHS',
+        nargs='+',
+        help='configuration file path(s), YAML, or CSV or .npy matrix'
+             ' ("serve", "shard", "merge", or "history" as the first argument runs that command'
+             ' instead)')
+    args = parser.parse_args()
+    return _get_options(args, args.QUANDARY_PATHS)
+
+
+def _serve(arguments: List[str]):
+    parser = _create_argument_parser(prog=f'{os.path.basename(sys.argv[0])} serve')
+    parser.add_argument(
+        '--socket',
+        dest='SOCKET',
+        help='Unix domain socket path to listen on, instead of an HTTP port')
+    parser.add_argument(
+        '--host',
+        dest='HOST',
+        default=DEFAULT_SERVE_HOST,
+        help=f'HTTP host address to listen on (default: {DEFAULT_SERVE_HOST})')
+    parser.add_argument(
+        '--port',
+        dest='PORT',
+        default=DEFAULT_SERVE_PORT,
+        help=f'HTTP port to listen on (default: {DEFAULT_SERVE_PORT})')
+    args = parser.parse_args(arguments)
+    port = _get_integer_argument(args, 'PORT', MINIMUM_SERVE_PORT, MAXIMUM_SERVE_PORT)
+    # With serve, --jobs is the number of service worker processes, and each
+    # one runs stability analysis inline.
+    try:
+        from quandary.server import serve
+        serve(_get_options(args, []), args.SOCKET, args.HOST, port)
+    except QuandaryError as exc:
+        critical_error(str(exc))
+
+
+def _shard(arguments: List[str]):
+    parser = _create_argument_parser(prog=f'{os.path.basename(sys.argv[0])} shard')
+    parser.add_argument(
+        '--steps',
+        dest='STEPS',
+        help='stability step range, e.g. "1-50" (default: all steps)')
+    parser.add_argument(
+        '--trials',
+        dest='TRIALS',
+        help=f'trial range, e.g. "{SHARD_BLOCK_TRIALS + 1}-{SHARD_BLOCK_TRIALS * 2}", starting'
+             f' at a multiple of {SHARD_BLOCK_TRIALS} plus 1 (default: all trials)')
+    parser.add_argument(
+        '-o', '--output',
+        dest='OUTPUT_PATH',
+        required=True,
+        help='partial results output file path')
+    parser.add_argument(
+        dest='QUANDARY_PATH',
+        help='configuration file path, with one quandary')
+    args = parser.parse_args(arguments)
+    options = _get_options(args, [args.QUANDARY_PATH])
+    if options.rank_statistics:
+        critical_error('RANK_STATISTICS is not available for shards.')
+    first_step, last_step = _get_range_argument(args, 'STEPS', 1, options.random_steps)
+    first_trial, last_trial = _get_range_argument(args, 'TRIALS', 1, options.random_trials)
+    from quandary.shard import run_shard, save_shard
+    try:
+        save_shard(args.OUTPUT_PATH, run_shard(args.QUANDARY_PATH,
+                                               options,
+                                               first_step,
+                                               last_step,
+                                               first_trial,
+                                               last_trial))
+    except QuandaryError as exc:
+        critical_error(f'{args.QUANDARY_PATH}: {exc}')
+
+
+def _merge(arguments: List[str]):
+    parser = _create_argument_parser(prog=f'{os.path.basename(sys.argv[0])} merge')
+    parser.add_argument(
+        dest='QUANDARY_PATH',
+        help='configuration file path, with one quandary')
+    parser.add_argument(
+        dest='SHARD_PATHS',
+        nargs='+',
+        help='partial results file paths produced by shard')
+    args = parser.parse_args(arguments)
+    # Stability settings come from the shard files.
+    options = _get_options(args, [args.QUANDARY_PATH])
+    from quandary.shard import merge_shard_files
+    writer = ReportWriter(options.report_format)
+    try:
+        writer.write(merge_shard_files(args.QUANDARY_PATH, args.SHARD_PATHS, options))
+    except QuandaryError as exc:
+        critical_error(f'{args.QUANDARY_PATH}: {exc}')
+    finally:
+        writer.close()
+
+
+def _history(arguments: List[str]):
+    parser = _create_argument_parser(prog=f'{os.path.basename(sys.argv[0])} history')
+    parser.add_argument(
+        '--revisions',
+        dest='REVISIONS',
+        default=DEFAULT_HISTORY_REVISIONS,
+        help=f'git revision range, e.g. "v1.0..main" (default: {DEFAULT_HISTORY_REVISIONS})')
+    parser.add_argument(
+        '--max-count',
+        dest='MAX_COUNT',
+        default=DEFAULT_HISTORY_COUNT,
+        help='maximum number of most recent revisions, 0 for all'
+             f' (default: {DEFAULT_HISTORY_COUNT})')
+    parser.add_argument(
+        dest='QUANDARY_PATH',
+        help='YAML configuration file path in a git working tree, with one quandary')
+    args = parser.parse_args(arguments)
+    max_count = _get_integer_argument(args, 'MAX_COUNT', MINIMUM_HISTORY_COUNT,
+                                      MAXIMUM_HISTORY_COUNT)
+    # With history, --jobs is the number of revision worker processes, like --batch.
+    options = _get_options(args, [args.QUANDARY_PATH])
+    if options.timings or options.metrics_path:
+        enable_metrics()
+    from quandary.history import run_history
+    from quandary.report import format_history_report
+    writer = ReportWriter(options.report_format, csv_columns=HISTORY_CSV_COLUMNS)
+    try:
+        history = run_history(args.QUANDARY_PATH, options, args.REVISIONS, max_count)
+        for chunk in format_history_report(options.report_format,
+                                           args.QUANDARY_PATH,
+                                           history,
+                                           decimal_places=options.decimal_places):
+            writer.write(chunk)
+    except QuandaryError as exc:
+        critical_error(f'{args.QUANDARY_PATH}: {exc}')
+    finally:
+        writer.close()
+    if get_metrics() is not None:
+        _write_metrics(options)
+
+
+def _run(options: Options) -> int:
+    result_cache = open_result_cache(options) if options.cache_stats else None
+    start_statistics = result_cache.statistics() if result_cache is not None else None
+    failure_count = 0
+    writer = ReportWriter(options.report_format)
+    # The output is finished, e.g. to close a JSON list, even after errors.
+    try:
+        if options.watch:
+            from quandary.watch import QuandaryWatcher
+            QuandaryWatcher(options, writer).watch(options.watch_interval)
+        elif options.batch:
+            from quandary.batch import run_batch
+            failure_count = run_batch(options, writer)
+        else:
+            for config_path in options.quandary_paths:
+                try:
+                    for chunk in process_quandary_file(config_path, options, options.jobs):
+                        writer.write(chunk)
+                except QuandaryError as exc:
+                    critical_error(f'{config_path}: {exc}')
+    finally:
+        writer.close()
+    if result_cache is not None:
+        # Counters are kept in the database, so that batch workers count too.
+        statistics = result_cache.statistics()
+        sys.stderr.write(f'Cache: {statistics["hits"] - start_statistics["hits"]} hits,'
+                         f' {statistics["misses"] - start_statistics["misses"]} misses'
+                         f' ({statistics["hits"]} hits, {statistics["misses"]} misses overall),'
+                         f' {statistics["entries"]} entries{os.linesep}')
+    return failure_count
+
+
+def _write_metrics(options: Options):
+    metrics = get_metrics()
+    if options.timings:
+        sys.stderr.write(os.linesep + metrics.format_text())
+    if options.metrics_path:
+        try:
+            metrics.save_json(options.metrics_path)
+        except OSError as exc:
+            error(f'Failed to write metrics file: {options.metrics_path}: {exc}')
 
 
 def main():
     """Main function parses the command line and produces report(s)."""
+    if sys.argv[1:2] == ['serve']:
+        _serve(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['shard']:
+        _shard(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['merge']:
+        _merge(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['history']:
+        _history(sys.argv[2:])
+        return
     options = _parse_command_line()
-    for config_path in options.quandary_paths:
-        quandary = parse_configuration_file(config_path)
-        results = resolve_quandary(quandary)
-        stability = analyze_stability(quandary,
-                                      results,
-                                      random_steps=options.random_steps,
-                                      random_trials=options.random_trials,
-                                      stability_percentage=options.stability_percentage)
-        produce_report(quandary,
-                       results,
-                       decimal_places=options.decimal_places,
-                       confidence=stability,
-                       details=options.details)
+    if options.timings or options.metrics_path:
+        enable_metrics()
+    profiler = None
+    if options.profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    # Metrics and profile statistics are also written after critical errors.
+    try:
+        failure_count = _run(options)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            try:
+                profiler.dump_stats(options.profile_path)
+            except OSError as exc:
+                error(f'Failed to write profile file: {options.profile_path}: {exc}')
+        if get_metrics() is not None:
+            _write_metrics(options)
+    if failure_count > 0:
+        sys.exit(1)
 
 
 # This module can be run directly.
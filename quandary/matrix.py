@@ -0,0 +1,250 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Columnar bulk quandary input, from CSV or NumPy matrix files."""
+
+import csv
+import os
+from array import array
+from typing import List, Optional, Dict
+
+from .data import ChoicesMap, CriteriaMap, PriorityRatings, PriorityProfiles, Criterion, \
+    CompiledQuandary, ChoiceLetter, CriterionLetter, MATRIX_FILE_EXTENSIONS
+from .utility import QuandaryError
+
+
+class MatrixQuandaryView:
+    """
+    Quandary view of a compiled matrix quandary, for reporting.
+
+    Provides the same attributes as Quandary. The choice, criteria, and
+    priority dictionaries are only built when first used, e.g. for a detailed
+    report. Choices and criteria are labeled by their identifiers.
+    """
+
+    def __init__(self,
+                 description: str,
+                 choice_ids: List[ChoiceLetter],
+                 criterion_ids: List[CriterionLetter],
+                 ratings: array,
+                 rated_indexes: array,
+                 priorities: array,
+                 ):
+        self.description = description
+        self.choice_ids = choice_ids
+        self.criterion_ids = criterion_ids
+        self.ratings = ratings
+        self.rated_indexes = rated_indexes
+        self.priorities = priorities
+        self._choices: Optional[ChoicesMap] = None
+        self._criteria: Optional[CriteriaMap] = None
+        self._priority_ratings: Optional[PriorityRatings] = None
+        # Matrix files have a single priority column.
+        self.priority_profiles: PriorityProfiles = {}
+
+    @property
+    def choices(self) -> ChoicesMap:
+        if self._choices is None:
+            self._choices = {choice_id: choice_id for choice_id in self.choice_ids}
+        return self._choices
+
+    @property
+    def criteria(self) -> CriteriaMap:
+        if self._criteria is None:
+            choice_count = len(self.choice_ids)
+            criteria_ratings: List[Dict[ChoiceLetter, float]] = [{} for _ in self.criterion_ids]
+            for rating_idx in self.rated_indexes:
+                criterion_idx, choice_idx = divmod(rating_idx, choice_count)
+                criteria_ratings[criterion_idx][self.choice_ids[choice_idx]] = \
+                    self.ratings[rating_idx]
+            self._criteria = {criterion_id: Criterion(criterion_id, choice_ratings)
+                              for criterion_id, choice_ratings in zip(self.criterion_ids,
+                                                                      criteria_ratings)}
+        return self._criteria
+
+    @property
+    def priority_ratings(self) -> PriorityRatings:
+        if self._priority_ratings is None:
+            self._priority_ratings = dict(zip(self.criterion_ids, self.priorities))
+        return self._priority_ratings
+
+
+def _compile(path: str,
+             choice_ids: List[ChoiceLetter],
+             criterion_ids: List[CriterionLetter],
+             ratings: array,
+             rated_indexes: array,
+             priorities: array,
+             ) -> CompiledQuandary:
+    quandary = MatrixQuandaryView(os.path.basename(path),
+                                  choice_ids,
+                                  criterion_ids,
+                                  ratings,
+                                  rated_indexes,
+                                  priorities)
+    return CompiledQuandary(quandary,
+                            choice_ids,
+                            criterion_ids,
+                            ratings,
+                            rated_indexes,
+                            priorities)
+
+
+def _check_ids(label: str, ids: List[str]):
+    if not all(ids):
+        raise QuandaryError(f'{label}: empty identifier.')
+    if len(set(ids)) != len(ids):
+        duplicate_ids = sorted(set(item for item in ids if ids.count(item) > 1))
+        raise QuandaryError(f'{label}: duplicate identifier(s): {", ".join(duplicate_ids)}')
+
+
+def _parse_rating(label: str, text: str) -> float:
+    try:
+        rating = float(text)
+    except ValueError:
+        raise QuandaryError(f'{label}: rating is not a number: {text}')
+    if not 0 <= rating <= 1:
+        raise QuandaryError(f'{label}: rating is not between 0 and 1: {text}')
+    return rating
+
+
+def load_csv_file(path: str) -> CompiledQuandary:
+    """
+    Load CSV quandary matrix file.
+
+    The header row holds choice identifiers, after two leading cells. Other
+    rows hold a criterion identifier, its priority rating, and then its
+    choice ratings. Ratings are numbers between 0 and 1, and empty cells
+    are unrated.
+
+    :param path: CSV file path
+    :return: compiled quandary
+    """
+    ratings = array('d')
+    rated_indexes = array('l')
+    priorities = array('d')
+    criterion_ids: List[CriterionLetter] = []
+    try:
+        with open(path, newline='', encoding='utf-8') as stream:
+            reader = csv.reader(stream)
+            header = next(reader, None)
+            if header is None or len(header) < 3:
+                raise QuandaryError(f'{path}: header row must have at least one choice.')
+            choice_ids = [choice_id.strip() for choice_id in header[2:]]
+            _check_ids(f'{path}: header row', choice_ids)
+            for row_number, row in enumerate(reader, start=2):
+                if not row:
+                    continue
+                label = f'{path}: row {row_number}'
+                if len(row) != len(header):
+                    raise QuandaryError(f'{label}: expected {len(header)} cells,'
+                                        f' found {len(row)}.')
+                criterion_ids.append(row[0].strip())
+                priorities.append(_parse_rating(f'{label}: priority', row[1]))
+                for cell in row[2:]:
+                    cell = cell.strip()
+                    if cell:
+                        rated_indexes.append(len(ratings))
+                        ratings.append(_parse_rating(label, cell))
+                    else:
+                        ratings.append(0)
+    except (IOError, OSError) as exc:
+        raise QuandaryError(f'Failed to load matrix file: {path}: {exc}')
+    except (csv.Error, UnicodeDecodeError) as exc:
+        raise QuandaryError(f'Failed to parse matrix file: {path}: {exc}')
+    if not criterion_ids:
+        raise QuandaryError(f'{path}: no criteria rows.')
+    _check_ids(f'{path}: criteria', criterion_ids)
+    return _compile(path, choice_ids, criterion_ids, ratings, rated_indexes, priorities)
+
+
+def load_npy_file(path: str) -> CompiledQuandary:
+    """
+    Load NumPy quandary matrix file.
+
+    The matrix has one row per criterion, with the priority rating followed
+    by choice ratings. Ratings are numbers between 0 and 1, and NaN values
+    are unrated. Choices and criteria are identified by number, from 1.
+
+    The file is memory-mapped, and its ratings are copied once, straight into
+    the compiled quandary arrays, which are then checked in place.
+
+    :param path: .npy file path
+    :return: compiled quandary
+    """
+    # Imported here, since this module is loaded for every run.
+    try:
+        import numpy as np
+    except ImportError:
+        raise QuandaryError(f'{path}: NumPy is required to load .npy files.')
+    try:
+        matrix = np.load(path, mmap_mode='r', allow_pickle=False)
+    except (IOError, OSError, ValueError) as exc:
+        raise QuandaryError(f'Failed to load matrix file: {path}: {exc}')
+    if matrix.ndim != 2 or matrix.shape[0] < 1 or matrix.shape[1] < 2:
+        raise QuandaryError(f'{path}: expected a criteria x (1 + choices) matrix,'
+                            f' found shape {matrix.shape}.')
+    if not np.issubdtype(matrix.dtype, np.number):
+        raise QuandaryError(f'{path}: matrix is not numeric ({matrix.dtype}).')
+    criterion_count = matrix.shape[0]
+    choice_count = matrix.shape[1] - 1
+    # The arrays are allocated first, and NumPy views of them are filled from
+    # the memory-mapped matrix, without intermediate copies.
+    ratings = array('d', [0.0]) * (criterion_count * choice_count)
+    priorities = array('d', [0.0]) * criterion_count
+    rating_values = np.frombuffer(ratings, dtype=float).reshape(criterion_count, choice_count)
+    priority_values = np.frombuffer(priorities, dtype=float)
+    np.copyto(rating_values, matrix[:, 1:], casting='unsafe')
+    np.copyto(priority_values, matrix[:, 0], casting='unsafe')
+    if np.isnan(priority_values).any():
+        raise QuandaryError(f'{path}: missing priority rating(s).')
+    # The NaN ignoring minimum and maximum reductions do not copy the ratings.
+    minimum = min(priority_values.min(), np.fmin.reduce(rating_values, axis=None))
+    maximum = max(priority_values.max(), np.fmax.reduce(rating_values, axis=None))
+    if minimum < 0 or maximum > 1:
+        raise QuandaryError(f'{path}: ratings are not all between 0 and 1.')
+    unrated = np.isnan(rating_values)
+    rating_values[unrated] = 0
+    rated_positions = np.flatnonzero(~unrated)
+    rated_indexes = array('l', [0]) * len(rated_positions)
+    np.frombuffer(rated_indexes, dtype=np.dtype('l'))[:] = rated_positions
+    choice_ids = [str(number) for number in range(1, choice_count + 1)]
+    criterion_ids = [str(number) for number in range(1, criterion_count + 1)]
+    return _compile(path, choice_ids, criterion_ids, ratings, rated_indexes, priorities)
+
+
+def is_matrix_file(path: str) -> bool:
+    """
+    Check if a path is a matrix file, based on its extension.
+
+    :param path: file path
+    :return: True for a matrix file
+    """
+    return path.lower().endswith(MATRIX_FILE_EXTENSIONS)
+
+
+def load_matrix_file(path: str) -> CompiledQuandary:
+    """
+    Load CSV or NumPy quandary matrix file, based on its extension.
+
+    :param path: matrix file path
+    :return: compiled quandary
+    """
+    if path.lower().endswith('.npy'):
+        return load_npy_file(path)
+    return load_csv_file(path)
@@ -0,0 +1,289 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Optional phase timing and run metrics."""
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, List, Any, Iterator, ContextManager
+
+from .data import StabilityResults
+
+# Phases in report order. Other phase names are reported after these.
+PHASES = ['load', 'validate', 'compile', 'cache', 'resolve', 'stability', 'sensitivity',
+          'report']
+
+# Metrics for the current process, None when disabled.
+_metrics: Optional['Metrics'] = None
+
+# Reusable context for disabled phases, so that they cost next to nothing.
+_DISABLED_PHASE = nullcontext()
+
+
+@dataclass
+class PhaseTimes:
+    """Accumulated wall and (current process) CPU seconds for a phase."""
+    wall: float = 0.0
+    cpu: float = 0.0
+    count: int = 0
+
+    def add(self, other: 'PhaseTimes'):
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.count += other.count
+
+
+@dataclass
+class FileMetrics:
+    """Metrics for one quandary file."""
+    path: str
+    phases: Dict[str, PhaseTimes] = field(default_factory=dict)
+    stability_steps: int = 0
+    stability_trials: int = 0
+    cache_hits: int = 0
+
+    @property
+    def wall(self) -> float:
+        return sum(times.wall for times in self.phases.values())
+
+    @property
+    def cpu(self) -> float:
+        return sum(times.cpu for times in self.phases.values())
+
+
+def _trials_per_second(file_metrics: FileMetrics) -> Optional[float]:
+    stability_times = file_metrics.phases.get('stability')
+    if stability_times is None or stability_times.wall <= 0:
+        return None
+    return file_metrics.stability_trials / stability_times.wall
+
+
+def _sorted_phases(phases: Dict[str, PhaseTimes]) -> List[str]:
+    return sorted(phases, key=lambda name: (PHASES.index(name) if name in PHASES else len(PHASES),
+                                            name))
+
+
+def _peak_memory(who: int) -> Optional[int]:
+    # Maximum resident set size in bytes. Linux reports KiB, and macOS bytes.
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Metrics:
+    """Phase timings and stability counts, by quandary file."""
+
+    def __init__(self):
+        self.files: List[FileMetrics] = []
+        self.current: Optional[FileMetrics] = None
+        self.start_time = time.perf_counter()
+
+    def start_file(self, path: str):
+        """
+        Start collecting metrics for a quandary file.
+
+        :param path: quandary file path
+        """
+        self.current = FileMetrics(path)
+        self.files.append(self.current)
+
+    def add_file(self, file_metrics: FileMetrics):
+        """
+        Add metrics collected elsewhere, e.g. by a batch worker process.
+
+        :param file_metrics: file metrics
+        """
+        self.files.append(file_metrics)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time a phase, and add it to the current file's metrics.
+
+        :param name: phase name
+        """
+        if self.current is None:
+            self.start_file('')
+        phase_times = self.current.phases.setdefault(name, PhaseTimes())
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            phase_times.wall += time.perf_counter() - start_wall
+            phase_times.cpu += time.process_time() - start_cpu
+            phase_times.count += 1
+
+    def count_stability(self, stability_results: StabilityResults, cached: bool):
+        """
+        Count stability steps and trials that were actually executed.
+
+        :param stability_results: stability analysis results
+        :param cached: True if the results came from the result cache
+        """
+        if self.current is None:
+            self.start_file('')
+        if cached:
+            self.current.cache_hits += 1
+            return
+        self.current.stability_steps += len(stability_results.steps)
+        self.current.stability_trials += sum(step.trial_count for step in stability_results.steps)
+
+    def totals(self) -> FileMetrics:
+        """
+        Get metrics totals for all files.
+
+        :return: totals, with an empty path
+        """
+        totals = FileMetrics('')
+        for file_metrics in self.files:
+            for name, phase_times in file_metrics.phases.items():
+                totals.phases.setdefault(name, PhaseTimes()).add(phase_times)
+            totals.stability_steps += file_metrics.stability_steps
+            totals.stability_trials += file_metrics.stability_trials
+            totals.cache_hits += file_metrics.cache_hits
+        return totals
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        Convert metrics to JSON-compatible data.
+
+        :return: metrics data
+        """
+        def _file_data(file_metrics: FileMetrics) -> Dict[str, Any]:
+            data = asdict(file_metrics)
+            data['wall'] = file_metrics.wall
+            data['cpu'] = file_metrics.cpu
+            data['trials_per_second'] = _trials_per_second(file_metrics)
+            return data
+        totals_data = _file_data(self.totals())
+        del totals_data['path']
+        peak_memory = _peak_memory(resource.RUSAGE_SELF) if resource else None
+        peak_child_memory = _peak_memory(resource.RUSAGE_CHILDREN) if resource else None
+        return {
+            'wall': time.perf_counter() - self.start_time,
+            'files': [_file_data(file_metrics) for file_metrics in self.files],
+            'totals': totals_data,
+            'peak_memory_bytes': peak_memory,
+            'peak_child_memory_bytes': peak_child_memory,
+        }
+
+    def format_text(self) -> str:
+        """
+        Format metrics as a text report.
+
+        :return: report text
+        """
+        totals = self.totals()
+        lines = ['::: Timings :::',
+                 '',
+                 f'{"PHASE":<11} {"WALL(s)":>10} {"CPU(s)":>9} {"COUNT":>7}']
+        for name in _sorted_phases(totals.phases):
+            phase_times = totals.phases[name]
+            lines.append(f'{name:<11} {phase_times.wall:10.4f} {phase_times.cpu:9.4f}'
+                         f' {phase_times.count:7d}')
+        lines.extend(['',
+                      f'{"WALL(s)":>12} {"CPU(s)":>9} {"STEPS":>7} {"TRIALS":>9}  FILE'])
+        for file_metrics in self.files:
+            lines.append(f'{file_metrics.wall:12.4f} {file_metrics.cpu:9.4f}'
+                         f' {file_metrics.stability_steps:7d} {file_metrics.stability_trials:9d}'
+                         f'  {file_metrics.path}')
+        lines.append('')
+        trials_per_second = _trials_per_second(totals)
+        lines.append(f'Stability: {totals.stability_steps} steps, {totals.stability_trials} trials'
+                     + (f', {trials_per_second:,.0f} trials/s' if trials_per_second else '')
+                     + (f', {totals.cache_hits} cached' if totals.cache_hits else ''))
+        lines.append(f'Total wall time: {time.perf_counter() - self.start_time:.4f}s')
+        if resource is not None:
+            lines.append(f'Peak memory: {_peak_memory(resource.RUSAGE_SELF) / 2 ** 20:.1f} MiB'
+                         f' (child processes: '
+                         f'{_peak_memory(resource.RUSAGE_CHILDREN) / 2 ** 20:.1f} MiB)')
+        return os.linesep.join(lines) + os.linesep
+
+    def save_json(self, path: str):
+        """
+        Write metrics as a JSON file.
+
+        :param path: output file path
+        """
+        with open(path, 'w', encoding='utf-8') as stream:
+            json.dump(self.to_json(), stream, indent=2)
+            stream.write('\n')
+
+
+def enable_metrics() -> Metrics:
+    """
+    Start collecting metrics in the current process, replacing any earlier metrics.
+
+    :return: metrics
+    """
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def get_metrics() -> Optional[Metrics]:
+    """
+    Get metrics for the current process.
+
+    :return: metrics or None if disabled
+    """
+    return _metrics
+
+
+def start_file(path: str):
+    """
+    Start collecting metrics for a quandary file, if enabled.
+
+    :param path: quandary file path
+    """
+    if _metrics is not None:
+        _metrics.start_file(path)
+
+
+def phase(name: str) -> ContextManager:
+    """
+    Get a context manager that times a phase, if enabled.
+
+    :param name: phase name
+    :return: context manager
+    """
+    if _metrics is None:
+        return _DISABLED_PHASE
+    return _metrics.phase(name)
+
+
+def count_stability(stability_results: StabilityResults, cached: bool):
+    """
+    Count stability steps and trials, if enabled.
+
+    :param stability_results: stability analysis results
+    :param cached: True if the results came from the result cache
+    """
+    if _metrics is not None:
+        _metrics.count_stability(stability_results, cached)
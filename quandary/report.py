@@ -17,60 +17,87 @@
 
 """Quandary report production."""
 
-from .data import Quandary, Results, DEFAULT_DECIMAL_PLACES
+import csv
+import io
+import json
+import sys
+from typing import List, Dict, Any, TextIO, Optional
 
+from .data import Quandary, Results, ChoiceResult, StabilityStep, StabilityResults, Sensitivity, \
+    RankStatistics, HistoryRevision, DEFAULT_DECIMAL_PLACES
 
-def produce_report(quandary: Quandary,
-                   results: Results,
-                   decimal_places: int = DEFAULT_DECIMAL_PLACES,
-                   confidence: float = None,
-                   details: bool = False,
-                   ):
+# The profile column is empty for consensus rankings.
+CSV_REPORT_COLUMNS = ['path', 'description', 'rank', 'choice', 'label', 'rating', 'confidence',
+                      'profile']
+
+
+def format_text_report(quandary: Quandary,
+                       results: Results,
+                       decimal_places: int = DEFAULT_DECIMAL_PLACES,
+                       confidence: float = None,
+                       details: bool = False,
+                       stability_steps: List[StabilityStep] = None,
+                       top_k: int = None,
+                       sensitivities: List[Sensitivity] = None,
+                       profile_stability: Dict[str, Optional[float]] = None,
+                       rank_statistics_step: StabilityStep = None,
+                       ) -> str:
     """
-    Load quandary file and display evaluation report.
+    Format human-readable evaluation report.
 
     :param quandary: quandary definition
     :param results: analysis results
     :param decimal_places: number of decimal places
     :param confidence: optional confidence rating
     :param details: display extra details if True
+    :param stability_steps: optional stability step results for details
+    :param top_k: number of top rankings considered for confidence (None: all)
+    :param sensitivities: optional sensitivity analysis results
+    :param profile_stability: optional confidence ratings by priority profile
+    :param rank_statistics_step: optional stability step with rank statistics
+    :return: report text
     """
+    # The report is built in memory, to be written all at once.
+    output = io.StringIO()
     rating_format = f'%{decimal_places + 2}.{decimal_places}f'
     row_format = f'%4d  %6.{decimal_places}f  %s'
     print(f'''
 ::: {quandary.description} :::
-''')
+''', file=output)
     print(f'''\
 RANK  RATING  CHOICE\
-''')
+''', file=output)
     for idx, choice_ranking in enumerate(results.choice_rankings):
         row = row_format % (idx + 1, choice_ranking.rating, choice_ranking.label)
         print(f'''\
 {row}\
-''')
+''', file=output)
     if confidence is not None:
+        rankings_label = 'rankings' if top_k is None else f'top {top_k} rankings'
         print(f'''
 Confidence: {confidence * 100:.0f}%
 
-Confidence is the highest random stress percentage with stable rankings.
-''')
+Confidence is the highest random stress percentage with stable {rankings_label}.
+''', file=output)
+    if results.profile_rankings:
+        _format_profiles(output, results, profile_stability or {})
     if details:
         print('''\
 ::: Choices :::
-''')
+''', file=output)
         for choice_letter in sorted(quandary.choices.keys()):
             print(f'''\
 [{choice_letter}] {quandary.choices[choice_letter]}\
-''')
+''', file=output)
         print('''
 ::: Criteria with choices ordered by rating (adjusted rating) :::\
-''')
+''', file=output)
         for criterion_letter in sorted(quandary.criteria.keys()):
             criterion = quandary.criteria[criterion_letter]
             priority = quandary.priority_ratings[criterion_letter]
             print(f'''
 [{criterion_letter}] {criterion.label}\
-''')
+''', file=output)
             sorted_choices = sorted(criterion.choice_ratings.items(),
                                     key=lambda pair: pair[1], reverse=True)
             for choice_letter, choice_rating in sorted_choices:
@@ -78,10 +105,10 @@ Confidence is the highest random stress percentage with stable rankings.
                 adj_rating_string = rating_format % (choice_rating * priority)
                 print(f'''\
    {rating_string} ({adj_rating_string}) [{choice_letter}] {quandary.choices[choice_letter]}\
-''')
+''', file=output)
         print('''
 ::: Priorities with criteria ordered by rating :::
-''')
+''', file=output)
         sorted_criteria = sorted(quandary.priority_ratings.items(),
                                  key=lambda pair: pair[1], reverse=True)
         for criterion_letter, criterion_rating in sorted_criteria:
@@ -89,5 +116,405 @@ Confidence is the highest random stress percentage with stable rankings.
             rating_string = rating_format % criterion_rating
             print(f'''\
 {rating_string} [{criterion_letter}] {criterion.label}\
-            ''')
-        print('')
+            ''', file=output)
+        print('', file=output)
+        if stability_steps:
+            print('''\
+::: Stability steps :::
+
+  STRESS  TRIALS  CHANGED\
+''', file=output)
+            for step in stability_steps:
+                changed_percentage = step.changed_count * 100 / step.trial_count
+                print(f'''\
+  {step.perturbation * 100:5.0f}%  {step.trial_count:6d}  {changed_percentage:6.1f}%\
+''', file=output)
+            print('', file=output)
+    if rank_statistics_step is not None:
+        _format_rank_statistics(output, quandary, results, rank_statistics_step, decimal_places)
+    if sensitivities is not None:
+        _format_sensitivities(output, quandary, sensitivities, decimal_places, top_k)
+    return output.getvalue()
+
+
+def _format_rank_statistics(output: TextIO,
+                            quandary: Quandary,
+                            results: Results,
+                            step: StabilityStep,
+                            decimal_places: int,
+                            ):
+    rank_statistics = step.rank_statistics
+    choice_count = len(rank_statistics.choice_letters)
+    choice_indexes = {letter: idx for idx, letter in enumerate(rank_statistics.choice_letters)}
+    value_width = decimal_places + 4
+    rank_header = ' '.join(f'{f"#{rank}":>6}' for rank in range(1, choice_count + 1))
+    print(f'''\
+::: Rank distribution at {step.perturbation * 100:.0f}% stress ({step.trial_count} trials) :::
+
+ TOP 1  {"MEAN":>{value_width}}  {"STDDEV":>{value_width}}  {rank_header}  CHOICE\
+''', file=output)
+    for ranking in results.choice_rankings:
+        choice_idx = choice_indexes[ranking.letter]
+        frequencies = ' '.join(f'{frequency * 100:5.1f}%'
+                               for frequency in rank_statistics.rank_frequencies(choice_idx))
+        mean = rank_statistics.total_mean(choice_idx)
+        deviation = rank_statistics.total_variance(choice_idx) ** 0.5
+        print(f'''\
+{rank_statistics.top_probability(choice_idx) * 100:5.1f}%  \
+{mean:{value_width}.{decimal_places}f}  {deviation:{value_width}.{decimal_places}f}  \
+{frequencies}  [{ranking.letter}] {quandary.choices[ranking.letter]}\
+''', file=output)
+    print('', file=output)
+
+
+def _rank_statistics_record(rank_statistics: RankStatistics) -> Dict[str, Any]:
+    return {letter: {'rank_frequencies': rank_statistics.rank_frequencies(choice_idx),
+                     'top_probability': rank_statistics.top_probability(choice_idx),
+                     'total_mean': rank_statistics.total_mean(choice_idx),
+                     'total_variance': rank_statistics.total_variance(choice_idx)}
+            for choice_idx, letter in enumerate(rank_statistics.choice_letters)}
+
+
+def _format_profiles(output: TextIO,
+                     results: Results,
+                     profile_stability: Dict[str, Optional[float]],
+                     ):
+    print('''\
+::: Priority profiles with choices ordered by rating :::
+
+CONFIDENCE  PROFILE\
+''', file=output)
+    for name, choice_rankings in results.profile_rankings.items():
+        confidence = profile_stability.get(name)
+        confidence_string = '-' if confidence is None else f'{confidence * 100:.0f}%'
+        letters = ' '.join(ranking.letter for ranking in choice_rankings)
+        print(f'''\
+{confidence_string:>10}  {name}: {letters}\
+''', file=output)
+    print('', file=output)
+
+
+def _format_sensitivities(output: TextIO,
+                          quandary: Quandary,
+                          sensitivities: List[Sensitivity],
+                          decimal_places: int,
+                          top_k: Optional[int],
+                          ):
+    rankings_label = 'rankings' if top_k is None else f'top {top_k} rankings'
+    value_format = f'%{decimal_places + 2}.{decimal_places}f'
+    change_format = f'%+{decimal_places + 4}.{decimal_places + 1}f'
+    print(f'''\
+::: Sensitivity (smallest change that alters the {rankings_label}) :::
+''', file=output)
+    for sensitivity in sensitivities:
+        criterion_label = quandary.criteria[sensitivity.criterion_letter].label
+        if sensitivity.is_priority:
+            target = f'priority [{sensitivity.criterion_letter}] {criterion_label}'
+        else:
+            choice_label = quandary.choices[sensitivity.choice_letter]
+            target = (f'[{sensitivity.criterion_letter}] {criterion_label}:'
+                      f' [{sensitivity.choice_letter}] {choice_label}')
+        value_string = value_format % sensitivity.value
+        if sensitivity.change is None:
+            change_string = '-'.rjust(decimal_places + 4)
+            swap = 'no change'
+        else:
+            change_string = change_format % sensitivity.change
+            swap = f'[{sensitivity.lower_letter}] passes [{sensitivity.higher_letter}]'
+        print(f'''\
+{change_string}  {value_string}  {target} ({swap})\
+''', file=output)
+    print('', file=output)
+
+
+def produce_report(quandary: Quandary,
+                   results: Results,
+                   decimal_places: int = DEFAULT_DECIMAL_PLACES,
+                   confidence: float = None,
+                   details: bool = False,
+                   stability_steps: List[StabilityStep] = None,
+                   top_k: int = None,
+                   ):
+    """
+    Display human-readable evaluation report.
+
+    :param quandary: quandary definition
+    :param results: analysis results
+    :param decimal_places: number of decimal places
+    :param confidence: optional confidence rating
+    :param details: display extra details if True
+    :param stability_steps: optional stability step results for details
+    :param top_k: number of top rankings considered for confidence (None: all)
+    """
+    sys.stdout.write(format_text_report(quandary,
+                                        results,
+                                        decimal_places=decimal_places,
+                                        confidence=confidence,
+                                        details=details,
+                                        stability_steps=stability_steps,
+                                        top_k=top_k))
+
+
+def report_record(quandary: Quandary,
+                  results: Results,
+                  stability_results: StabilityResults,
+                  top_k: int = None,
+                  details: bool = False,
+                  path: str = None,
+                  sensitivities: List[Sensitivity] = None,
+                  ) -> Dict[str, Any]:
+    """
+    Produce machine-readable report data.
+
+    :param quandary: quandary definition
+    :param results: analysis results
+    :param stability_results: stability analysis results
+    :param top_k: number of top rankings considered for confidence (None: all)
+    :param details: include stability steps if True
+    :param path: optional quandary file path
+    :param sensitivities: optional sensitivity analysis results
+    :return: JSON-compatible report data, with "profiles" if there are priority profiles
+    """
+    record: Dict[str, Any] = {}
+    if path is not None:
+        record['path'] = path
+    record['description'] = quandary.description
+
+    def _rankings(choice_rankings: List[ChoiceResult]) -> List[Dict[str, Any]]:
+        return [{'rank': rank,
+                 'choice': ranking.letter,
+                 'label': ranking.label,
+                 'rating': ranking.rating}
+                for rank, ranking in enumerate(choice_rankings, start=1)]
+
+    record['rankings'] = _rankings(results.choice_rankings)
+    record['confidence'] = stability_results.stability
+    record['top_k'] = top_k
+    rank_statistics_step = stability_results.rank_statistics_step
+    if rank_statistics_step is not None:
+        record['rank_statistics'] = {
+            'perturbation': rank_statistics_step.perturbation,
+            'trials': rank_statistics_step.rank_statistics.trial_count,
+            'choices': _rank_statistics_record(rank_statistics_step.rank_statistics)}
+    if results.profile_rankings:
+        record['profiles'] = [{'name': name,
+                               'rankings': _rankings(choice_rankings),
+                               'confidence': stability_results.profile_stability.get(name)}
+                              for name, choice_rankings in results.profile_rankings.items()]
+    if details:
+        record['stability_steps'] = []
+        for step in stability_results.steps:
+            step_record = {'perturbation': step.perturbation,
+                           'trials': step.trial_count,
+                           'changed': step.changed_count}
+            if step.rank_statistics is not None:
+                step_record['rank_statistics'] = _rank_statistics_record(step.rank_statistics)
+            record['stability_steps'].append(step_record)
+    if sensitivities is not None:
+        record['sensitivity'] = [{'criterion': sensitivity.criterion_letter,
+                                  'choice': sensitivity.choice_letter,
+                                  'value': sensitivity.value,
+                                  'change': sensitivity.change,
+                                  'higher': sensitivity.higher_letter,
+                                  'lower': sensitivity.lower_letter}
+                                 for sensitivity in sensitivities]
+    return record
+
+
+def _format_csv_rows(rows: List[List[Any]]) -> str:
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\n').writerows(rows)
+    return output.getvalue()
+
+
+def format_report(report_format: str,
+                  quandary: Quandary,
+                  results: Results,
+                  stability_results: StabilityResults,
+                  decimal_places: int = DEFAULT_DECIMAL_PLACES,
+                  details: bool = False,
+                  top_k: int = None,
+                  path: str = None,
+                  sensitivities: List[Sensitivity] = None,
+                  ) -> str:
+    """
+    Format one quandary report, as a chunk for a ReportWriter.
+
+    :param report_format: report format, one of REPORT_FORMATS
+    :param quandary: quandary definition
+    :param results: analysis results
+    :param stability_results: stability analysis results
+    :param decimal_places: number of decimal places (text format)
+    :param details: display extra details if True
+    :param top_k: number of top rankings considered for confidence (None: all)
+    :param path: optional quandary file path (machine-readable formats)
+    :param sensitivities: optional sensitivity analysis results (not in CSV)
+    :return: report chunk
+    """
+    if report_format == 'text':
+        return format_text_report(quandary,
+                                  results,
+                                  decimal_places=decimal_places,
+                                  confidence=stability_results.stability,
+                                  details=details,
+                                  stability_steps=stability_results.steps,
+                                  top_k=top_k,
+                                  sensitivities=sensitivities,
+                                  profile_stability=stability_results.profile_stability,
+                                  rank_statistics_step=stability_results.rank_statistics_step)
+    record = report_record(quandary, results, stability_results, top_k, details, path,
+                           sensitivities)
+    if report_format == 'json':
+        return json.dumps(record, indent=2)
+    if report_format == 'ndjson':
+        return json.dumps(record) + '\n'
+    if report_format == 'csv':
+        profiles = [(None, record['rankings'], record['confidence'])]
+        profiles.extend((profile['name'], profile['rankings'], profile['confidence'])
+                        for profile in record.get('profiles', []))
+        return _format_csv_rows([[path, record['description'], ranking['rank'], ranking['choice'],
+                                  ranking['label'], ranking['rating'], confidence, name]
+                                 for name, rankings, confidence in profiles
+                                 for ranking in rankings])
+    raise ValueError(f'Unknown report format: {report_format}')
+
+
+def _history_ranking(revision: HistoryRevision) -> List[str]:
+    return [ranking.letter for ranking in revision.results.choice_rankings]
+
+
+def _format_text_history(path: str,
+                         revisions: List[HistoryRevision],
+                         decimal_places: int,
+                         ) -> str:
+    output = io.StringIO()
+    distinct_count = len({revision.fingerprint for revision in revisions
+                          if revision.fingerprint is not None})
+    print(f'''
+::: History of {path} ({len(revisions)} revisions, {distinct_count} distinct) :::
+
+TIME              COMMIT   CONFIDENCE  {"TOP":>{decimal_places + 3}}  RANKING\
+''', file=output)
+    previous_ranking = None
+    for revision in revisions:
+        prefix = f'{revision.time[:16].replace("T", " "):16}  {revision.commit[:7]}'
+        if revision.error is not None:
+            # Errors, e.g. from YAML parsing, are kept to one line.
+            message = ' '.join(revision.error.split())
+            print(f'{prefix}  {"-":>10}  {"-":>{decimal_places + 3}}  ({message})', file=output)
+            continue
+        stability = revision.stability_results.stability
+        confidence = f'{stability * 100:.0f}%' if stability is not None else '-'
+        top_rating = revision.results.choice_rankings[0].rating
+        ranking = _history_ranking(revision)
+        marker = '  *' if previous_ranking is not None and ranking != previous_ranking else ''
+        print(f'''\
+{prefix}  {confidence:>10}  {top_rating:{decimal_places + 3}.{decimal_places}f}  \
+{' '.join(ranking)}{marker}\
+''', file=output)
+        previous_ranking = ranking
+    print('''
+* The ranking changed since the previous revision.
+''', file=output)
+    return output.getvalue()
+
+
+def history_record(path: str, revision: HistoryRevision) -> Dict[str, Any]:
+    """
+    Produce machine-readable data for one revision of a quandary history.
+
+    :param path: quandary file path
+    :param revision: revision results
+    :return: JSON-compatible revision data, with "error" if it failed to load
+    """
+    record: Dict[str, Any] = {'path': path,
+                              'commit': revision.commit,
+                              'time': revision.time,
+                              'fingerprint': revision.fingerprint}
+    if revision.error is not None:
+        record['error'] = revision.error
+        return record
+    record['ranking'] = _history_ranking(revision)
+    record['ratings'] = [ranking.rating for ranking in revision.results.choice_rankings]
+    record['confidence'] = revision.stability_results.stability
+    return record
+
+
+def format_history_report(report_format: str,
+                          path: str,
+                          revisions: List[HistoryRevision],
+                          decimal_places: int = DEFAULT_DECIMAL_PLACES,
+                          ) -> List[str]:
+    """
+    Format a quandary history time series, as chunks for a ReportWriter.
+
+    Text reports are one table, and other formats have a chunk per revision.
+
+    :param report_format: report format, one of REPORT_FORMATS
+    :param path: quandary file path
+    :param revisions: revision results, oldest first
+    :param decimal_places: number of decimal places (text format)
+    :return: report chunks
+    """
+    if report_format == 'text':
+        return [_format_text_history(path, revisions, decimal_places)]
+    records = [history_record(path, revision) for revision in revisions]
+    if report_format == 'json':
+        return [json.dumps(record, indent=2) for record in records]
+    if report_format == 'ndjson':
+        return [json.dumps(record) + '\n' for record in records]
+    if report_format == 'csv':
+        return [_format_csv_rows([[path, record['commit'], record['time'],
+                                   ' '.join(record.get('ranking', [])), record.get('confidence'),
+                                   record.get('error')]])
+                for record in records]
+    raise ValueError(f'Unknown report format: {report_format}')
+
+
+class ReportWriter:
+    """
+    Writes formatted report chunks to a stream, with any framing they need.
+
+    JSON reports are collected in a list, CSV rows share one header row, and
+    NDJSON records are flushed one at a time, so that consumers can process
+    them as they arrive.
+    """
+
+    def __init__(self,
+                 report_format: str,
+                 stream: TextIO = None,
+                 csv_columns: List[str] = None,
+                 ):
+        self.report_format = report_format
+        self.stream = stream if stream is not None else sys.stdout
+        self.csv_columns = csv_columns if csv_columns is not None else CSV_REPORT_COLUMNS
+        self.report_count = 0
+
+    def write(self, chunk: str):
+        """
+        Write a report chunk produced by format_report().
+
+        :param chunk: report chunk
+        """
+        if self.report_count == 0:
+            if self.report_format == 'json':
+                chunk = '[\n' + chunk
+            elif self.report_format == 'csv':
+                chunk = _format_csv_rows([self.csv_columns]) + chunk
+        elif self.report_format == 'json':
+            chunk = ',\n' + chunk
+        self.stream.write(chunk)
+        self.report_count += 1
+        if self.report_format == 'ndjson':
+            self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        """Finish the output, e.g. by closing the JSON list."""
+        if self.report_format == 'json':
+            self.stream.write('[]\n' if self.report_count == 0 else '\n]\n')
+        elif self.report_format == 'csv' and self.report_count == 0:
+            self.stream.write(_format_csv_rows([self.csv_columns]))
+        self.stream.flush()
@@ -0,0 +1,95 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Seedable random streams for stability trials."""
+
+import hashlib
+import random
+from typing import Tuple
+
+
+class RandomStream:
+    """
+    Seedable random stream, with independent child streams.
+
+    A stream is identified by a root seed and a sequence of integer keys, so
+    that child streams can be recreated anywhere, e.g. in worker processes,
+    and always produce the same random values. Streams provide generators
+    for the Python and NumPy stability engines.
+    """
+
+    __slots__ = ('seed', 'keys')
+
+    def __init__(self, seed: int = None, keys: Tuple[int, ...] = ()):
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.keys = keys
+
+    def __repr__(self) -> str:
+        return f'RandomStream({self.seed}, {self.keys})'
+
+    def spawn(self, *keys: int) -> 'RandomStream':
+        """
+        Get an independent child stream.
+
+        :param keys: integer keys identifying the child stream
+        :return: child stream
+        """
+        return RandomStream(self.seed, self.keys + keys)
+
+    def python_random(self) -> random.Random:
+        """
+        Create a Python random generator for the stream.
+
+        :return: random generator
+        """
+        key_string = ':'.join(str(key) for key in (self.seed,) + self.keys)
+        digest = hashlib.sha256(key_string.encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], 'little'))
+
+    def numpy_generator(self) -> 'np.random.Generator':
+        """
+        Create a NumPy random generator for the stream (requires NumPy).
+
+        :return: random generator
+        """
+        # Imported here, since only the NumPy engine needs it, and importing
+        # it would slow down the start of every run.
+        import numpy as np
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=self.keys))
+
+
+class SignBits:
+    """
+    Draws all randomization signs for a trial at once, as a string of bits.
+
+    Each character is "1" to raise a rating or "0" to lower it.
+    """
+
+    __slots__ = ('rng', 'bit_count', 'bit_format')
+
+    def __init__(self, rng: random.Random, bit_count: int):
+        self.rng = rng
+        self.bit_count = bit_count
+        self.bit_format = f'0{bit_count}b'
+
+    def draw(self) -> str:
+        """
+        Draw signs for one trial.
+
+        :return: sign bits string
+        """
+        return format(self.rng.getrandbits(self.bit_count), self.bit_format)
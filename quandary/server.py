@@ -0,0 +1,360 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Long-running quandary resolver service, over HTTP on a Unix socket or localhost port."""
+
+import collections
+import dataclasses
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit, parse_qsl
+
+from .analysis import compile_quandary, analyze_sensitivity
+from .batch import analyze_quandary
+from .configuration import parse_configuration_data, load_configuration_text
+from .data import Options, STABILITY_ENGINES, SERVE_LATENCY_SAMPLES, \
+    MINIMUM_RANDOM_STEPS, MAXIMUM_RANDOM_STEPS, MINIMUM_RANDOM_TRIALS, MAXIMUM_RANDOM_TRIALS, \
+    MINIMUM_SEED, MAXIMUM_SEED, MINIMUM_TOP_K, MAXIMUM_TOP_K
+from .report import report_record
+from .utility import QuandaryError
+
+# Request query parameters that override options, with (minimum, maximum) limits.
+_INTEGER_PARAMETERS = {
+    'random_steps': (MINIMUM_RANDOM_STEPS, MAXIMUM_RANDOM_STEPS),
+    'random_trials': (MINIMUM_RANDOM_TRIALS, MAXIMUM_RANDOM_TRIALS),
+    'stability_percentage': (0, 100),
+    'seed': (MINIMUM_SEED, MAXIMUM_SEED),
+    'top_k': (MINIMUM_TOP_K, MAXIMUM_TOP_K),
+}
+
+# Maximum request body size, to protect against runaway clients.
+_MAXIMUM_BODY_SIZE = 16 * 2 ** 20
+
+
+class _RequestError(Exception):
+    """Request error with HTTP status, reported as a structured response."""
+
+    def __init__(self, status: HTTPStatus, error_type: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+
+
+def resolve_document(raw_data: Any, options: Options) -> Dict[str, Any]:
+    """
+    Resolve a loaded quandary document and analyze its stability.
+
+    Runs in a service worker process.
+
+    :param raw_data: configuration dictionary
+    :param options: runtime options, possibly overridden by the request
+    :return: JSON-compatible rankings and confidence
+    """
+    compiled = compile_quandary(parse_configuration_data(raw_data))
+    results, stability_results = analyze_quandary(compiled, options, 1)
+    sensitivities = analyze_sensitivity(compiled, options.top_k) if options.sensitivity else None
+    return report_record(compiled.quandary, results, stability_results, options.top_k,
+                         options.details, sensitivities=sensitivities)
+
+
+def _override_options(options: Options, query: str) -> Options:
+    overrides: Dict[str, Any] = {}
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name == 'engine':
+            if value not in STABILITY_ENGINES:
+                raise _RequestError(HTTPStatus.BAD_REQUEST, 'InvalidParameter',
+                                    f'engine must be one of: {", ".join(STABILITY_ENGINES)}')
+            overrides[name] = value
+        elif name in _INTEGER_PARAMETERS:
+            min_value, max_value = _INTEGER_PARAMETERS[name]
+            try:
+                overrides[name] = int(value)
+            except ValueError:
+                raise _RequestError(HTTPStatus.BAD_REQUEST, 'InvalidParameter',
+                                    f'{name} value is not an integer: {value}')
+            if not min_value <= overrides[name] <= max_value:
+                raise _RequestError(HTTPStatus.BAD_REQUEST, 'InvalidParameter',
+                                    f'{name} value must be between {min_value} and {max_value}.')
+        else:
+            raise _RequestError(HTTPStatus.BAD_REQUEST, 'InvalidParameter',
+                                f'Unknown parameter: {name}')
+    if overrides.get('top_k') == 0:
+        overrides['top_k'] = None
+    return dataclasses.replace(options, **overrides) if overrides else options
+
+
+def _load_document(body: bytes, content_type: str) -> Any:
+    try:
+        if content_type.split(';')[0].strip() == 'application/json':
+            return json.loads(body)
+        # JSON documents are also valid YAML.
+        return load_configuration_text(body)
+    except ValueError as exc:
+        raise _RequestError(HTTPStatus.BAD_REQUEST, 'ParseError', str(exc))
+    except QuandaryError as exc:
+        raise _RequestError(HTTPStatus.BAD_REQUEST, 'ParseError', str(exc))
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+class ResolverService:
+    """
+    Resolves quandary documents with a warm pool of worker processes.
+
+    Keeps request counts and recent latencies for the statistics endpoint.
+    """
+
+    def __init__(self, options: Options):
+        self.options = options
+        self.worker_count = options.jobs or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.worker_count)
+        # Start all the workers now, rather than when the first requests arrive.
+        for future in [self.executor.submit(_warm_up) for _ in range(self.worker_count)]:
+            future.result()
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.request_count = 0
+        self.error_count = 0
+        self.in_flight = 0
+        self.latencies = collections.deque(maxlen=SERVE_LATENCY_SAMPLES)
+
+    def resolve(self, body: bytes, content_type: str, query: str) -> Dict[str, Any]:
+        """
+        Resolve a YAML or JSON quandary document.
+
+        :param body: request body
+        :param content_type: request content type
+        :param query: request query string, with option overrides
+        :return: JSON-compatible results
+        """
+        options = _override_options(self.options, query)
+        raw_data = _load_document(body, content_type)
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return self.executor.submit(resolve_document, raw_data, options).result()
+        except QuandaryError as exc:
+            raise _RequestError(HTTPStatus.UNPROCESSABLE_ENTITY, 'QuandaryError', str(exc))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def record(self, latency: float, failed: bool):
+        """
+        Record a finished request.
+
+        :param latency: request latency in seconds
+        :param failed: True if the request failed
+        """
+        with self.lock:
+            self.request_count += 1
+            if failed:
+                self.error_count += 1
+            self.latencies.append(latency)
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        Get service statistics.
+
+        :return: JSON-compatible statistics
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            statistics = {
+                'uptime': time.time() - self.start_time,
+                'workers': self.worker_count,
+                'requests': self.request_count,
+                'errors': self.error_count,
+                'in_flight': self.in_flight,
+                # Requests beyond the number of workers wait for a free worker.
+                'queue_depth': max(self.in_flight - self.worker_count, 0),
+            }
+        if latencies:
+            statistics['latency'] = {
+                'samples': len(latencies),
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[(len(latencies) - 1) // 2],
+                'p95': latencies[(len(latencies) - 1) * 95 // 100],
+                'max': latencies[-1],
+            }
+        return statistics
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """HTTP request handler, with JSON responses."""
+
+    server_version = 'Quandary'
+    service: ResolverService = None
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, format_string: str, *args):
+        sys.stderr.write(f'{self.address_string()} - {format_string % args}{os.linesep}')
+
+    def _respond(self, status: HTTPStatus, data: Any):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_error(self, exc: _RequestError):
+        self._respond(exc.status, {'error': {'type': exc.error_type, 'message': str(exc)}})
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/stats':
+            self._respond(HTTPStatus.OK, self.service.statistics())
+        else:
+            self._respond_error(_RequestError(HTTPStatus.NOT_FOUND, 'NotFound',
+                                              f'Unknown path: {path}'))
+
+    def do_POST(self):
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            url = urlsplit(self.path)
+            if url.path != '/resolve':
+                raise _RequestError(HTTPStatus.NOT_FOUND, 'NotFound', f'Unknown path: {url.path}')
+            try:
+                body_size = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                raise _RequestError(HTTPStatus.BAD_REQUEST, 'InvalidRequest',
+                                    'Content-Length is not an integer.')
+            if body_size > _MAXIMUM_BODY_SIZE:
+                raise _RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'TooLarge',
+                                    f'Request body exceeds {_MAXIMUM_BODY_SIZE} bytes.')
+            body = self.rfile.read(body_size)
+            data = self.service.resolve(body, self.headers.get('Content-Type', ''), url.query)
+            data['elapsed'] = time.perf_counter() - start_time
+            self._respond(HTTPStatus.OK, data)
+            failed = False
+        except _RequestError as exc:
+            self._respond_error(exc)
+        except Exception as exc:
+            self._respond_error(_RequestError(HTTPStatus.INTERNAL_SERVER_ERROR,
+                                              exc.__class__.__name__, str(exc)))
+        finally:
+            self.service.record(time.perf_counter() - start_time, failed)
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server on a Unix domain socket, with a thread per request."""
+    daemon_threads = True
+
+
+def _create_server(socket_path: Optional[str],
+                   address: Tuple[str, int],
+                   handler_class: type,
+                   ) -> socketserver.BaseServer:
+    if socket_path is None:
+        return ThreadingHTTPServer(address, handler_class)
+    if not hasattr(socket, 'AF_UNIX'):
+        raise QuandaryError('Unix domain sockets are not supported on this platform.')
+    _remove_stale_socket(socket_path)
+    return _ThreadingUnixHTTPServer(socket_path, handler_class)
+
+
+def _remove_stale_socket(socket_path: str):
+    # Only a socket left behind by an earlier server is replaced, and never
+    # another kind of file, or the socket of a server that is still running.
+    try:
+        path_stat = os.stat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(path_stat.st_mode):
+        raise QuandaryError(f'Socket path exists and is not a socket: {socket_path}')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    raise QuandaryError(f'Another server is already listening on {socket_path}')
+
+
+def _socket_identity(socket_path: str) -> Optional[Tuple[int, int]]:
+    try:
+        path_stat = os.stat(socket_path)
+    except OSError:
+        return None
+    return path_stat.st_dev, path_stat.st_ino
+
+
+def _terminate(_signal_number: int, _frame):
+    raise KeyboardInterrupt
+
+
+def serve(options: Options, socket_path: Optional[str], host: str, port: int):
+    """
+    Run the resolver service until interrupted or terminated.
+
+    Endpoints:
+      POST /resolve - resolve a YAML or JSON quandary document, with optional
+                      query parameters overriding stability options
+      GET /stats    - request counts, latency, and queue depth
+
+    :param options: runtime options, with --jobs as the number of workers
+    :param socket_path: Unix domain socket path, or None for HTTP on host and port
+    :param host: HTTP host address
+    :param port: HTTP port
+    """
+    service = ResolverService(options)
+    handler_class = type('_ServiceRequestHandler', (_RequestHandler,), {'service': service})
+    try:
+        server = _create_server(socket_path, (host, port), handler_class)
+    except QuandaryError:
+        service.close()
+        raise
+    except OSError as exc:
+        service.close()
+        raise QuandaryError(f'Failed to start server: {exc}')
+    # Shutdown only removes the socket that this server created.
+    created_socket = _socket_identity(socket_path) if socket_path is not None else None
+    # Termination shuts down cleanly, like an interrupt.
+    signal.signal(signal.SIGTERM, _terminate)
+    location = socket_path or f'http://{host}:{server.server_address[1]}'
+    sys.stderr.write(f'Serving on {location} with {service.worker_count} worker(s){os.linesep}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if created_socket is not None and _socket_identity(socket_path) == created_socket:
+            os.unlink(socket_path)
@@ -0,0 +1,214 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Sharded stability runs, with partial result files that are merged later."""
+
+import dataclasses
+import json
+import os
+from typing import List, Dict, Tuple
+
+from .analysis import compile_quandary, resolve_quandary, run_stability_shard, \
+    merge_stability_steps
+from .batch import report_quandary
+from .cache import quandary_fingerprint
+from .configuration import iterate_configuration_file
+from .data import Options, CompiledQuandary, StabilityShard, StabilityStep, SHARD_FILE_VERSION
+from .utility import QuandaryError
+
+
+def _load_single_quandary(config_path: str, options: Options) -> CompiledQuandary:
+    quandaries = list(iterate_configuration_file(config_path, options.cache_directory))
+    if len(quandaries) != 1:
+        raise QuandaryError(f'Sharded stability needs exactly one quandary per file,'
+                            f' found {len(quandaries)}.')
+    return compile_quandary(quandaries[0])
+
+
+def run_shard(config_path: str,
+              options: Options,
+              first_step: int,
+              last_step: int,
+              first_trial: int,
+              last_trial: int,
+              ) -> StabilityShard:
+    """
+    Run a range of stability steps and trials for a quandary file.
+
+    :param config_path: quandary file path, with one quandary
+    :param options: runtime options
+    :param first_step: first step number, starting with 1
+    :param last_step: last step number
+    :param first_trial: first trial number, starting with 1
+    :param last_trial: last trial number, up to the number of random trials
+    :return: partial stability results
+    """
+    if last_trial > options.random_trials:
+        raise QuandaryError(f'Shard trials {first_trial}-{last_trial} are not within'
+                            f' 1-{options.random_trials}.')
+    compiled = _load_single_quandary(config_path, options)
+    steps = run_stability_shard(compiled,
+                                first_step,
+                                last_step,
+                                first_trial,
+                                last_trial,
+                                random_steps=options.random_steps,
+                                engine=options.engine,
+                                jobs=options.jobs,
+                                seed=options.seed,
+                                top_k=options.top_k)
+    return StabilityShard(quandary_fingerprint(compiled),
+                          options.random_steps,
+                          options.random_trials,
+                          options.seed,
+                          options.engine,
+                          options.top_k,
+                          first_trial,
+                          last_trial,
+                          steps)
+
+
+def save_shard(path: str, shard: StabilityShard):
+    """
+    Write partial stability results as a JSON file.
+
+    :param path: output file path
+    :param shard: partial stability results
+    """
+    data = {
+        'version': SHARD_FILE_VERSION,
+        'fingerprint': shard.fingerprint,
+        'random_steps': shard.random_steps,
+        'random_trials': shard.random_trials,
+        'seed': shard.seed,
+        'engine': shard.engine,
+        'top_k': shard.top_k,
+        'first_trial': shard.first_trial,
+        'last_trial': shard.last_trial,
+        'steps': [[random_step, step.changed_count, step.trial_count]
+                  for random_step, step in sorted(shard.steps.items())],
+    }
+    # Write to a temporary file first, so that a merge never sees partial data.
+    temporary_path = f'{path}.{os.getpid()}'
+    try:
+        with open(temporary_path, 'w', encoding='utf-8') as stream:
+            json.dump(data, stream)
+            stream.write('\n')
+        os.replace(temporary_path, path)
+    except OSError as exc:
+        raise QuandaryError(f'Failed to write shard file: {path}: {exc}')
+
+
+def load_shard(path: str) -> StabilityShard:
+    """
+    Read partial stability results from a JSON file.
+
+    :param path: shard file path
+    :return: partial stability results
+    """
+    try:
+        with open(path, encoding='utf-8') as stream:
+            data = json.load(stream)
+        if data.get('version') != SHARD_FILE_VERSION:
+            raise QuandaryError(f'Unsupported shard file version: {path}: {data.get("version")}')
+        random_steps = data['random_steps']
+        return StabilityShard(data['fingerprint'],
+                              random_steps,
+                              data['random_trials'],
+                              data['seed'],
+                              data['engine'],
+                              data['top_k'],
+                              data['first_trial'],
+                              data['last_trial'],
+                              {random_step: StabilityStep(random_step / random_steps,
+                                                          changed_count,
+                                                          trial_count)
+                               for random_step, changed_count, trial_count in data['steps']})
+    except (OSError, ValueError) as exc:
+        raise QuandaryError(f'Failed to load shard file: {path}: {exc}')
+    except (KeyError, TypeError, AttributeError) as exc:
+        raise QuandaryError(f'Bad shard file data: {path}: {exc}')
+
+
+def merge_shards(shards: List[StabilityShard]) -> Dict[int, StabilityStep]:
+    """
+    Add up partial stability results, checking that they belong together.
+
+    Each step's trial ranges may not overlap, and must cover all trials.
+
+    :param shards: partial stability results
+    :return: merged step results by step number
+    """
+    if not shards:
+        raise QuandaryError('No shard results to merge.')
+    first_shard = shards[0]
+    for shard in shards[1:]:
+        # Engines have different random numbers for the same seed.
+        for name in ('fingerprint', 'random_steps', 'random_trials', 'seed', 'engine', 'top_k'):
+            if getattr(shard, name) != getattr(first_shard, name):
+                raise QuandaryError(f'Shard results do not match, with different "{name}" values:'
+                                    f' {getattr(first_shard, name)} and {getattr(shard, name)}.')
+    trial_ranges: Dict[int, List[Tuple[int, int]]] = {}
+    changed_counts: Dict[int, int] = {}
+    for shard in shards:
+        for random_step, step in shard.steps.items():
+            trial_ranges.setdefault(random_step, []).append((shard.first_trial, shard.last_trial))
+            changed_counts[random_step] = changed_counts.get(random_step, 0) + step.changed_count
+    random_trials = first_shard.random_trials
+    for random_step, step_trial_ranges in trial_ranges.items():
+        next_trial = 1
+        for first_trial, last_trial in sorted(step_trial_ranges):
+            if first_trial < next_trial:
+                raise QuandaryError(f'Stability step {random_step} has overlapping shard trials'
+                                    f' at {first_trial}-{last_trial}.')
+            if first_trial > next_trial:
+                break
+            next_trial = last_trial + 1
+        if next_trial != random_trials + 1:
+            raise QuandaryError(f'Stability step {random_step} is missing shard trials'
+                                f' from {next_trial}.')
+    return {random_step: StabilityStep(random_step / first_shard.random_steps,
+                                       changed_counts[random_step],
+                                       random_trials)
+            for random_step in sorted(changed_counts)}
+
+
+def merge_shard_files(config_path: str, shard_paths: List[str], options: Options) -> str:
+    """
+    Merge partial stability result files, and format the quandary report.
+
+    The stability percentage and report options come from the runtime
+    options, and the stability settings from the shard files.
+
+    :param config_path: quandary file path, with one quandary
+    :param shard_paths: shard file paths
+    :param options: runtime options
+    :return: report chunk for a ReportWriter
+    """
+    shards = [load_shard(shard_path) for shard_path in shard_paths]
+    steps = merge_shards(shards)
+    compiled = _load_single_quandary(config_path, options)
+    if quandary_fingerprint(compiled) != shards[0].fingerprint:
+        raise QuandaryError('Shard results are for a different quandary, or other ratings.')
+    stability_results = merge_stability_steps(steps,
+                                              shards[0].random_steps,
+                                              options.stability_percentage)
+    return report_quandary(compiled,
+                           resolve_quandary(compiled),
+                           stability_results,
+                           dataclasses.replace(options, top_k=shards[0].top_k),
+                           config_path)
@@ -28,6 +28,15 @@ def error(message: str):
     sys.stderr.write(f'ERROR: {message}{os.linesep}')
 
 
+def warning(message: str):
+    """
+    Display warning message.
+
+    :param message: warning message
+    """
+    sys.stderr.write(f'WARNING: {message}{os.linesep}')
+
+
 def critical_error(message: str):
     """
     Display critical error message and exit.
@@ -36,3 +45,7 @@ def critical_error(message: str):
     """
     sys.stderr.write(f'CRITICAL: {message}{os.linesep}')
     sys.exit(1)
+
+
+class QuandaryError(Exception):
+    """Quandary configuration or analysis error that prevents producing results."""
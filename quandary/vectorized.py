@@ -0,0 +1,201 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Vectorized (NumPy) stability trials."""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from typing import Tuple, Optional, List
+
+from .data import CompiledQuandary, RankStatistics
+from .rng import RandomStream
+
+# Upper bound on perturbed rating values held in memory by one trial batch.
+_MAXIMUM_BATCH_ELEMENTS = 1 << 20
+
+
+def numpy_available() -> bool:
+    """
+    Check if NumPy can be imported.
+
+    :return: True if NumPy is available
+    """
+    return np is not None
+
+
+class VectorizedStabilityEngine:
+    """
+    Counts changed rankings for whole batches of randomized trials at once.
+
+    The compiled quandary is viewed as a criteria x choices rating matrix and
+    a criteria priority vector. Missing ratings are masked out, so that they
+    neither contribute to totals nor get randomized, like they are handled by
+    resolve_quandary().
+    """
+
+    def __init__(self,
+                 compiled: CompiledQuandary,
+                 order_checks: List[Tuple[int, int, bool]],
+                 ):
+        self.compiled = compiled
+        # Set by the stability analysis to collect rank statistics along with the trials.
+        self.rank_statistics: Optional[RankStatistics] = None
+        shape = (compiled.criterion_count, compiled.choice_count)
+        self.ratings = np.frombuffer(compiled.ratings, dtype=float).reshape(shape)
+        self.mask = np.zeros(compiled.criterion_count * compiled.choice_count)
+        self.mask[np.array(compiled.rated_indexes, dtype=np.intp)] = 1
+        self.mask = self.mask.reshape(shape)
+        self.rated_indexes = np.array(compiled.rated_indexes, dtype=np.intp)
+        self.priorities = np.frombuffer(compiled.priorities, dtype=float)
+        # The (higher, lower, strict) choice pairs that must keep their order
+        # come from the Python engine's order checks, as index arrays.
+        self.higher_indexes = np.array([check[0] for check in order_checks], dtype=np.intp)
+        self.lower_indexes = np.array([check[1] for check in order_checks], dtype=np.intp)
+        self.strict = np.array([check[2] for check in order_checks], dtype=bool)
+        self.batch_size = max(1, _MAXIMUM_BATCH_ELEMENTS // max(1, self.ratings.size))
+        self.generator = np.random.default_rng()
+
+    @staticmethod
+    def _totals(priorities: 'np.ndarray', ratings: 'np.ndarray') -> 'np.ndarray':
+        # Batched (trials x 1 x criteria) @ (trials x criteria x choices) product.
+        return np.matmul(priorities[:, np.newaxis, :], ratings)[:, 0, :]
+
+    def _add_rank_statistics(self, totals: 'np.ndarray'):
+        # Ranks are counted by choice and rank position with one bincount.
+        rank_statistics = self.rank_statistics
+        trial_count, choice_count = totals.shape
+        order = np.argsort(-totals, axis=1, kind='stable')
+        rank_indexes = order * choice_count + np.arange(choice_count)
+        np.frombuffer(rank_statistics.rank_counts, dtype=np.int64)[:] += np.bincount(
+            rank_indexes.ravel(), minlength=choice_count * choice_count)
+        np.frombuffer(rank_statistics.total_sums, dtype=float)[:] += totals.sum(axis=0)
+        np.frombuffer(rank_statistics.total_squares, dtype=float)[:] += \
+            np.square(totals).sum(axis=0)
+        rank_statistics.trial_count += trial_count
+
+    def _count_changed_totals(self, totals: 'np.ndarray') -> int:
+        # Compares all ordered pairs at once, instead of sorting each trial.
+        if self.rank_statistics is not None:
+            self._add_rank_statistics(totals)
+        higher_totals = totals[:, self.higher_indexes]
+        lower_totals = totals[:, self.lower_indexes]
+        out_of_order = (higher_totals < lower_totals) | (self.strict & (higher_totals == lower_totals))
+        return int(np.count_nonzero(np.any(out_of_order, axis=1)))
+
+    def _signs(self, shape: tuple) -> 'np.ndarray':
+        return self.generator.integers(0, 2, size=shape, dtype=np.int8) * 2 - 1
+
+    def set_stream(self, stream: RandomStream):
+        """
+        Start a new random stream for subsequent trials.
+
+        :param stream: random stream
+        """
+        self.generator = stream.numpy_generator()
+
+    def count_changed(self, perturbation: float, trials: int) -> int:
+        """
+        Randomize trials in batches and count rankings that differ.
+
+        :param perturbation: perturbation amount added to or subtracted from ratings
+        :param trials: number of trials
+        :return: number of trials with changed rankings
+        """
+        changed_count = 0
+        remaining = trials
+        while remaining > 0:
+            batch_size = min(remaining, self.batch_size)
+            remaining -= batch_size
+            ratings = np.clip(
+                self.ratings + perturbation * self._signs((batch_size,) + self.ratings.shape),
+                0, 1) * self.mask
+            priorities = np.clip(
+                self.priorities + perturbation * self._signs((batch_size,) + self.priorities.shape),
+                0, 1)
+            changed_count += self._count_changed_totals(self._totals(priorities, ratings))
+        return changed_count
+
+    def sweep_changed(self, perturbations: List[float], trials: int) -> List[int]:
+        """
+        Count changed rankings at every perturbation, reusing each trial's signs.
+
+        Signs are drawn once per batch of trials, and only scaled for each
+        perturbation.
+
+        :param perturbations: perturbation amounts
+        :param trials: number of trials
+        :return: number of trials with changed rankings, by perturbation
+        """
+        changed_counts = [0] * len(perturbations)
+        remaining = trials
+        while remaining > 0:
+            batch_size = min(remaining, self.batch_size)
+            remaining -= batch_size
+            rating_signs = self._signs((batch_size,) + self.ratings.shape)
+            priority_signs = self._signs((batch_size,) + self.priorities.shape)
+            for level_idx, perturbation in enumerate(perturbations):
+                ratings = np.clip(self.ratings + perturbation * rating_signs, 0, 1) * self.mask
+                priorities = np.clip(self.priorities + perturbation * priority_signs, 0, 1)
+                changed_counts[level_idx] += self._count_changed_totals(
+                    self._totals(priorities, ratings))
+        return changed_counts
+
+    def count_all(self, perturbation: float) -> Tuple[int, int]:
+        """
+        Count changed rankings for every possible randomization.
+
+        Randomizations are the sign bit patterns of all ratings, evaluated in
+        batches of consecutive pattern numbers.
+
+        :param perturbation: perturbation amount added to or subtracted from ratings
+        :return: (changed rankings count, randomization count) pair
+        """
+        rated_count = len(self.rated_indexes)
+        bit_count = rated_count + len(self.priorities)
+        pattern_count = 1 << bit_count
+        bit_shifts = np.arange(bit_count, dtype=np.int64)
+        flat_ratings = self.ratings.reshape(-1)
+        changed_count = 0
+        for first_pattern in range(0, pattern_count, self.batch_size):
+            patterns = np.arange(first_pattern,
+                                 min(first_pattern + self.batch_size, pattern_count),
+                                 dtype=np.int64)
+            signs = ((patterns[:, np.newaxis] >> bit_shifts) & 1).astype(np.int8) * 2 - 1
+            ratings = np.zeros((len(patterns), flat_ratings.size))
+            ratings[:, self.rated_indexes] = np.clip(
+                flat_ratings[self.rated_indexes] + perturbation * signs[:, :rated_count], 0, 1)
+            priorities = np.clip(self.priorities + perturbation * signs[:, rated_count:], 0, 1)
+            changed_count += self._count_changed_totals(
+                self._totals(priorities, ratings.reshape((len(patterns),) + self.ratings.shape)))
+        return changed_count, pattern_count
+
+
+def calculate_profile_totals(compiled: CompiledQuandary) -> List[List[float]]:
+    """
+    Calculate choice totals for all priority profiles as one matrix product.
+
+    :param compiled: compiled quandary with priority profiles
+    :return: choice totals by profile
+    """
+    ratings = np.frombuffer(compiled.ratings, dtype=float).reshape(
+        (compiled.criterion_count, compiled.choice_count))
+    profile_priorities = np.frombuffer(compiled.profile_priorities, dtype=float).reshape(
+        (len(compiled.profile_names), compiled.criterion_count))
+    return (profile_priorities @ ratings).tolist()
@@ -0,0 +1,159 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Watch mode, with incremental re-analysis of changed quandary files."""
+
+import hashlib
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .analysis import compile_quandary, relabel_results
+from .batch import analyze_quandary, report_quandary
+from .cache import quandary_fingerprint
+from .configuration import iterate_configuration_file
+from .data import Options, Results, StabilityResults, MATRIX_FILE_EXTENSIONS
+from .metrics import phase, start_file, count_stability
+from .report import ReportWriter
+from .utility import error, QuandaryError
+
+QUANDARY_FILE_EXTENSIONS = ('.yaml', '.yml') + MATRIX_FILE_EXTENSIONS
+
+
+class _WatchedFile:
+    """Last seen state of a watched quandary file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stat_signature: Optional[Tuple[int, int]] = None
+        self.content_hash: Optional[str] = None
+        # Analysis results by quandary fingerprint, only for the file's latest
+        # quandaries, so that memory does not grow with each edit.
+        self.analyses: Dict[str, Tuple[Results, StabilityResults]] = {}
+
+
+def _expand_paths(paths: List[str]) -> List[str]:
+    # Directories are watched for quandary files being added or removed.
+    expanded_paths: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            expanded_paths.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith(QUANDARY_FILE_EXTENSIONS)))
+        else:
+            expanded_paths.append(path)
+    return expanded_paths
+
+
+class QuandaryWatcher:
+    """
+    Re-analyzes quandary files as they change.
+
+    Files are checked cheaply by modification time and size, and then by
+    content hash. Stability analysis is skipped when the numeric quandary
+    data did not change, e.g. after editing only descriptions or names.
+    """
+
+    def __init__(self, options: Options, writer: ReportWriter = None):
+        self.options = options
+        self.writer = writer if writer is not None else ReportWriter(options.report_format)
+        self.watched_files: Dict[str, _WatchedFile] = {}
+
+    def _read_change(self, watched_file: _WatchedFile) -> bool:
+        try:
+            stat = os.stat(watched_file.path)
+        except OSError:
+            return False
+        stat_signature = (stat.st_mtime_ns, stat.st_size)
+        if stat_signature == watched_file.stat_signature:
+            return False
+        watched_file.stat_signature = stat_signature
+        try:
+            with open(watched_file.path, 'rb') as stream:
+                content_hash = hashlib.sha256(stream.read()).hexdigest()
+        except OSError:
+            return False
+        if content_hash == watched_file.content_hash:
+            return False
+        watched_file.content_hash = content_hash
+        return True
+
+    def _refresh(self, watched_file: _WatchedFile):
+        path = watched_file.path
+        # The header goes to the report stream, and only with text reports, so
+        # that machine-readable reports stay parseable.
+        if self.options.report_format == 'text':
+            self.writer.stream.write(f'=== {path} [{time.strftime("%H:%M:%S")}] ===\n')
+        start_file(path)
+        analyses: Dict[str, Tuple[Results, StabilityResults]] = {}
+        for quandary in iterate_configuration_file(path):
+            with phase('compile'):
+                compiled = compile_quandary(quandary)
+                fingerprint = quandary_fingerprint(compiled)
+            analysis = analyses.get(fingerprint) or watched_file.analyses.get(fingerprint)
+            if analysis is not None:
+                results = relabel_results(compiled, analysis[0])
+                stability_results = analysis[1]
+                count_stability(stability_results, True)
+            else:
+                results, stability_results = analyze_quandary(compiled,
+                                                              self.options,
+                                                              self.options.jobs)
+            analyses[fingerprint] = (results, stability_results)
+            self.writer.write(report_quandary(compiled, results, stability_results,
+                                              self.options, path))
+        watched_file.analyses = analyses
+        self.writer.flush()
+
+    def check(self) -> int:
+        """
+        Check watched paths once, and report on new or changed files.
+
+        :return: number of refreshed reports
+        """
+        refresh_count = 0
+        paths = _expand_paths(self.options.quandary_paths)
+        # Files removed from watched directories are forgotten.
+        self.watched_files = {path: self.watched_files.get(path) or _WatchedFile(path)
+                              for path in paths}
+        for path in paths:
+            watched_file = self.watched_files[path]
+            if not self._read_change(watched_file):
+                continue
+            # A file may be checked while only partly saved, so any failure
+            # is reported, and watching continues.
+            try:
+                self._refresh(watched_file)
+                refresh_count += 1
+            except QuandaryError as exc:
+                error(f'{path}: {exc}')
+            except Exception as exc:
+                error(f'{path}: {exc.__class__.__name__}: {exc}')
+        return refresh_count
+
+    def watch(self, interval: float):
+        """
+        Keep checking watched paths until interrupted.
+
+        :param interval: seconds between checks
+        """
+        try:
+            while True:
+                self.check()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
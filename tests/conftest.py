@@ -0,0 +1,73 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Shared test fixtures."""
+
+import pytest
+
+from benchmarks.generator import generate_quandary
+from quandary.analysis import compile_quandary
+from quandary.main import _create_argument_parser, _get_options
+
+# Generator seeds for small quandaries, small enough to enumerate every
+# randomization, with some unrated choice ratings.
+SMALL_QUANDARY_SEEDS = [1, 2, 3, 4]
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def engine(request):
+    """Stability engine name, skipping the NumPy engine if NumPy is not installed."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    return request.param
+
+
+@pytest.fixture(params=SMALL_QUANDARY_SEEDS)
+def small_quandary(request):
+    """Compiled 3 choice x 3 criterion quandary."""
+    return compile_quandary(generate_quandary(3, 3, seed=request.param, unrated_fraction=0.2))
+
+
+@pytest.fixture
+def medium_quandary():
+    """Compiled 6 choice x 5 criterion quandary, too large to enumerate quickly."""
+    return compile_quandary(generate_quandary(6, 5, seed=4))
+
+
+@pytest.fixture
+def stability_settings():
+    """
+    Seeded run_stability_analysis() arguments with random trials.
+
+    The top choice of the medium quandary is stable for a third of the steps.
+    """
+    return dict(random_steps=20,
+                random_trials=500,
+                stability_percentage=50,
+                seed=5,
+                exact_limit=0,
+                top_k=1)
+
+
+@pytest.fixture
+def make_options():
+    """Function that creates runtime options from command line arguments."""
+    def _make_options(*arguments, quandary_paths=()):
+        return _get_options(_create_argument_parser().parse_args(arguments), list(quandary_paths))
+    return _make_options
@@ -0,0 +1,61 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Adaptive early stopping of stability step trials."""
+
+import math
+
+from quandary.analysis import (_create_stability_engine, _hoeffding_margin, resolve_quandary,
+                               run_stability_analysis)
+from quandary.data import ADAPTIVE_BLOCK_TRIALS
+from quandary.rng import RandomStream
+
+
+def test_hoeffding_margin():
+    assert math.isclose(_hoeffding_margin(100, 1, 0.05), math.sqrt(math.log(40) / 200))
+    # More trials narrow the margin, while more looks and lower error rates widen it.
+    assert _hoeffding_margin(200, 4, 0.05) < _hoeffding_margin(100, 4, 0.05)
+    assert _hoeffding_margin(100, 8, 0.05) > _hoeffding_margin(100, 4, 0.05)
+    assert _hoeffding_margin(100, 4, 0.01) > _hoeffding_margin(100, 4, 0.05)
+
+
+def test_adaptive_decisions_match_full_trials(medium_quandary, stability_settings):
+    settings = dict(stability_settings, random_trials=2000)
+    results = resolve_quandary(medium_quandary)
+    full = run_stability_analysis(medium_quandary, results, **settings)
+    adaptive = run_stability_analysis(medium_quandary, results, error_rate=0.01, **settings)
+    assert adaptive.stability == full.stability
+    volatility_threshold = (100 - settings['stability_percentage']) / 100
+    for adaptive_step, full_step in zip(adaptive.steps, full.steps):
+        assert adaptive_step.trial_count % ADAPTIVE_BLOCK_TRIALS == 0
+        assert ((adaptive_step.changed_count / adaptive_step.trial_count >= volatility_threshold)
+                == (full_step.changed_count / full_step.trial_count >= volatility_threshold))
+    assert sum(step.trial_count for step in adaptive.steps) < sum(step.trial_count
+                                                                  for step in full.steps)
+
+
+def test_stopped_steps_are_trial_prefixes(medium_quandary, stability_settings):
+    # Each step stream is the same with early stopping, which only runs fewer trials.
+    settings = dict(stability_settings, random_trials=2000)
+    results = resolve_quandary(medium_quandary)
+    adaptive = run_stability_analysis(medium_quandary, results, error_rate=0.01, **settings)
+    for random_step, step in enumerate(adaptive.steps, start=1):
+        engine = _create_stability_engine('python', medium_quandary, settings['top_k'])
+        engine.set_stream(RandomStream(settings['seed']).spawn(random_step))
+        assert engine.count_changed(step.perturbation, step.trial_count) == step.changed_count
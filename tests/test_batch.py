@@ -0,0 +1,60 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Batch processing of quandary files in worker processes."""
+
+import io
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary.batch import process_quandary_file, run_batch
+from quandary.report import ReportWriter
+
+
+def _write_quandary_files(directory, count):
+    paths = []
+    for seed in range(count):
+        path = directory / f'quandary{seed}.yaml'
+        path.write_text(quandary_yaml(generate_quandary(4, 3, seed=seed)))
+        paths.append(str(path))
+    return paths
+
+
+def test_batch_matches_sequential_reports(tmp_path, make_options):
+    paths = _write_quandary_files(tmp_path, 5)
+    options = make_options('--no-cache', '--seed', '3', '-r', '10', '-t', '200', '-j', '3',
+                           '-f', 'ndjson', quandary_paths=paths)
+    stream = io.StringIO()
+    assert run_batch(options, ReportWriter('ndjson', stream)) == 0
+    expected = ''.join(chunk
+                       for path in paths
+                       for chunk in process_quandary_file(path, options, 1))
+    assert stream.getvalue() == expected
+
+
+def test_batch_continues_after_failures(tmp_path, make_options, capsys):
+    paths = _write_quandary_files(tmp_path, 3)
+    bad_path = tmp_path / 'bad.yaml'
+    bad_path.write_text('quandary: [\n')
+    paths.insert(1, str(bad_path))
+    options = make_options('--no-cache', '--seed', '3', '-r', '10', '-t', '200', '-j', '2',
+                           '-f', 'ndjson', quandary_paths=paths)
+    stream = io.StringIO()
+    assert run_batch(options, ReportWriter('ndjson', stream)) == 1
+    assert len(stream.getvalue().splitlines()) == 3
+    assert str(bad_path) in capsys.readouterr().err
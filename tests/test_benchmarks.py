@@ -0,0 +1,59 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Benchmark quandary generator and baseline comparisons."""
+
+import pytest
+import yaml
+
+from benchmarks.generator import YAML_RATINGS_BAR_WIDTH, generate_quandary, quandary_yaml
+from benchmarks.suite import (Measurement, baseline_data, compare_measurements,
+                              measurements_from_baseline)
+from quandary.configuration import parse_configuration_data
+
+
+def test_same_seed_generates_same_quandary():
+    assert generate_quandary(6, 4, seed=3) == generate_quandary(6, 4, seed=3)
+    assert generate_quandary(6, 4, seed=3) != generate_quandary(6, 4, seed=4)
+
+
+@pytest.mark.parametrize('distribution', ['uniform', 'clustered', 'skewed'])
+def test_yaml_round_trip(distribution):
+    # Ratings move to the nearest free ratings bar position.
+    quandary = generate_quandary(5, 4, distribution=distribution, seed=1)
+    parsed = parse_configuration_data(yaml.safe_load(quandary_yaml(quandary)))
+    assert parsed.choices == quandary.choices
+    tolerance = len(quandary.choices) / (YAML_RATINGS_BAR_WIDTH - 1)
+    for letter, criterion in quandary.criteria.items():
+        parsed_ratings = parsed.criteria[letter].choice_ratings
+        assert parsed_ratings.keys() == criterion.choice_ratings.keys()
+        for choice_letter, rating in criterion.choice_ratings.items():
+            assert abs(parsed_ratings[choice_letter] - rating) <= tolerance
+
+
+def test_compare_flags_slowdowns():
+    baseline = measurements_from_baseline(baseline_data([Measurement('resolve', 100.0, 'runs/s'),
+                                                         Measurement('parse', 50.0, 'files/s')]))
+    comparisons = compare_measurements(baseline,
+                                       [Measurement('resolve', 91.0, 'runs/s'),
+                                        Measurement('parse', 44.0, 'files/s'),
+                                        Measurement('new', 1.0, 'runs/s')],
+                                       threshold_percentage=10)
+    assert [(comparison.name, comparison.slowdown) for comparison in comparisons] == [
+        ('resolve', False), ('parse', True)]
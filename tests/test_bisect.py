@@ -0,0 +1,73 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Bisection search for the stability boundary."""
+
+import pytest
+
+from quandary.analysis import _search_bisect, resolve_quandary, run_stability_analysis
+
+
+class _FakeRunner:
+    """Step runner with predetermined unstable steps, recording the steps that ran."""
+
+    def __init__(self, unstable_steps):
+        self.unstable_steps = set(unstable_steps)
+        self.completed = set()
+
+    def run(self, random_steps):
+        self.completed.update(random_steps)
+
+    def refine(self, random_steps, trials):
+        assert self.completed.issuperset(random_steps)
+
+    def is_unstable(self, random_step):
+        assert random_step in self.completed
+        return random_step in self.unstable_steps
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 3, 5])
+@pytest.mark.parametrize('refine_trials', [0, 100])
+def test_monotonic_boundary(jobs, refine_trials):
+    random_steps = 30
+    for stable_step in range(random_steps + 1):
+        runner = _FakeRunner(range(stable_step + 1, random_steps + 1))
+        assert _search_bisect(runner, random_steps, jobs, refine_trials) == stable_step
+        if jobs == 1:
+            assert len(runner.completed) < 15
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_contradiction_falls_back(jobs):
+    # Step 10 is unstable below the boundary at step 20, which only the
+    # verification pass finds.
+    runner = _FakeRunner([10] + list(range(21, 31)))
+    assert _search_bisect(runner, 30, jobs, 0) is None
+
+
+def test_bisect_matches_linear(medium_quandary, stability_settings, engine):
+    results = resolve_quandary(medium_quandary)
+    linear, bisect = [run_stability_analysis(medium_quandary, results, engine=engine,
+                                             search=search, **stability_settings)
+                      for search in ('linear', 'bisect')]
+    assert bisect.stability == linear.stability
+    linear_steps = {step.perturbation: step for step in linear.steps}
+    for step in bisect.steps:
+        if step.perturbation in linear_steps:
+            assert step == linear_steps[step.perturbation]
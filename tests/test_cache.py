@@ -0,0 +1,123 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""SQLite result cache, and its use for analyzing quandaries."""
+
+import pytest
+
+from quandary import batch
+from quandary.analysis import compile_quandary, resolve_quandary, run_stability_analysis
+from quandary.batch import analyze_quandary, open_result_cache, stability_arguments
+from quandary.cache import CACHE_FILE_NAME, ResultCache, fingerprint_seed, quandary_fingerprint
+from quandary.data import Quandary
+
+
+@pytest.fixture
+def result_cache(tmp_path):
+    result_cache = ResultCache(str(tmp_path / 'cache'), max_entries=2)
+    yield result_cache
+    result_cache.close()
+
+
+@pytest.fixture
+def fresh_result_cache(monkeypatch):
+    # The result cache is opened once per process, so each test opens its own.
+    monkeypatch.setattr(batch, '_result_cache', None)
+    monkeypatch.setattr(batch, '_result_cache_pid', None)
+
+
+def _analyze(compiled, seed, rank_statistics=False):
+    results = resolve_quandary(compiled)
+    arguments = dict(random_steps=10, random_trials=200, seed=seed, exact_limit=0,
+                     rank_statistics=rank_statistics)
+    return arguments, results, run_stability_analysis(compiled, results, **arguments)
+
+
+def _relabeled(compiled):
+    quandary = compiled.quandary
+    return compile_quandary(Quandary('Relabeled',
+                                     {letter: f'New {label}'
+                                      for letter, label in quandary.choices.items()},
+                                     quandary.criteria,
+                                     quandary.priority_ratings))
+
+
+def test_miss_then_hit(result_cache, medium_quandary):
+    arguments, results, stability_results = _analyze(medium_quandary, 1, rank_statistics=True)
+    assert result_cache.get(medium_quandary, arguments) is None
+    result_cache.put(medium_quandary, arguments, results, stability_results)
+    assert result_cache.get(medium_quandary, arguments) == (results, stability_results)
+    assert result_cache.get(medium_quandary, dict(arguments, seed=2)) is None
+    assert result_cache.statistics() == {'hits': 1, 'misses': 2, 'entries': 1}
+
+
+def test_relabeled_quandary_hits(result_cache, medium_quandary):
+    arguments, results, stability_results = _analyze(medium_quandary, 1)
+    result_cache.put(medium_quandary, arguments, results, stability_results)
+    relabeled = _relabeled(medium_quandary)
+    assert quandary_fingerprint(relabeled) == quandary_fingerprint(medium_quandary)
+    cached_results, cached_stability_results = result_cache.get(relabeled, arguments)
+    assert cached_stability_results == stability_results
+    assert ([(ranking.letter, ranking.rating) for ranking in cached_results.choice_rankings]
+            == [(ranking.letter, ranking.rating) for ranking in results.choice_rankings])
+    assert cached_results.choice_rankings[0].label.startswith('New ')
+
+
+def test_least_recently_used_entries_are_evicted(result_cache, medium_quandary):
+    entries = [_analyze(medium_quandary, seed) for seed in (1, 2, 3)]
+    for arguments, results, stability_results in entries[:2]:
+        result_cache.put(medium_quandary, arguments, results, stability_results)
+    assert result_cache.get(medium_quandary, entries[0][0]) is not None
+    result_cache.put(medium_quandary, *entries[2])
+    assert result_cache.get(medium_quandary, entries[1][0]) is None
+    assert result_cache.get(medium_quandary, entries[0][0]) is not None
+    assert result_cache.get(medium_quandary, entries[2][0]) is not None
+
+
+def test_database_errors_are_misses(result_cache, medium_quandary, capsys):
+    arguments, results, stability_results = _analyze(medium_quandary, 1)
+    result_cache.put(medium_quandary, arguments, results, stability_results)
+    result_cache.connection.execute('DROP TABLE results')
+    assert result_cache.get(medium_quandary, arguments) is None
+    result_cache.put(medium_quandary, arguments, results, stability_results)
+    assert result_cache.get(medium_quandary, arguments) is None
+    assert capsys.readouterr().err.count('WARNING') == 1
+
+
+def test_unavailable_cache_is_disabled(tmp_path, make_options, fresh_result_cache, capsys):
+    # A file where the directory should be, and a file that is not a database.
+    not_a_directory = tmp_path / 'file'
+    not_a_directory.write_text('')
+    not_a_database = tmp_path / 'cache'
+    not_a_database.mkdir()
+    (not_a_database / CACHE_FILE_NAME).write_text('not a database' * 100)
+    for directory in (not_a_directory, not_a_database):
+        batch._result_cache_pid = None
+        assert open_result_cache(make_options('--cache-dir', str(directory))) is None
+        assert 'WARNING' in capsys.readouterr().err
+
+
+def test_unseeded_runs_use_derived_seed(tmp_path, make_options, fresh_result_cache,
+                                        medium_quandary):
+    options = make_options('--cache-dir', str(tmp_path), '-r', '10', '-t', '200')
+    results, stability_results = analyze_quandary(medium_quandary, options, 1)
+    arguments = dict(stability_arguments(options), seed=fingerprint_seed(medium_quandary))
+    assert stability_results == run_stability_analysis(medium_quandary, results, **arguments)
+    assert analyze_quandary(medium_quandary, options, 1) == (results, stability_results)
+    assert open_result_cache(options).statistics()['hits'] == 1
@@ -0,0 +1,97 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Configuration file loading, and the parsed configuration cache."""
+
+import os
+
+import pytest
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary import configuration
+from quandary.configuration import CONFIGURATION_CACHE_FOLDER, iterate_configuration_file
+from quandary.utility import QuandaryError
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / 'quandaries.yaml'
+    path.write_text('---\n'.join(quandary_yaml(generate_quandary(4, 3, seed=seed))
+                                 for seed in range(3)))
+    return str(path)
+
+
+@pytest.fixture
+def parse_count(monkeypatch):
+    counts = {'parses': 0}
+    load_all = configuration._load_all
+
+    def _count_parse(config_path):
+        counts['parses'] += 1
+        return load_all(config_path)
+
+    monkeypatch.setattr(configuration, '_load_all', _count_parse)
+    return counts
+
+
+def _cache_files(cache_directory):
+    return list((cache_directory / CONFIGURATION_CACHE_FOLDER).iterdir())
+
+
+def test_cached_quandaries_match_parsed(tmp_path, config_path, parse_count):
+    parsed = list(iterate_configuration_file(config_path))
+    assert len(parsed) == 3
+    assert list(iterate_configuration_file(config_path, str(tmp_path))) == parsed
+    assert list(iterate_configuration_file(config_path, str(tmp_path))) == parsed
+    assert parse_count['parses'] == 2
+
+
+def test_changed_file_is_parsed_again(tmp_path, config_path, parse_count):
+    list(iterate_configuration_file(config_path, str(tmp_path)))
+    with open(config_path, 'a', encoding='utf-8') as stream:
+        stream.write('---\n' + quandary_yaml(generate_quandary(4, 3, seed=3)))
+    assert len(list(iterate_configuration_file(config_path, str(tmp_path)))) == 4
+    assert parse_count['parses'] == 2
+
+
+def test_corrupt_cache_is_a_miss(tmp_path, config_path, parse_count):
+    parsed = list(iterate_configuration_file(config_path, str(tmp_path)))
+    for cache_file in _cache_files(tmp_path):
+        cache_file.write_bytes(b'\x80\x04corrupt')
+    assert list(iterate_configuration_file(config_path, str(tmp_path))) == parsed
+    assert parse_count['parses'] == 2
+    # The corrupt entry was replaced.
+    assert list(iterate_configuration_file(config_path, str(tmp_path))) == parsed
+    assert parse_count['parses'] == 2
+
+
+def test_errors_have_document_numbers_with_empty_documents(tmp_path):
+    path = tmp_path / 'quandaries.yaml'
+    # The second document is empty.
+    path.write_text('---\n'.join([quandary_yaml(generate_quandary(4, 3)), '', 'choices: {}\n']))
+    with pytest.raises(QuandaryError, match='document 3'):
+        list(iterate_configuration_file(str(path)))
+
+
+def test_failed_files_are_not_cached(tmp_path, config_path):
+    with open(config_path, 'a', encoding='utf-8') as stream:
+        stream.write('---\nquandary: [\n')
+    with pytest.raises(QuandaryError):
+        list(iterate_configuration_file(config_path, str(tmp_path)))
+    assert not os.path.exists(tmp_path / CONFIGURATION_CACHE_FOLDER)
@@ -0,0 +1,84 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Exact stability counts, compared to brute force enumeration."""
+
+import itertools
+import operator
+
+import pytest
+
+from quandary.analysis import _create_stability_engine, run_stability_analysis, resolve_quandary
+
+
+def _ranking(choice_count, ratings, priorities):
+    totals = [sum(map(operator.mul, ratings[choice_idx::choice_count], priorities))
+              for choice_idx in range(choice_count)]
+    return sorted(range(choice_count), key=totals.__getitem__, reverse=True)
+
+
+def _brute_force_count(compiled, perturbation, top_k):
+    # Every rated choice rating and priority is either lowered or raised.
+    choice_count = compiled.choice_count
+    rated_indexes = list(compiled.rated_indexes)
+    top_count = choice_count if top_k is None else top_k
+    original = _ranking(choice_count, compiled.ratings, compiled.priorities)[:top_count]
+    changed_count = 0
+    pattern_count = 0
+    for signs in itertools.product((-1, 1), repeat=len(rated_indexes) + compiled.criterion_count):
+        ratings = list(compiled.ratings)
+        for idx, sign in zip(rated_indexes, signs):
+            ratings[idx] = min(max(ratings[idx] + sign * perturbation, 0), 1)
+        priorities = [min(max(priority + sign * perturbation, 0), 1)
+                      for priority, sign in zip(compiled.priorities, signs[len(rated_indexes):])]
+        if _ranking(choice_count, ratings, priorities)[:top_count] != original:
+            changed_count += 1
+        pattern_count += 1
+    return changed_count, pattern_count
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 2])
+@pytest.mark.parametrize('perturbation', [0.1, 0.3, 0.6])
+def test_python_count_all_matches_brute_force(small_quandary, perturbation, top_k):
+    engine = _create_stability_engine('python', small_quandary, top_k)
+    assert engine.count_all(perturbation) == _brute_force_count(small_quandary,
+                                                                perturbation,
+                                                                top_k)
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 2])
+@pytest.mark.parametrize('perturbation', [0.1, 0.3, 0.6])
+def test_numpy_count_all_matches_brute_force(small_quandary, perturbation, top_k):
+    pytest.importorskip('numpy')
+    engine = _create_stability_engine('numpy', small_quandary, top_k)
+    assert engine.count_all(perturbation) == _brute_force_count(small_quandary,
+                                                                perturbation,
+                                                                top_k)
+
+
+def test_exact_limit_selects_exact_steps(small_quandary):
+    results = resolve_quandary(small_quandary)
+    stability_results = run_stability_analysis(small_quandary, results, random_steps=5,
+                                               random_trials=10, seed=1, exact_limit=1 << 20)
+    pattern_count = 1 << (len(small_quandary.rated_indexes) + small_quandary.criterion_count)
+    for step in stability_results.steps:
+        assert step.trial_count == pattern_count
+        assert (step.changed_count, step.trial_count) == _brute_force_count(small_quandary,
+                                                                            step.perturbation,
+                                                                            None)
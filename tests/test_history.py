@@ -0,0 +1,90 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Rankings across the git history of a quandary file."""
+
+import shutil
+import subprocess
+
+import pytest
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary.analysis import compile_quandary
+from quandary.batch import analyze_quandary
+from quandary.configuration import parse_configuration_file
+from quandary.history import run_history
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason='git is not installed')
+
+
+def _git(directory, *arguments):
+    return subprocess.run(['git', '-C', str(directory), '-c', 'user.name=Test',
+                           '-c', 'user.email=test@example.com'] + list(arguments),
+                          check=True, stdout=subprocess.PIPE).stdout.decode().strip()
+
+
+@pytest.fixture
+def history_repository(tmp_path):
+    # Versions: original, relabeled, broken, new ratings, and reverted.
+    repository = tmp_path / 'repository'
+    (repository / 'quandaries').mkdir(parents=True)
+    _git(repository, 'init', '-q')
+    config_path = repository / 'quandaries' / 'quandary.yaml'
+    original = quandary_yaml(generate_quandary(4, 3, seed=1))
+    versions = [original,
+                original.replace('Choice A', 'Renamed A'),
+                'quandary: [\n',
+                quandary_yaml(generate_quandary(4, 3, seed=2)),
+                original]
+    for version_idx, text in enumerate(versions):
+        config_path.write_text(text)
+        _git(repository, 'add', '-A')
+        _git(repository, 'commit', '-q', '-m', f'Version {version_idx}')
+    (repository / 'other.txt').write_text('unrelated')
+    _git(repository, 'add', '-A')
+    _git(repository, 'commit', '-q', '-m', 'Unrelated')
+    return config_path
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_history_matches_each_version(history_repository, make_options, jobs):
+    options = make_options('--no-cache', '--seed', '1', '-r', '10', '-t', '100', '-j', jobs)
+    history = run_history(str(history_repository), options, 'HEAD', 0)
+    commits = _git(history_repository.parent, 'log', '--format=%H', '--', 'quandary.yaml')
+    assert [revision.commit for revision in history] == commits.split()[::-1]
+    assert [revision.error is not None for revision in history] == [False, False, True, False,
+                                                                     False]
+    assert history[0].fingerprint == history[1].fingerprint == history[4].fingerprint
+    assert history[3].fingerprint != history[0].fingerprint
+    # Relabeled revisions share the analysis, but keep their own labels.
+    assert {ranking.letter: ranking.label
+            for ranking in history[1].results.choice_rankings}['A'] == 'Renamed A'
+    assert {ranking.letter: ranking.label
+            for ranking in history[0].results.choice_rankings}['A'] == 'Choice A'
+    current = compile_quandary(parse_configuration_file(str(history_repository)))
+    assert (history[4].results, history[4].stability_results) == analyze_quandary(current,
+                                                                                  options, 1)
+
+
+def test_max_count_keeps_latest_revisions(history_repository, make_options):
+    options = make_options('--no-cache', '--seed', '1', '-r', '10', '-t', '100')
+    history = run_history(str(history_repository), options, 'HEAD', 2)
+    full_history = run_history(str(history_repository), options, 'HEAD', 0)
+    assert [revision.commit for revision in history] == [revision.commit
+                                                         for revision in full_history[-2:]]
@@ -0,0 +1,91 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Incremental resolution, compared to resolving the edited quandary again."""
+
+import random
+
+import pytest
+
+from benchmarks.generator import generate_quandary
+from quandary.analysis import resolve_quandary
+from quandary.data import Criterion, Quandary
+from quandary.incremental import IncrementalResolver
+from quandary.utility import QuandaryError
+
+
+def _edited_quandary(quandary, choice_ratings, priorities):
+    return Quandary(quandary.description,
+                    quandary.choices,
+                    {letter: Criterion(criterion.label, dict(choice_ratings[letter]))
+                     for letter, criterion in quandary.criteria.items()},
+                    dict(priorities))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_edits_match_resolution(seed):
+    # Ratings from a few values produce many ties, which must be ranked in
+    # configuration order, like resolve_quandary() ranks them.
+    rng = random.Random(seed)
+    quandary = generate_quandary(8, 5, seed=seed, unrated_fraction=0.2)
+    resolver = IncrementalResolver(quandary)
+    choice_ratings = {letter: dict(criterion.choice_ratings)
+                      for letter, criterion in quandary.criteria.items()}
+    priorities = dict(quandary.priority_ratings)
+    values = [0.0, 0.25, 0.5, 0.75, 1.0, None]
+    for _edit in range(300):
+        old_order = [ranking.letter for ranking in resolver.results().choice_rankings]
+        criterion_letter = rng.choice(list(quandary.criteria))
+        if rng.random() < 0.2:
+            priority = rng.choice(values[:-1])
+            moves = resolver.set_priority(criterion_letter, priority)
+            priorities[criterion_letter] = priority
+        else:
+            choice_letter = rng.choice(list(quandary.choices))
+            rating = rng.choice(values)
+            moves = resolver.set_rating(criterion_letter, choice_letter, rating)
+            if rating is None:
+                choice_ratings[criterion_letter].pop(choice_letter, None)
+            else:
+                choice_ratings[criterion_letter][choice_letter] = rating
+        expected = resolve_quandary(_edited_quandary(quandary, choice_ratings, priorities))
+        choice_rankings = resolver.results().choice_rankings
+        assert ([ranking.letter for ranking in choice_rankings]
+                == [ranking.letter for ranking in expected.choice_rankings])
+        assert ([ranking.rating for ranking in choice_rankings]
+                == pytest.approx([ranking.rating for ranking in expected.choice_rankings]))
+        new_order = [ranking.letter for ranking in choice_rankings]
+        assert [(move.letter, move.old_rank, move.new_rank) for move in moves] == [
+            (letter, old_order.index(letter) + 1, new_order.index(letter) + 1)
+            for letter in new_order if old_order.index(letter) != new_order.index(letter)]
+    resolver.refresh()
+    assert resolver.results() == resolve_quandary(
+        _edited_quandary(quandary, choice_ratings, priorities))
+
+
+def test_bad_edits():
+    resolver = IncrementalResolver(generate_quandary(3, 2, seed=1))
+    with pytest.raises(QuandaryError, match='criterion'):
+        resolver.set_rating('Z', 'A', 0.5)
+    with pytest.raises(QuandaryError, match='choice'):
+        resolver.set_rating('A', 'Z', 0.5)
+    with pytest.raises(QuandaryError, match='between 0 and 1'):
+        resolver.set_rating('A', 'A', 1.5)
+    with pytest.raises(QuandaryError, match='between 0 and 1'):
+        resolver.set_priority('A', -0.5)
@@ -0,0 +1,108 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""CSV and NumPy matrix files, compared to the same quandary in memory."""
+
+import math
+
+import pytest
+
+from benchmarks.generator import generate_quandary
+from quandary.analysis import compile_quandary, resolve_quandary
+from quandary.matrix import load_csv_file, load_matrix_file, load_npy_file
+from quandary.utility import QuandaryError
+
+
+@pytest.fixture
+def quandary():
+    return compile_quandary(generate_quandary(5, 4, seed=2, unrated_fraction=0.2))
+
+
+def _matrix_rows(compiled):
+    # Rows of priority and choice ratings, by criterion, with None for unrated.
+    rated = set(compiled.rated_indexes)
+    choice_count = compiled.choice_count
+    return [[priority] + [compiled.ratings[idx] if idx in rated else None
+                          for idx in range(criterion_idx * choice_count,
+                                           (criterion_idx + 1) * choice_count)]
+            for criterion_idx, priority in enumerate(compiled.priorities)]
+
+
+def _write_csv(path, compiled):
+    lines = [','.join(['criterion', 'priority'] + compiled.choice_letters)]
+    for criterion_letter, row in zip(compiled.criterion_letters, _matrix_rows(compiled)):
+        lines.append(','.join([criterion_letter] + ['' if value is None else repr(value)
+                                                    for value in row]))
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def _write_npy(path, compiled):
+    np = pytest.importorskip('numpy')
+    np.save(path, np.array([[math.nan if value is None else value for value in row]
+                            for row in _matrix_rows(compiled)]))
+    return str(path)
+
+
+def _assert_same_quandary(loaded, compiled):
+    assert list(loaded.ratings) == list(compiled.ratings)
+    assert list(loaded.rated_indexes) == list(compiled.rated_indexes)
+    assert list(loaded.priorities) == list(compiled.priorities)
+    assert ([ranking.rating for ranking in resolve_quandary(loaded).choice_rankings]
+            == [ranking.rating for ranking in resolve_quandary(compiled).choice_rankings])
+
+
+def test_csv_matches_quandary(tmp_path, quandary):
+    loaded = load_matrix_file(_write_csv(tmp_path / 'quandary.csv', quandary))
+    _assert_same_quandary(loaded, quandary)
+    assert loaded.choice_letters == quandary.choice_letters
+    assert loaded.criterion_letters == quandary.criterion_letters
+
+
+def test_npy_matches_quandary(tmp_path, quandary):
+    loaded = load_matrix_file(_write_npy(tmp_path / 'quandary.npy', quandary))
+    _assert_same_quandary(loaded, quandary)
+    assert loaded.choice_letters == ['1', '2', '3', '4', '5']
+
+
+@pytest.mark.parametrize('text, message', [
+    ('criterion,priority,a,b\nx,0.5,0.2,1.5\n', 'not between 0 and 1'),
+    ('criterion,priority,a,b\nx,0.5,0.2,high\n', 'not a number'),
+    ('criterion,priority,a,a\nx,0.5,0.2,0.3\n', 'duplicate'),
+    ('criterion,priority,a,b\nx,0.5,0.2\n', 'expected 4 cells'),
+    ('criterion,priority,a,b\n', 'no criteria'),
+])
+def test_bad_csv_files(tmp_path, text, message):
+    path = tmp_path / 'bad.csv'
+    path.write_text(text)
+    with pytest.raises(QuandaryError, match=message):
+        load_csv_file(str(path))
+
+
+@pytest.mark.parametrize('rows, message', [
+    ([[0.5, 0.2, 1.5]], 'not all between 0 and 1'),
+    ([[math.nan, 0.2, 0.5]], 'missing priority'),
+    ([[0.5]], 'expected a criteria'),
+])
+def test_bad_npy_files(tmp_path, rows, message):
+    np = pytest.importorskip('numpy')
+    path = tmp_path / 'bad.npy'
+    np.save(path, np.array(rows))
+    with pytest.raises(QuandaryError, match=message):
+        load_npy_file(str(path))
@@ -0,0 +1,77 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Phase timings and stability counts."""
+
+import io
+import json
+
+import pytest
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary import metrics
+from quandary.batch import process_quandary_file, run_batch
+from quandary.metrics import enable_metrics, get_metrics, phase
+from quandary.report import ReportWriter
+
+
+@pytest.fixture
+def disabled_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', None)
+
+
+@pytest.fixture
+def config_paths(tmp_path):
+    paths = []
+    for seed in range(2):
+        path = tmp_path / f'quandary{seed}.yaml'
+        path.write_text(quandary_yaml(generate_quandary(4, 3, seed=seed)))
+        paths.append(str(path))
+    return paths
+
+
+def test_disabled_phases_are_shared(disabled_metrics):
+    assert phase('resolve') is phase('report')
+    assert get_metrics() is None
+
+
+def test_file_phases_and_trials(disabled_metrics, config_paths, make_options, tmp_path):
+    options = make_options('--no-cache', '--seed', '1', '-r', '10', '-t', '100',
+                           quandary_paths=config_paths)
+    run_metrics = enable_metrics()
+    list(process_quandary_file(config_paths[0], options, 1))
+    file_metrics = run_metrics.files[0]
+    assert file_metrics.path == config_paths[0]
+    assert {'load', 'validate', 'compile', 'resolve', 'stability', 'report'} <= set(
+        file_metrics.phases)
+    assert file_metrics.stability_trials == 100 * file_metrics.stability_steps > 0
+    metrics_path = tmp_path / 'metrics.json'
+    run_metrics.save_json(str(metrics_path))
+    data = json.loads(metrics_path.read_text())
+    assert data['totals']['stability_trials'] == file_metrics.stability_trials
+    assert 'Stability:' in run_metrics.format_text()
+
+
+def test_batch_workers_add_file_metrics(disabled_metrics, config_paths, make_options):
+    options = make_options('--no-cache', '--seed', '1', '-r', '10', '-t', '100', '-j', '2',
+                           '--timings', quandary_paths=config_paths)
+    run_metrics = enable_metrics()
+    run_batch(options, ReportWriter('text', io.StringIO()))
+    assert [file_metrics.path for file_metrics in run_metrics.files] == config_paths
+    assert all(file_metrics.stability_trials > 0 for file_metrics in run_metrics.files)
@@ -0,0 +1,56 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Seeded stability results, with and without worker processes."""
+
+import pytest
+
+from quandary.analysis import resolve_quandary, run_stability_analysis, run_stability_shard
+
+
+@pytest.mark.parametrize('search_arguments', [dict(search='linear'),
+                                              dict(search='bisect', refine_trials=200),
+                                              dict(search='sweep'),
+                                              dict(search='linear', error_rate=0.05)])
+def test_jobs_do_not_change_results(medium_quandary, stability_settings, engine,
+                                    search_arguments):
+    # Worker processes may run extra steps past the boundary, but every step
+    # that both runs have must be the same.
+    results = resolve_quandary(medium_quandary)
+    single, multiple = [run_stability_analysis(medium_quandary, results, engine=engine, jobs=jobs,
+                                               **stability_settings, **search_arguments)
+                        for jobs in (1, 3)]
+    assert single.stability == multiple.stability
+    multiple_steps = {step.perturbation: step for step in multiple.steps}
+    for step in single.steps:
+        assert multiple_steps[step.perturbation] == step
+
+
+def test_jobs_do_not_change_shards(medium_quandary):
+    single, multiple = [run_stability_shard(medium_quandary, 2, 6, 101, 350, random_steps=20,
+                                            jobs=jobs, seed=5, top_k=1)
+                        for jobs in (1, 3)]
+    assert single == multiple
+
+
+def test_seed_reproduces_results(medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+    first, second = [run_stability_analysis(medium_quandary, results, **stability_settings)
+                     for _run in range(2)]
+    assert first == second
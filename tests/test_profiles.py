@@ -0,0 +1,81 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Priority profiles, compared to separate quandaries with each profile's priorities."""
+
+import random
+
+import pytest
+
+from benchmarks.generator import generate_quandary
+from quandary import vectorized
+from quandary.analysis import compile_quandary, resolve_quandary, run_stability_analysis
+from quandary.data import Quandary
+
+
+@pytest.fixture
+def profiles_quandary():
+    quandary = generate_quandary(5, 4, seed=6, unrated_fraction=0.2)
+    rng = random.Random(6)
+    profiles = {name: {letter: rng.random() for letter in quandary.criteria}
+                for name in ('alice', 'bob', 'carol')}
+    priorities = {letter: sum(profile[letter] for profile in profiles.values()) / len(profiles)
+                  for letter in quandary.criteria}
+    return Quandary(quandary.description, quandary.choices, quandary.criteria, priorities,
+                    profiles)
+
+
+def _profile_quandary(quandary, name):
+    return Quandary(quandary.description, quandary.choices, quandary.criteria,
+                    quandary.priority_profiles[name])
+
+
+def _rankings(choice_rankings):
+    return [(ranking.letter, pytest.approx(ranking.rating)) for ranking in choice_rankings]
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+def test_profile_rankings(profiles_quandary, monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(vectorized, 'numpy_available', lambda: False)
+    results = resolve_quandary(profiles_quandary)
+    assert list(results.profile_rankings) == ['alice', 'bob', 'carol']
+    for name, choice_rankings in results.profile_rankings.items():
+        expected = resolve_quandary(_profile_quandary(profiles_quandary, name)).choice_rankings
+        assert _rankings(choice_rankings) == _rankings(expected)
+    # Consensus rankings rank choices by their average profile rating.
+    for ranking in results.choice_rankings:
+        assert ranking.rating == pytest.approx(
+            sum(profile_ranking.rating
+                for profile_rankings in results.profile_rankings.values()
+                for profile_ranking in profile_rankings
+                if profile_ranking.letter == ranking.letter) / 3)
+
+
+def test_profile_stability(profiles_quandary, stability_settings):
+    stability_results = run_stability_analysis(profiles_quandary,
+                                               resolve_quandary(profiles_quandary),
+                                               **stability_settings)
+    for name, stability in stability_results.profile_stability.items():
+        profile_quandary = compile_quandary(_profile_quandary(profiles_quandary, name))
+        assert stability == run_stability_analysis(profile_quandary,
+                                                   resolve_quandary(profile_quandary),
+                                                   **stability_settings).stability
@@ -0,0 +1,92 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Rank statistics collected from the same trials as the stability steps."""
+
+import itertools
+import operator
+
+import pytest
+
+from quandary.analysis import resolve_quandary, run_stability_analysis
+from quandary.data import RankStatistics
+
+
+def _brute_force_statistics(compiled, perturbation):
+    # Every rated choice rating and priority is either lowered or raised.
+    choice_count = compiled.choice_count
+    rated_indexes = list(compiled.rated_indexes)
+    rank_statistics = RankStatistics.allocate(compiled.choice_letters)
+    for signs in itertools.product((-1, 1), repeat=len(rated_indexes) + compiled.criterion_count):
+        ratings = list(compiled.ratings)
+        for idx, sign in zip(rated_indexes, signs):
+            ratings[idx] = min(max(ratings[idx] + sign * perturbation, 0), 1)
+        priorities = [min(max(priority + sign * perturbation, 0), 1)
+                      for priority, sign in zip(compiled.priorities, signs[len(rated_indexes):])]
+        totals = [sum(map(operator.mul, ratings[choice_idx::choice_count], priorities))
+                  for choice_idx in range(choice_count)]
+        rank_statistics.add_trial(totals, sorted(range(choice_count), key=totals.__getitem__,
+                                                 reverse=True))
+    return rank_statistics
+
+
+def test_exact_statistics_match_brute_force(small_quandary, engine):
+    results = resolve_quandary(small_quandary)
+    stability_results = run_stability_analysis(small_quandary, results, engine=engine,
+                                               random_steps=10, seed=1, rank_statistics=True)
+    for step in stability_results.steps:
+        expected = _brute_force_statistics(small_quandary, step.perturbation)
+        assert step.rank_statistics.trial_count == expected.trial_count == step.trial_count
+        assert list(step.rank_statistics.rank_counts) == list(expected.rank_counts)
+        assert list(step.rank_statistics.total_sums) == pytest.approx(list(expected.total_sums))
+        assert (list(step.rank_statistics.total_squares)
+                == pytest.approx(list(expected.total_squares)))
+
+
+@pytest.mark.parametrize('search_arguments', [dict(search='linear'),
+                                              dict(search='linear', error_rate=0.05),
+                                              dict(search='bisect', refine_trials=200)])
+def test_random_statistics_count_every_trial(medium_quandary, stability_settings, engine,
+                                             search_arguments):
+    results = resolve_quandary(medium_quandary)
+    stability_results = run_stability_analysis(medium_quandary, results, engine=engine,
+                                               rank_statistics=True, **stability_settings,
+                                               **search_arguments)
+    choice_count = medium_quandary.choice_count
+    for step in stability_results.steps:
+        rank_statistics = step.rank_statistics
+        assert rank_statistics.trial_count == step.trial_count
+        # Every choice has one rank, and every rank one choice, in each trial.
+        for idx in range(choice_count):
+            assert sum(rank_statistics.rank_counts[idx * choice_count:
+                                                   (idx + 1) * choice_count]) == step.trial_count
+            assert sum(rank_statistics.rank_counts[idx::choice_count]) == step.trial_count
+    assert stability_results.rank_statistics_step.perturbation == pytest.approx(
+        max(stability_results.stability, stability_results.steps[0].perturbation))
+
+
+def test_statistics_do_not_change_stability(medium_quandary, stability_settings, engine):
+    results = resolve_quandary(medium_quandary)
+    plain, collected = [run_stability_analysis(medium_quandary, results, engine=engine,
+                                               rank_statistics=rank_statistics,
+                                               **stability_settings)
+                        for rank_statistics in (False, True)]
+    assert collected.stability == plain.stability
+    assert ([(step.changed_count, step.trial_count) for step in collected.steps]
+            == [(step.changed_count, step.trial_count) for step in plain.steps])
@@ -0,0 +1,80 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Machine-readable report formats, and their framing by the report writer."""
+
+import csv
+import io
+import json
+
+import pytest
+
+from quandary.analysis import resolve_quandary, run_stability_analysis
+from quandary.report import CSV_REPORT_COLUMNS, ReportWriter, format_report
+
+
+@pytest.fixture
+def reports(medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+    stability_results = run_stability_analysis(medium_quandary, results, **stability_settings)
+
+    def _reports(report_format, count):
+        stream = io.StringIO()
+        writer = ReportWriter(report_format, stream)
+        for idx in range(count):
+            writer.write(format_report(report_format, medium_quandary.quandary, results,
+                                       stability_results, details=True, top_k=1,
+                                       path=f'quandary{idx}.yaml'))
+        writer.close()
+        return stream.getvalue()
+
+    return _reports
+
+
+@pytest.mark.parametrize('count', [0, 1, 3])
+def test_json_and_ndjson_records_match(reports, count):
+    records = json.loads(reports('json', count))
+    assert records == [json.loads(line) for line in reports('ndjson', count).splitlines()]
+    assert [record['path'] for record in records] == [f'quandary{idx}.yaml'
+                                                      for idx in range(count)]
+
+
+@pytest.mark.parametrize('count', [0, 1, 3])
+def test_csv_rows_match_json(reports, count):
+    # The header row is written once, even without reports.
+    text = reports('csv', count)
+    assert next(csv.reader(io.StringIO(text))) == CSV_REPORT_COLUMNS
+    rows = list(csv.DictReader(io.StringIO(text)))
+    records = json.loads(reports('json', count))
+    assert [(row['path'], int(row['rank']), row['choice'], float(row['rating']))
+            for row in rows] == [(record['path'], ranking['rank'], ranking['choice'],
+                                  ranking['rating'])
+                                 for record in records
+                                 for ranking in record['rankings']]
+
+
+def test_json_confidence_and_steps(reports, medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+    stability_results = run_stability_analysis(medium_quandary, results, **stability_settings)
+    record = json.loads(reports('json', 1))[0]
+    assert record['confidence'] == stability_results.stability
+    assert [(step['perturbation'], step['changed'], step['trials'])
+            for step in record['stability_steps']] == [
+        (step.perturbation, step.changed_count, step.trial_count)
+        for step in stability_results.steps]
@@ -0,0 +1,81 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Compiled quandary resolution, compared to resolving the parsed data directly."""
+
+import math
+
+from benchmarks.generator import generate_quandary
+from quandary.analysis import compile_quandary, relabel_results, resolve_quandary
+from quandary.data import Criterion, Quandary
+
+
+def _resolve_directly(quandary):
+    # Sums of priority weighted ratings, with unrated choices contributing nothing.
+    totals = {choice_letter: sum(quandary.priority_ratings[criterion_letter]
+                                 * criterion.choice_ratings.get(choice_letter, 0)
+                                 for criterion_letter, criterion in quandary.criteria.items()
+                                 if criterion_letter in quandary.priority_ratings)
+              for choice_letter in quandary.choices}
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def test_resolution_matches_direct_totals():
+    for seed in range(10):
+        quandary = generate_quandary(7, 6, seed=seed, unrated_fraction=0.3)
+        choice_rankings = resolve_quandary(quandary).choice_rankings
+        expected = _resolve_directly(quandary)
+        assert [ranking.letter for ranking in choice_rankings] == [item[0] for item in expected]
+        for ranking, (choice_letter, total) in zip(choice_rankings, expected):
+            assert ranking.label == quandary.choices[choice_letter]
+            assert math.isclose(ranking.rating, total)
+
+
+def test_ties_keep_configuration_order():
+    quandary = Quandary('Ties',
+                        {'A': 'Choice A', 'B': 'Choice B', 'C': 'Choice C'},
+                        {'X': Criterion('X', {'A': 0.5, 'B': 1.0, 'C': 1.0}),
+                         'Y': Criterion('Y', {'A': 0.5})},
+                        {'X': 1.0})
+    choice_rankings = resolve_quandary(quandary).choice_rankings
+    assert [ranking.letter for ranking in choice_rankings] == ['B', 'C', 'A']
+    # Criteria without priorities are left out.
+    assert compile_quandary(quandary).criterion_letters == ['X']
+
+
+def test_compiled_quandary_resolves_the_same():
+    quandary = generate_quandary(5, 4, seed=3, unrated_fraction=0.2)
+    compiled = compile_quandary(quandary)
+    assert compile_quandary(compiled) is compiled
+    assert resolve_quandary(compiled) == resolve_quandary(quandary)
+
+
+def test_relabel_results():
+    quandary = generate_quandary(4, 3, seed=3)
+    results = resolve_quandary(quandary)
+    relabeled_quandary = Quandary(quandary.description,
+                                  {letter: f'New {label}'
+                                   for letter, label in quandary.choices.items()},
+                                  quandary.criteria,
+                                  quandary.priority_ratings)
+    relabeled = relabel_results(compile_quandary(relabeled_quandary), results)
+    assert ([(ranking.letter, ranking.rating) for ranking in relabeled.choice_rankings]
+            == [(ranking.letter, ranking.rating) for ranking in results.choice_rankings])
+    assert all(ranking.label == f'New {quandary.choices[ranking.letter]}'
+               for ranking in relabeled.choice_rankings)
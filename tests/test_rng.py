@@ -0,0 +1,50 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Seedable random streams."""
+
+import random
+
+import pytest
+
+from quandary.rng import RandomStream, SignBits
+
+
+def test_streams_are_reproducible():
+    stream = RandomStream(7).spawn(3, 1)
+    assert stream.python_random().random() == RandomStream(7, (3, 1)).python_random().random()
+    assert stream.python_random().random() != RandomStream(7, (3, 2)).python_random().random()
+    assert stream.python_random().random() != RandomStream(8, (3, 1)).python_random().random()
+
+
+def test_numpy_streams_are_reproducible():
+    pytest.importorskip('numpy')
+    stream = RandomStream(7).spawn(3, 1)
+    assert (list(stream.numpy_generator().integers(0, 1000, 5))
+            == list(RandomStream(7, (3, 1)).numpy_generator().integers(0, 1000, 5)))
+    assert (list(stream.numpy_generator().integers(0, 1000, 5))
+            != list(RandomStream(7, (3, 2)).numpy_generator().integers(0, 1000, 5)))
+
+
+def test_sign_bits():
+    sign_bits = SignBits(random.Random(1), 70)
+    draws = [sign_bits.draw() for _trial in range(200)]
+    assert all(len(signs) == 70 and set(signs) <= {'0', '1'} for signs in draws)
+    ones = sum(signs.count('1') for signs in draws)
+    assert 0.45 < ones / (70 * 200) < 0.55
@@ -0,0 +1,69 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Closed form sensitivity analysis, compared to changing values directly."""
+
+import pytest
+
+from quandary.analysis import _calculate_totals, _rank_choices, analyze_sensitivity
+
+
+def _top_ranking(compiled, top_k, criterion_letter, choice_letter, value):
+    # Ranking with one priority, or one choice rating, set to a new value.
+    ratings = list(compiled.ratings)
+    priorities = list(compiled.priorities)
+    criterion_idx = compiled.criterion_letters.index(criterion_letter)
+    if choice_letter is None:
+        priorities[criterion_idx] = value
+    else:
+        ratings[criterion_idx * compiled.choice_count
+                + compiled.choice_letters.index(choice_letter)] = value
+    ranking = _rank_choices(_calculate_totals(compiled.choice_count, ratings, priorities))
+    return ranking if top_k is None else ranking[:top_k]
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 2])
+def test_smallest_changes(small_quandary, top_k):
+    sensitivities = analyze_sensitivity(small_quandary, top_k)
+    assert len(sensitivities) == small_quandary.criterion_count + len(small_quandary.rated_indexes)
+    for sensitivity in sensitivities:
+        def _ranking(value, sensitivity=sensitivity):
+            return _top_ranking(small_quandary, top_k, sensitivity.criterion_letter,
+                                sensitivity.choice_letter, value)
+
+        original = _ranking(sensitivity.value)
+        if sensitivity.change is None:
+            # No possible value changes the rankings.
+            assert all(_ranking(step / 100) == original for step in range(101))
+            continue
+        # Slightly smaller changes in either direction keep the rankings, and
+        # slightly larger ones, if possible, change them.
+        for fraction in (-0.999, -0.5, 0.5, 0.999):
+            value = sensitivity.value + fraction * abs(sensitivity.change)
+            if 0 <= value <= 1:
+                assert _ranking(value) == original
+        value = sensitivity.value + 1.001 * sensitivity.change
+        if 0 <= value <= 1:
+            assert _ranking(value) != original
+
+
+def test_most_fragile_values_first(small_quandary):
+    changes = [abs(sensitivity.change) if sensitivity.change is not None else 2
+               for sensitivity in analyze_sensitivity(small_quandary)]
+    assert changes == sorted(changes)
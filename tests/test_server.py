@@ -0,0 +1,82 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Resolver service documents, request options, and socket paths."""
+
+import json
+import socket
+from http import HTTPStatus
+
+import pytest
+import yaml
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary.batch import process_quandary_file
+from quandary.server import _RequestError, _override_options, _remove_stale_socket, \
+    resolve_document
+from quandary.utility import QuandaryError
+
+
+def test_documents_resolve_like_files(tmp_path, make_options):
+    text = quandary_yaml(generate_quandary(4, 3, seed=1))
+    path = tmp_path / 'quandary.yaml'
+    path.write_text(text)
+    options = make_options('--no-cache', '--seed', '1', '-r', '10', '-t', '100', '-f', 'ndjson',
+                           '--sensitivity')
+    file_record = json.loads(''.join(process_quandary_file(str(path), options, 1)))
+    del file_record['path']
+    assert resolve_document(yaml.safe_load(text), options) == file_record
+
+
+def test_request_options(make_options):
+    options = make_options('-k', '2')
+    overridden = _override_options(options, 'engine=python&random_trials=50&seed=3&top_k=0')
+    assert (overridden.engine, overridden.random_trials, overridden.seed, overridden.top_k) == (
+        'python', 50, 3, None)
+    assert _override_options(options, '') is options
+    for query in ('engine=fortran', 'seed=x', 'random_steps=0', 'colour=blue'):
+        with pytest.raises(_RequestError) as exc_info:
+            _override_options(options, query)
+        assert exc_info.value.status == HTTPStatus.BAD_REQUEST
+
+
+def test_stale_sockets_are_replaced(tmp_path):
+    # Unix socket paths are limited to about 100 characters.
+    socket_path = str(tmp_path / 's')
+    _remove_stale_socket(socket_path)
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    _remove_stale_socket(socket_path)
+    assert not (tmp_path / 's').exists()
+
+
+def test_other_files_are_kept(tmp_path):
+    file_path = tmp_path / 'file'
+    file_path.write_text('keep me')
+    with pytest.raises(QuandaryError, match='not a socket'):
+        _remove_stale_socket(str(file_path))
+    assert file_path.read_text() == 'keep me'
+    socket_path = str(tmp_path / 's')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(socket_path)
+        listener.listen()
+        with pytest.raises(QuandaryError, match='already listening'):
+            _remove_stale_socket(socket_path)
+    assert (tmp_path / 's').exists()
@@ -0,0 +1,118 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Sharded stability runs, merged from different splits of steps and trials."""
+
+import dataclasses
+
+import pytest
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary.analysis import merge_stability_steps, run_stability_shard
+from quandary.data import StabilityShard, StabilityStep
+from quandary.shard import load_shard, merge_shard_files, merge_shards, run_shard, save_shard
+from quandary.utility import QuandaryError
+
+RANDOM_STEPS = 10
+RANDOM_TRIALS = 250
+
+
+def _shard(compiled, first_step, last_step, first_trial, last_trial, **kwargs):
+    steps = run_stability_shard(compiled, first_step, last_step, first_trial, last_trial,
+                                random_steps=RANDOM_STEPS, seed=5, top_k=1, **kwargs)
+    return StabilityShard('fingerprint', RANDOM_STEPS, RANDOM_TRIALS, 5, 'python', 1,
+                          first_trial, last_trial, steps)
+
+
+def test_splits_merge_the_same(medium_quandary):
+    single = merge_shards([_shard(medium_quandary, 1, RANDOM_STEPS, 1, RANDOM_TRIALS)])
+    by_steps = merge_shards([_shard(medium_quandary, 1, 4, 1, RANDOM_TRIALS),
+                             _shard(medium_quandary, 5, RANDOM_STEPS, 1, RANDOM_TRIALS)])
+    by_trials = merge_shards([_shard(medium_quandary, 1, RANDOM_STEPS, 201, RANDOM_TRIALS),
+                              _shard(medium_quandary, 1, RANDOM_STEPS, 1, 100),
+                              _shard(medium_quandary, 1, RANDOM_STEPS, 101, 200, jobs=2)])
+    assert single == by_steps == by_trials
+    assert [step.trial_count for step in single.values()] == [RANDOM_TRIALS] * RANDOM_STEPS
+
+
+def test_merged_stability(medium_quandary):
+    steps = merge_shards([_shard(medium_quandary, 1, RANDOM_STEPS, 1, RANDOM_TRIALS)])
+    stability_results = merge_stability_steps(steps, RANDOM_STEPS, 50)
+    stable_step = round(stability_results.stability * RANDOM_STEPS)
+    for random_step in range(1, stable_step + 1):
+        assert steps[random_step].changed_count / RANDOM_TRIALS < 0.5
+    if stable_step < RANDOM_STEPS:
+        assert steps[stable_step + 1].changed_count / RANDOM_TRIALS >= 0.5
+    # Steps after the first unstable step may be missing.
+    partial_steps = {random_step: step for random_step, step in steps.items()
+                     if random_step <= stable_step + 1}
+    assert merge_stability_steps(partial_steps, RANDOM_STEPS, 50) == dataclasses.replace(
+        stability_results, steps=list(partial_steps.values()))
+
+
+def _fake_shard(first_trial, last_trial, **kwargs):
+    trial_count = last_trial - first_trial + 1
+    return dataclasses.replace(
+        StabilityShard('fingerprint', 2, 200, 5, 'python', None, first_trial, last_trial,
+                       {random_step: StabilityStep(random_step / 2, 1, trial_count)
+                        for random_step in (1, 2)}),
+        **kwargs)
+
+
+@pytest.mark.parametrize('shards, message', [
+    ([], 'No shard'),
+    ([_fake_shard(1, 100), _fake_shard(101, 200, seed=6)], '"seed"'),
+    ([_fake_shard(1, 100), _fake_shard(101, 200, engine='numpy')], '"engine"'),
+    ([_fake_shard(1, 100), _fake_shard(101, 200, top_k=1)], '"top_k"'),
+    ([_fake_shard(1, 100), _fake_shard(101, 200, fingerprint='other')], '"fingerprint"'),
+    ([_fake_shard(1, 150), _fake_shard(101, 200)], 'overlapping'),
+    ([_fake_shard(1, 100), _fake_shard(151, 200)], 'missing shard trials from 101'),
+    ([_fake_shard(1, 100)], 'missing shard trials from 101'),
+])
+def test_mismatched_shards(shards, message):
+    with pytest.raises(QuandaryError, match=message):
+        merge_shards(shards)
+
+
+def test_shard_ranges(medium_quandary):
+    for first_step, last_step, first_trial, last_trial in ((0, 2, 1, 100), (1, 11, 1, 100),
+                                                          (1, 2, 50, 100), (1, 2, 101, 100)):
+        with pytest.raises(QuandaryError):
+            run_stability_shard(medium_quandary, first_step, last_step, first_trial, last_trial,
+                                random_steps=RANDOM_STEPS)
+    with pytest.raises(QuandaryError, match='missing'):
+        merge_stability_steps({1: StabilityStep(0.1, 0, 100)}, RANDOM_STEPS)
+
+
+def test_shard_files(tmp_path, make_options):
+    config_path = tmp_path / 'quandary.yaml'
+    config_path.write_text(quandary_yaml(generate_quandary(5, 4, seed=4)))
+    options = make_options('--no-cache', '--seed', '5', '-r', '10', '-t', '250', '-s', '50',
+                           '-f', 'json')
+    shard_paths = []
+    for first_trial, last_trial in ((1, 100), (101, 250)):
+        shard = run_shard(str(config_path), options, 1, 10, first_trial, last_trial)
+        shard_path = str(tmp_path / f'shard{first_trial}.json')
+        save_shard(shard_path, shard)
+        assert load_shard(shard_path) == shard
+        shard_paths.append(shard_path)
+    assert '"confidence"' in merge_shard_files(str(config_path), shard_paths, options)
+    config_path.write_text(quandary_yaml(generate_quandary(5, 4, seed=5)))
+    with pytest.raises(QuandaryError, match='different quandary'):
+        merge_shard_files(str(config_path), shard_paths, options)
@@ -0,0 +1,70 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Streaming stability progress, compared to the full analysis."""
+
+import asyncio
+import threading
+
+from quandary.analysis import (iterate_stability, iterate_stability_async, resolve_quandary,
+                               run_stability_analysis)
+
+
+def test_progress_matches_linear_analysis(medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+    stability_results = run_stability_analysis(medium_quandary, results, **stability_settings)
+    progress = list(iterate_stability(medium_quandary, results, **stability_settings))
+    assert [record.random_step for record in progress] == list(range(1, len(progress) + 1))
+    assert [record.finished for record in progress] == [False] * (len(progress) - 1) + [True]
+    assert progress[-1].stability == stability_results.stability
+    assert ([(record.changed_fraction, record.trial_count) for record in progress]
+            == [(step.changed_count / step.trial_count, step.trial_count)
+                for step in stability_results.steps])
+
+
+def test_cancel_stops_before_next_step(medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+    cancel = threading.Event()
+    progress = []
+    for record in iterate_stability(medium_quandary, results, cancel=cancel,
+                                    **stability_settings):
+        progress.append(record)
+        cancel.set()
+    assert len(progress) == 1
+
+
+def test_async_progress_matches(medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+
+    async def _collect(limit):
+        progress = []
+        async for record in iterate_stability_async(medium_quandary, results,
+                                                    **stability_settings):
+            progress.append(record)
+            if len(progress) == limit:
+                break
+        return progress
+
+    expected = list(iterate_stability(medium_quandary, results, **stability_settings))
+    progress = asyncio.run(_collect(None))
+    assert [(record.random_step, record.changed_fraction, record.stability, record.finished)
+            for record in progress] == [
+        (record.random_step, record.changed_fraction, record.stability, record.finished)
+        for record in expected]
+    assert len(asyncio.run(_collect(2))) == 2
@@ -0,0 +1,55 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Sweeps of all steps with the same random signs."""
+
+import pytest
+
+from quandary.analysis import (_create_stability_engine, resolve_quandary,
+                               run_stability_analysis)
+from quandary.rng import RandomStream
+
+PERTURBATIONS = [step / 20 for step in range(1, 21)]
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 3])
+def test_sweep_matches_separate_counts(medium_quandary, engine, top_k):
+    # Each count starts over with the same stream, so that it has the same
+    # signs as the sweep, including values that get clamped at 0 or 1.
+    trials = 300
+    stream = RandomStream(5).spawn(0, 1)
+    sweep_engine = _create_stability_engine(engine, medium_quandary, top_k)
+    sweep_engine.set_stream(stream)
+    changed_counts = sweep_engine.sweep_changed(PERTURBATIONS, trials)
+    count_engine = _create_stability_engine(engine, medium_quandary, top_k)
+    expected = []
+    for perturbation in PERTURBATIONS:
+        count_engine.set_stream(stream)
+        expected.append(count_engine.count_changed(perturbation, trials))
+    assert changed_counts == expected
+
+
+def test_sweep_stability_is_close_to_linear(medium_quandary, stability_settings, engine):
+    settings = dict(stability_settings, random_trials=2000)
+    results = resolve_quandary(medium_quandary)
+    linear, sweep = [run_stability_analysis(medium_quandary, results, engine=engine,
+                                            search=search, **settings)
+                     for search in ('linear', 'sweep')]
+    assert len(sweep.steps) == settings['random_steps']
+    assert abs(sweep.stability - linear.stability) <= 0.1
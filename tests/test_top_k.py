@@ -0,0 +1,39 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Top K order checks, compared to ranking all choices."""
+
+import random
+
+import pytest
+
+from quandary.analysis import _order_changed, _order_checks, _rank_choices
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 2, 3, 5, 8])
+def test_order_checks_match_rankings(top_k):
+    # Small integer totals have many ties, which are ranked in choice order.
+    rng = random.Random(top_k)
+    for _trial in range(2000):
+        choice_count = rng.randint(1, 6)
+        original = _rank_choices([rng.randint(0, 3) for _ in range(choice_count)])
+        totals = [rng.randint(0, 3) for _ in range(choice_count)]
+        top_count = choice_count if top_k is None else top_k
+        assert (_order_changed(totals, _order_checks(original, top_k))
+                == (_rank_choices(totals)[:top_count] != original[:top_count]))
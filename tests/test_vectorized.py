@@ -0,0 +1,67 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""NumPy stability engine, compared to the Python engine."""
+
+import pytest
+
+from quandary.analysis import (_create_stability_engine, resolve_quandary,
+                               run_stability_analysis)
+from quandary.rng import RandomStream
+
+pytest.importorskip('numpy')
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 2])
+def test_exact_counts_match(small_quandary, top_k):
+    python_engine = _create_stability_engine('python', small_quandary, top_k)
+    numpy_engine = _create_stability_engine('numpy', small_quandary, top_k)
+    for perturbation in (0.05, 0.2, 0.5, 1.0):
+        assert python_engine.count_all(perturbation) == numpy_engine.count_all(perturbation)
+
+
+def test_trial_counts_agree(medium_quandary):
+    # The engines draw different random signs from the same stream, so only
+    # the changed fractions agree, within sampling error.
+    trials = 4000
+    for perturbation, top_k in ((0.1, None), (0.3, 1)):
+        fractions = []
+        for engine_name in ('python', 'numpy'):
+            engine = _create_stability_engine(engine_name, medium_quandary, top_k)
+            engine.set_stream(RandomStream(5).spawn(1))
+            fractions.append(engine.count_changed(perturbation, trials) / trials)
+        assert abs(fractions[0] - fractions[1]) < 0.05
+
+
+def test_same_stream_is_reproducible(medium_quandary):
+    counts = []
+    for _run in range(2):
+        engine = _create_stability_engine('numpy', medium_quandary, None)
+        engine.set_stream(RandomStream(5).spawn(1))
+        counts.append(engine.count_changed(0.2, 3000))
+    assert counts[0] == counts[1]
+
+
+def test_stability_agrees(medium_quandary, stability_settings):
+    results = resolve_quandary(medium_quandary)
+    stabilities = [run_stability_analysis(medium_quandary, results, engine=engine_name,
+                                          **dict(stability_settings, random_trials=2000)).stability
+                   for engine_name in ('python', 'numpy')]
+    assert stabilities[0] > 0
+    assert abs(stabilities[0] - stabilities[1]) <= 0.1
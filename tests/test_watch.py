@@ -0,0 +1,105 @@
+# Copyright (C) 2022, Steven Cooper
+#
+# This file is part of Quandary.
+#
+# Quandary is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Quandary is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Quandary.  If not, see <https://www.gnu.org/licenses/>.
+
+
+
+"""Watch mode checks for changed quandary files."""
+
+import io
+import os
+
+import pytest
+
+from benchmarks.generator import generate_quandary, quandary_yaml
+from quandary import watch
+from quandary.report import ReportWriter
+from quandary.watch import QuandaryWatcher
+
+
+def _write(path, text, mtime_ns):
+    # Explicit modification times, since a rewrite may not change the clock.
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def watcher(tmp_path, make_options):
+    _write(tmp_path / 'a.yaml', quandary_yaml(generate_quandary(4, 3, seed=1)), 1)
+    _write(tmp_path / 'b.yaml', quandary_yaml(generate_quandary(4, 3, seed=2)), 1)
+    (tmp_path / 'notes.txt').write_text('not a quandary')
+    options = make_options('--no-cache', '--seed', '1', '-r', '10', '-t', '100', '-f', 'ndjson',
+                           quandary_paths=[str(tmp_path)])
+    return QuandaryWatcher(options, ReportWriter('ndjson', io.StringIO()))
+
+
+@pytest.fixture
+def analysis_count(monkeypatch):
+    counts = {'analyses': 0}
+    analyze_quandary = watch.analyze_quandary
+
+    def _count_analysis(*arguments):
+        counts['analyses'] += 1
+        return analyze_quandary(*arguments)
+
+    monkeypatch.setattr(watch, 'analyze_quandary', _count_analysis)
+    return counts
+
+
+def test_only_changed_files_refresh(tmp_path, watcher, analysis_count):
+    assert watcher.check() == 2
+    assert watcher.check() == 0
+    # Same content with a new modification time.
+    _write(tmp_path / 'a.yaml', (tmp_path / 'a.yaml').read_text(), 2)
+    assert watcher.check() == 0
+    _write(tmp_path / 'b.yaml', quandary_yaml(generate_quandary(4, 3, seed=3)), 2)
+    assert watcher.check() == 1
+    assert analysis_count['analyses'] == 3
+    assert len(watcher.writer.stream.getvalue().splitlines()) == 3
+
+
+def test_relabeling_reuses_analysis(tmp_path, watcher, analysis_count):
+    watcher.check()
+    text = (tmp_path / 'a.yaml').read_text()
+    _write(tmp_path / 'a.yaml', text.replace('Choice A', 'Renamed A'), 2)
+    assert watcher.check() == 1
+    assert analysis_count['analyses'] == 2
+    assert 'Renamed A' in watcher.writer.stream.getvalue().splitlines()[-1]
+    assert len(watcher.watched_files[str(tmp_path / 'a.yaml')].analyses) == 1
+
+
+def test_failures_do_not_stop_watching(tmp_path, watcher, monkeypatch, capsys):
+    _write(tmp_path / 'a.yaml', 'quandary: [\n', 1)
+    assert watcher.check() == 1
+    assert 'a.yaml' in capsys.readouterr().err
+
+    def _fail(*_arguments):
+        raise RuntimeError('unexpected')
+
+    _write(tmp_path / 'b.yaml', quandary_yaml(generate_quandary(4, 3, seed=3)), 2)
+    monkeypatch.setattr(watch, 'analyze_quandary', _fail)
+    assert watcher.check() == 0
+    assert 'RuntimeError: unexpected' in capsys.readouterr().err
+    monkeypatch.undo()
+    _write(tmp_path / 'a.yaml', quandary_yaml(generate_quandary(4, 3, seed=1)), 3)
+    assert watcher.check() == 1
+
+
+def test_removed_files_are_forgotten(tmp_path, watcher):
+    watcher.check()
+    os.remove(tmp_path / 'b.yaml')
+    assert watcher.check() == 0
+    assert list(watcher.watched_files) == [str(tmp_path / 'a.yaml')]